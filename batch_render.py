@@ -0,0 +1,73 @@
+import argparse
+import importlib
+from src.batch_renderer import BatchRenderer
+
+
+DENOISERS = {
+    "MeanPixel": "src.denoiser.mean_pixel",
+    "MedianPixel": "src.denoiser.median_pixel",
+    "CnnAutoencoder": "src.denoiser.cnn"}
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(
+            description="Renders a camera path to image files without a GUI")
+
+    parser.add_argument("--w", type=int, default=300)
+    parser.add_argument("--h", type=int, default=300)
+    parser.add_argument("--noise", type=int, default=1)
+    parser.add_argument("--scene", type=str, default="scenes/scene.json")
+    parser.add_argument("--obj", type=str, default=None)
+    parser.add_argument("--camera-path", type=str, default=None,
+                        help="JSON list of camera keyframes (default: "
+                        "the --animation key sequence)")
+    parser.add_argument("--start", type=int, default=0)
+    parser.add_argument("--end", type=int, default=None,
+                        help="Last frame, exclusive (default: end of path)")
+    parser.add_argument("--output", type=str, default="frames")
+    parser.add_argument("--format", choices=["png", "exr"], default="png")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Encoder processes (default: CPU count)")
+    parser.add_argument("--denoiser", choices=sorted(DENOISERS),
+                        default=None)
+    parser.add_argument("--brute-force", action="store_true",
+                        help="Test every triangle instead of using the BVH")
+    parser.add_argument("--pipeline-depth", type=int, default=2)
+    parser.add_argument("--samples", type=int, default=1,
+                        help="Antialiasing rays per pixel")
+    parser.add_argument("--wavefront", action="store_true",
+                        help="Trace with a kernel per bounce stage instead "
+                        "of one kernel per pixel")
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = get_args()
+    if args.denoiser:
+        # registers the class, the CNN one pulls in keras
+        importlib.import_module(DENOISERS[args.denoiser])
+
+    renderer = BatchRenderer(
+        "kernels/raytracer.cl",
+        args.scene,
+        args.w,
+        args.h,
+        args.noise,
+        args.obj,
+        args.camera_path,
+        args.output,
+        args.format,
+        args.workers,
+        args.denoiser,
+        not args.brute_force,
+        args.pipeline_depth,
+        args.samples,
+        args.wavefront)
+    renderer.run(args.start, args.end)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import datetime
+
+import pyopencl as cl
+
+from src.objects.camera import Camera
+from src.opencl_connector import Connector
+from src.scene import Scene
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(
+        description="Compare kernel sources rendering the same scene")
+
+    parser.add_argument("kernels", nargs="+",
+                        help="Kernel sources, e.g. an older revision saved "
+                        "with git show")
+    parser.add_argument("--w", type=int, default=300)
+    parser.add_argument("--h", type=int, default=300)
+    parser.add_argument("--scene", type=str, default="scenes/scene.json")
+    parser.add_argument("--obj", type=str, default=None)
+    parser.add_argument("--samples", type=int, default=1)
+    parser.add_argument("--frames", type=int, default=20)
+
+    return parser.parse_args()
+
+
+def load_scene(args):
+
+    scene = Scene(None, None)
+    scene.load_from_json(args.scene)
+    if args.obj:
+        scene.load_from_mesh(args.obj)
+    scene.add_object(Camera(args.w, args.h))
+    return scene
+
+
+def measure(filename, args):
+
+    connector = Connector(
+        filename, load_scene(args), args.w, args.h, 1, samples=args.samples)
+    device = connector.device[0]
+    info = cl.kernel_work_group_info
+    # OpenCL has no occupancy query, private memory per work-item is what
+    # limits it and drivers lower the work-group limit when it grows
+    private = connector.kernel.get_work_group_info(
+        info.PRIVATE_MEM_SIZE, device)
+    group = connector.kernel.get_work_group_info(info.WORK_GROUP_SIZE, device)
+
+    # the first frame pays for lazy allocations in the driver
+    connector.run()
+    connector.get_result(True)
+
+    kernel_time = 0
+    start = datetime.datetime.now()
+    for _ in range(args.frames):
+        connector.run()
+        connector.get_result(True)
+        kernel_time += sum(
+            (event.profile.end - event.profile.start) * 1e-9
+            for _, event, _ in connector.last_tiles)
+    total = (datetime.datetime.now() - start).total_seconds()
+
+    rays = args.w * args.h * args.samples * args.frames
+    return private, group, total / args.frames, rays / kernel_time
+
+
+def main():
+
+    args = get_args()
+    results = [(filename, measure(filename, args))
+               for filename in args.kernels]
+
+    print()
+    print("{:<30} {:>10} {:>10} {:>10} {:>14}".format(
+        "kernel", "private B", "group", "ms/frame", "Mrays/s"))
+    for filename, (private, group, frame, rays) in results:
+        print("{:<30} {:>10} {:>10} {:>10.2f} {:>14.2f}".format(
+            filename, private, group, frame * 1000, rays / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import datetime
+import json
+
+import numpy as np
+
+from src.objects.base import BaseObject
+from src.objects.camera import Camera
+from src.objects.light import Light
+from src.opencl_connector import Connector
+from src.scene import Scene
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(
+        description="Frame time against the number of lights, with and "
+        "without the light grid")
+
+    parser.add_argument("--w", type=int, default=300)
+    parser.add_argument("--h", type=int, default=300)
+    parser.add_argument("--scene", type=str, default="scenes/scene.json",
+                        help="Geometry to light, its own lights are dropped")
+    parser.add_argument("--obj", type=str, default=None)
+    parser.add_argument("--lights", type=int, nargs="+",
+                        default=[1, 4, 16, 64, 256, 1024])
+    parser.add_argument("--radius", type=float, default=3,
+                        help="Radius of every generated light")
+    parser.add_argument("--extent", type=float, default=20,
+                        help="Side of the box the lights are scattered in")
+    parser.add_argument("--frames", type=int, default=10)
+
+    return parser.parse_args()
+
+
+def load_scene(args, n_lights):
+
+    scene = Scene(None, None)
+    with open(args.scene) as f:
+        data = json.load(f)
+    for name, objects in data.items():
+        if name != "Light":
+            for obj in objects:
+                scene.add_object(BaseObject.create(name, obj))
+    if args.obj:
+        scene.load_from_mesh(args.obj)
+
+    # same lights for every run of a given count
+    random = np.random.RandomState(n_lights)
+    for _ in range(n_lights):
+        scene.add_object(Light(
+            (random.rand(3) - 0.5) * args.extent,
+            random.rand(3) * 0.1,
+            random.rand(3),
+            random.rand(3),
+            args.radius))
+    scene.add_object(Camera(args.w, args.h))
+    return scene
+
+
+def measure(args, n_lights, cull_lights):
+
+    connector = Connector(
+        "kernels/raytracer.cl", load_scene(args, n_lights), args.w, args.h,
+        1, cull_lights=cull_lights)
+    connector.run()
+    connector.get_result(True)
+
+    start = datetime.datetime.now()
+    for _ in range(args.frames):
+        connector.run()
+        connector.get_result(True)
+    total = (datetime.datetime.now() - start).total_seconds()
+    return total / args.frames
+
+
+def main():
+
+    args = get_args()
+    results = [(n, measure(args, n, False), measure(args, n, True))
+               for n in args.lights]
+
+    print()
+    print("{:>8} {:>14} {:>14} {:>10}".format(
+        "lights", "all ms/frame", "grid ms/frame", "speedup"))
+    for n, flat, grid in results:
+        print("{:>8} {:>14.2f} {:>14.2f} {:>10.2f}".format(
+            n, flat * 1000, grid * 1000, flat / grid))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import contextlib
+import datetime
+import io
+import sys
+
+import numpy as np
+from PIL import Image
+
+from src.numpy_connector import NumpyConnector
+from src.objects.camera import Camera
+from src.scene import Scene
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(
+        description="Render with the NumPy reference and check the OpenCL "
+        "kernel against it")
+
+    parser.add_argument("--w", type=int, default=300)
+    parser.add_argument("--h", type=int, default=300)
+    parser.add_argument("--scene", type=str, default="scenes/scene.json")
+    parser.add_argument("--obj", type=str, default=None)
+    parser.add_argument("--position", type=float, nargs=3, default=[0, 1, 1])
+    parser.add_argument("--direction", type=float, nargs=3,
+                        default=[0, 0, -1])
+    parser.add_argument("--samples", type=int, default=1)
+    parser.add_argument("--brute-force", action="store_true")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Save the reference image")
+    parser.add_argument("--tolerance", type=int, default=2,
+                        help="Largest difference of a channel that counts "
+                        "as equal")
+    parser.add_argument("--max-differing", type=float, default=0.001,
+                        help="Fail when a larger fraction of the pixels "
+                        "differs")
+
+    return parser.parse_args()
+
+
+def load_scene(args):
+
+    scene = Scene(None, None)
+    scene.load_from_json(args.scene)
+    if args.obj:
+        scene.load_from_mesh(args.obj)
+    scene.add_object(Camera(
+        args.w, args.h, position=args.position, direction=args.direction))
+    return scene
+
+
+def render(connector):
+
+    start = datetime.datetime.now()
+    connector.run()
+    image = connector.get_result(True).copy()
+    return image, (datetime.datetime.now() - start).total_seconds()
+
+
+def main():
+
+    args = get_args()
+    with contextlib.redirect_stdout(io.StringIO()):
+        scene = load_scene(args)
+    reference, reference_time = render(NumpyConnector(
+        scene, args.w, args.h, 1, not args.brute_force, args.samples))
+    print("NumPy: {:.2f} s".format(reference_time))
+    if args.output:
+        Image.fromarray(reference.reshape(args.h, args.w, 3)).save(
+            args.output)
+
+    try:
+        import pyopencl as cl
+        cl.get_platforms()
+    except Exception as e:
+        print("No OpenCL platform, nothing to compare against:", e)
+        return
+
+    from src.opencl_connector import Connector
+    with contextlib.redirect_stdout(io.StringIO()):
+        connector = Connector(
+            "kernels/raytracer.cl", scene, args.w, args.h, 1,
+            not args.brute_force, samples=args.samples)
+    render(connector)
+    image, kernel_time = render(connector)
+    print("OpenCL: {:.4f} s".format(kernel_time))
+
+    difference = np.abs(
+        image.astype(np.int32) - reference).reshape(-1, 3).max(axis=1)
+    differing = np.mean(difference > args.tolerance)
+    print("Largest difference: {}, mean: {:.4f}, pixels off by more than "
+          "{}: {:.4%}".format(difference.max(), difference.mean(),
+                              args.tolerance, differing))
+    if differing > args.max_differing:
+        print("The kernel differs from the reference")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
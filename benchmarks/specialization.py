@@ -0,0 +1,83 @@
+import argparse
+import contextlib
+import datetime
+import glob
+import io
+
+import numpy as np
+
+from src.objects.camera import Camera
+from src.opencl_connector import Connector
+from src.scene import Scene
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(
+        description="Kernels built for the features of each scene against "
+        "the generic kernel")
+
+    parser.add_argument("scenes", nargs="*",
+                        help="Scene files, every bundled one by default")
+    parser.add_argument("--w", type=int, default=300)
+    parser.add_argument("--h", type=int, default=300)
+    parser.add_argument("--obj", type=str, default=None,
+                        help="Mesh added to every scene")
+    parser.add_argument("--samples", type=int, default=1)
+    parser.add_argument("--frames", type=int, default=20)
+
+    return parser.parse_args()
+
+
+def load_scene(args, filename):
+
+    scene = Scene(None, None)
+    scene.load_from_json(filename)
+    if args.obj:
+        scene.load_from_mesh(args.obj)
+    scene.add_object(Camera(args.w, args.h))
+    return scene
+
+
+def measure(args, scene, specialize):
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        connector = Connector(
+            "kernels/raytracer.cl", scene, args.w, args.h, 1,
+            samples=args.samples, specialize=specialize)
+    connector.run()
+    image = connector.get_result(True).copy()
+
+    start = datetime.datetime.now()
+    for _ in range(args.frames):
+        connector.run()
+        connector.get_result(True)
+    total = (datetime.datetime.now() - start).total_seconds()
+    return connector, total / args.frames, image
+
+
+def main():
+
+    args = get_args()
+    print("{:<32} {:>10} {:>10} {:>8} {:>9}  {}".format(
+        "scene", "generic", "special", "speedup", "max diff", "features"))
+    for filename in args.scenes or sorted(glob.glob("scenes/*.json")):
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                scene = load_scene(args, filename)
+        except Exception as e:
+            print("{:<32} could not be loaded: {!r}".format(filename, e))
+            continue
+
+        _, generic, reference = measure(args, scene, False)
+        connector, special, image = measure(args, scene, True)
+        features = [name for name, present in connector.features.items()
+                    if present]
+        print("{:<32} {:>8.2f}ms {:>8.2f}ms {:>7.2f}x {:>9}  {}".format(
+            filename, generic * 1000, special * 1000, generic / special,
+            np.abs(image.astype(np.int32) - reference).max(),
+            " ".join(features) or "none"))
+
+
+if __name__ == "__main__":
+    main()
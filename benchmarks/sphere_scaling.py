@@ -0,0 +1,103 @@
+import argparse
+import contextlib
+import datetime
+import io
+
+import numpy as np
+
+from src.material import Material
+from src.objects.camera import Camera
+from src.objects.light import Light
+from src.objects.sphere import Sphere
+from src.opencl_connector import Connector
+from src.scene import Scene
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(
+        description="Frame time against the number of spheres in a cube of "
+        "spheres, with the sphere grid and without it")
+
+    parser.add_argument("--w", type=int, default=300)
+    parser.add_argument("--h", type=int, default=300)
+    parser.add_argument("--sides", type=int, nargs="+",
+                        default=[10, 20, 40, 64, 100],
+                        help="Spheres per side of the cube")
+    parser.add_argument("--max-brute-force", type=int, default=20,
+                        help="Largest side also rendered without the grid")
+    parser.add_argument("--frames", type=int, default=10)
+
+    return parser.parse_args()
+
+
+def load_scene(args, side):
+
+    # same layout as scene_generator.py cube_of_spheres
+    scene = Scene(None, None)
+    distance = 2.5
+    random = np.random.RandomState(side)
+    materials = [
+        Material(color, color, [0.3, 0.3, 0.3], transparency=0)
+        for color in random.rand(8, 3).tolist()]
+    coords = (np.arange(side) - (side - 1) / 2) * distance
+    x, y, z = np.meshgrid(coords, coords, coords, indexing="ij")
+    centers = np.stack([x, y, z], axis=-1).reshape(-1, 3).tolist()
+    for i, center in enumerate(centers):
+        scene.add_object(Sphere(materials[i % len(materials)], center, 1))
+
+    extent = side * distance
+    scene.add_object(Light(
+        [extent, extent, extent], [0.1] * 3, [0.6] * 3, [0.4] * 3))
+    # the whole cube in view, most rays hit the nearest face
+    scene.add_object(Camera(
+        args.w, args.h, position=[0, 0, extent * 1.2],
+        direction=[0, 0, -1], z_far=extent * 3))
+    return scene
+
+
+def measure(args, scene, use_bvh):
+
+    start = datetime.datetime.now()
+    with contextlib.redirect_stdout(io.StringIO()):
+        connector = Connector(
+            "kernels/raytracer.cl", scene, args.w, args.h, 1, use_bvh)
+    setup = (datetime.datetime.now() - start).total_seconds()
+    connector.run()
+    connector.get_result(True)
+
+    start = datetime.datetime.now()
+    for _ in range(args.frames):
+        connector.run()
+        connector.get_result(True)
+    total = (datetime.datetime.now() - start).total_seconds()
+    return setup, total / args.frames
+
+
+def main():
+
+    args = get_args()
+    results = []
+    for side in args.sides:
+        scene = load_scene(args, side)
+        setup, grid = measure(args, scene, True)
+        brute = None
+        if side <= args.max_brute_force:
+            _, brute = measure(args, scene, False)
+        print("{} spheres: setup {:.2f}s".format(side ** 3, setup))
+        results.append((side ** 3, setup, grid, brute))
+
+    rays = args.w * args.h
+    print()
+    print("{:>10} {:>10} {:>14} {:>10} {:>15} {:>10}".format(
+        "spheres", "setup s", "grid ms/frame", "Mrays/s",
+        "brute ms/frame", "speedup"))
+    for n, setup, grid, brute in results:
+        print("{:>10} {:>10.2f} {:>14.2f} {:>10.2f} {:>15} {:>10}".format(
+            n, setup, grid * 1000, rays / grid / 1e6,
+            "{:.2f}".format(brute * 1000) if brute else "-",
+            "{:.1f}".format(brute / grid) if brute else "-"))
+
+
+if __name__ == "__main__":
+    main()
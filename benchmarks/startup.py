@@ -0,0 +1,111 @@
+import argparse
+import contextlib
+import datetime
+import glob
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from src.objects.camera import Camera
+from src.opencl_connector import Connector
+from src.scene import Scene
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(
+        description="Startup time with an empty and a filled kernel cache")
+
+    parser.add_argument("--w", type=int, default=300)
+    parser.add_argument("--h", type=int, default=300)
+    parser.add_argument("--scene", type=str, default="scenes/scene.json")
+    parser.add_argument("--obj", type=str, default=None)
+    parser.add_argument("--runs", type=int, default=3,
+                        help="Warm starts, the median is reported")
+    parser.add_argument("--child", action="store_true",
+                        help=argparse.SUPPRESS)
+
+    return parser.parse_args()
+
+
+def seconds_since(start):
+    return (datetime.datetime.now() - start).total_seconds()
+
+
+def start_up(args):
+
+    # the phases of one start, in this process
+    phases = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = datetime.datetime.now()
+        scene = Scene(None, None)
+        scene.load_from_json(args.scene)
+        if args.obj:
+            scene.load_from_mesh(args.obj)
+        scene.add_object(Camera(args.w, args.h))
+        phases["scene"] = seconds_since(start)
+
+        start = datetime.datetime.now()
+        connector = Connector(
+            "kernels/raytracer.cl", scene, args.w, args.h, 1)
+        phases["build"] = connector.build_time
+        phases["setup"] = seconds_since(start) - connector.build_time
+
+        start = datetime.datetime.now()
+        connector.run()
+        connector.get_result(True)
+        phases["first frame"] = seconds_since(start)
+    return phases
+
+
+def run_child(args, cache):
+
+    # a new process each time, nothing stays compiled in memory; the cache
+    # of pyopencl itself is off to measure only ours, drivers like pocl keep
+    # theirs under XDG_CACHE_HOME too so the first start is really cold
+    env = dict(os.environ, XDG_CACHE_HOME=cache, PYOPENCL_NO_CACHE="1")
+    command = [sys.executable, "-m", "benchmarks.startup", "--child",
+               "--w", str(args.w), "--h", str(args.h), "--scene", args.scene]
+    if args.obj:
+        command += ["--obj", args.obj]
+    output = subprocess.run(
+        command, env=env, check=True, stdout=subprocess.PIPE,
+        universal_newlines=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+
+    args = get_args()
+    if args.child:
+        print(json.dumps(start_up(args)))
+        return
+
+    with tempfile.TemporaryDirectory() as cache:
+        results = [("cold", run_child(args, cache))]
+        warm = sorted((run_child(args, cache) for _ in range(args.runs)),
+                      key=lambda phases: sum(phases.values()))
+        results.append(("warm", warm[len(warm) // 2]))
+
+        # a binary the driver refuses must still start from source
+        binaries = glob.glob(os.path.join(cache, "raytracer", "kernels", "*"))
+        for filename in binaries:
+            with open(filename, "wb") as f:
+                f.write(b"not a binary")
+        results.append(("rejected", run_child(args, cache)))
+
+    names = list(results[0][1])
+    print("Kernel binaries cached: {}".format(len(binaries)))
+    print("{:>10}".format("start") + "".join(
+        "{:>13}".format(name) for name in names + ["total"]))
+    for start, phases in results:
+        print("{:>10}".format(start) + "".join(
+            "{:>12.3f}s".format(phases[name]) for name in names) +
+            "{:>12.3f}s".format(sum(phases.values())))
+
+
+if __name__ == "__main__":
+    main()
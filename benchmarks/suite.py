@@ -0,0 +1,319 @@
+import argparse
+import contextlib
+import datetime
+import glob
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pyopencl as cl
+
+from src.camera_path import CameraPath
+from src.objects.base import BaseObject
+from src.objects.camera import Camera
+from src.opencl_connector import Connector
+from src.scene import Scene
+
+
+# scene_generator.py arguments of the generated scenes, the seed keeps them
+# the same between runs
+GENERATED = {
+    "random": ["random", "--spheres", "50", "--triangles", "50"],
+    "sierpinski": ["sierpinski", "--depth", "4"],
+    "cube_spheres": ["cube_of_spheres", "--side-length", "10"]}
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(
+        description="Render every benchmark scene along a fixed camera "
+        "path, write a JSON report and compare it with a baseline")
+
+    parser.add_argument("--w", type=int, default=320)
+    parser.add_argument("--h", type=int, default=240)
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--samples", type=int, default=1)
+    parser.add_argument("--scenes", type=str, nargs="*", default=None,
+                        help="Scene files, every bundled one by default")
+    parser.add_argument("--generated", type=str, nargs="*",
+                        default=sorted(GENERATED), choices=sorted(GENERATED),
+                        help="Scenes made by scripts/scene_generator.py")
+    parser.add_argument("--obj", type=str, nargs="*", default=[],
+                        help="Meshes, each one a scene of its own")
+    parser.add_argument("--camera-path", type=str, default=None,
+                        help="JSON camera keyframes for every scene instead "
+                        "of an orbit around each")
+    parser.add_argument("--output", type=str, default="benchmark.json",
+                        help="Report to write")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Earlier report to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Fail when a median frame time grows by more "
+                        "than this fraction of the baseline")
+    parser.add_argument("--min-difference", type=float, default=0.5,
+                        help="Milliseconds a frame time may always grow by, "
+                        "small scenes are noisy")
+    parser.add_argument("--child", type=str, default=None,
+                        help=argparse.SUPPRESS)
+
+    return parser.parse_args()
+
+
+def seconds_since(start):
+    return (datetime.datetime.now() - start).total_seconds()
+
+
+def get_cases(args, directory):
+
+    cases = []
+    for filename in args.scenes or sorted(glob.glob("scenes/*.json")):
+        name = os.path.splitext(os.path.basename(filename))[0]
+        cases.append({"name": name, "scene": filename})
+
+    for name in args.generated:
+        filename = os.path.join(directory, name + ".json")
+        subprocess.run(
+            [sys.executable, "scripts/scene_generator.py", "--seed", "0",
+             "--output", filename] + GENERATED[name], check=True)
+        cases.append({"name": "generated/" + name, "scene": filename,
+                      "generator": " ".join(GENERATED[name])})
+
+    for filename in args.obj:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        cases.append({"name": "obj/" + name, "scene": "scenes/scene.json",
+                      "obj": filename})
+    return cases
+
+
+def get_bounds(scene):
+
+    # corners of everything visible, the lights when nothing is
+    points = []
+    spheres = scene.get_packed("Sphere")
+    if spheres is not None and len(spheres):
+        centers = BaseObject.get_field(spheres, "center")
+        radius = spheres["radius"][:, np.newaxis]
+        points += [centers - radius, centers + radius]
+    triangles = scene.get_packed("Triangle")
+    if triangles is not None and len(triangles):
+        points.append(
+            BaseObject.get_field(triangles, "vertices").reshape(-1, 3))
+    lights = scene.get_packed("Light")
+    if not points and lights is not None and len(lights):
+        points.append(BaseObject.get_field(lights, "position"))
+    if not points:
+        return np.zeros(3), np.zeros(3)
+    points = np.concatenate(points)
+    return points.min(axis=0), points.max(axis=0)
+
+
+def get_device_memory(connector):
+
+    # every buffer and image the connector holds, also in lists of them
+    found = {}
+
+    def visit(value):
+        if isinstance(value, cl.MemoryObjectHolder):
+            found[value.int_ptr] = value.size
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                visit(item)
+
+    for value in vars(connector).values():
+        visit(value)
+    return sum(found.values())
+
+
+def run_case(args, case):
+
+    startup = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = datetime.datetime.now()
+        scene = Scene(None, None)
+        scene.load_from_json(case["scene"])
+        if case.get("obj"):
+            scene.load_from_mesh(case["obj"])
+        low, high = get_bounds(scene)
+        center = (low + high) / 2
+        size = max(np.linalg.norm(high - low), 1)
+        camera = Camera(args.w, args.h, z_far=size * 10)
+        scene.add_object(camera)
+        startup["scene"] = seconds_since(start)
+
+        start = datetime.datetime.now()
+        connector = Connector(
+            "kernels/raytracer.cl", scene, args.w, args.h, 1,
+            samples=args.samples)
+        startup["build"] = connector.build_time
+        startup["setup"] = seconds_since(start) - connector.build_time
+
+    if args.camera_path:
+        path = CameraPath.load(args.camera_path)
+    else:
+        path = CameraPath.orbit(center, size, args.frames)
+    frames = min(args.frames, len(path))
+
+    # the first frame may still compile for the launch size
+    start = datetime.datetime.now()
+    path.apply(camera, 0)
+    connector.run()
+    connector.get_result(True)
+    startup["first frame"] = seconds_since(start)
+
+    frame_times = []
+    for frame in range(frames):
+        start = datetime.datetime.now()
+        path.apply(camera, frame)
+        connector.run()
+        connector.get_result(True)
+        frame_times.append(seconds_since(start))
+
+    frame_times = np.array(frame_times) * 1000
+    rays = args.w * args.h * args.samples
+    return {
+        "scene": case.get("generator", case["scene"]),
+        "obj": case.get("obj"),
+        "spheres": int(connector.n_spheres),
+        "triangles": int(connector.n_triangles),
+        "features": [name for name, present in connector.features.items()
+                     if present],
+        "frames": frames,
+        "frame_ms": {
+            "mean": float(frame_times.mean()),
+            "p50": float(np.percentile(frame_times, 50)),
+            "p90": float(np.percentile(frame_times, 90)),
+            "p99": float(np.percentile(frame_times, 99))},
+        "primary_rays_per_second": rays * frames / frame_times.sum() * 1000,
+        "startup_s": startup,
+        "memory_mb": {
+            "opencl": get_device_memory(connector) / 2**20,
+            # ru_maxrss is in kilobytes on Linux
+            "host_peak": resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 2**10}}
+
+
+def run_child(args, case):
+
+    # a process per scene, its peak memory and startup are its own
+    command = [
+        sys.executable, "-m", "benchmarks.suite", "--child", json.dumps(case),
+        "--w", str(args.w), "--h", str(args.h),
+        "--frames", str(args.frames), "--samples", str(args.samples)]
+    if args.camera_path:
+        command += ["--camera-path", args.camera_path]
+    process = subprocess.run(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    if process.returncode:
+        # the last line of the traceback says what went wrong
+        error = (process.stderr.strip().splitlines() or ["no output"])[-1]
+        return {"scene": case.get("generator", case["scene"]),
+                "obj": case.get("obj"), "error": error}
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def get_revision():
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+
+    print("{:<26} {:>9} {:>9} {:>9} {:>12} {:>9} {:>9}".format(
+        "scene", "p50 ms", "p90 ms", "p99 ms", "Mrays/s", "start s",
+        "CL MB"))
+    for name, result in report["cases"].items():
+        if "error" in result:
+            print("{:<26} failed: {}".format(name, result["error"]))
+            continue
+        frame = result["frame_ms"]
+        print("{:<26} {:>9.2f} {:>9.2f} {:>9.2f} {:>12.2f} {:>9.3f} "
+              "{:>9.2f}".format(
+                  name, frame["p50"], frame["p90"], frame["p99"],
+                  result["primary_rays_per_second"] / 1e6,
+                  sum(result["startup_s"].values()),
+                  result["memory_mb"]["opencl"]))
+
+
+def compare(report, baseline, threshold, min_difference):
+
+    if baseline["devices"] != report["devices"]:
+        print("The baseline ran on {}, the times may not compare".format(
+            ", ".join(baseline["devices"])))
+
+    regressions = []
+    print()
+    print("{:<26} {:>12} {:>12} {:>9}".format(
+        "scene", "baseline ms", "p50 ms", "change"))
+    for name, result in report["cases"].items():
+        old = baseline["cases"].get(name, {})
+        if "frame_ms" not in old:
+            continue
+        # a scene that rendered before and fails now is the worst regression
+        if "error" in result:
+            print("{:<26} {:>12.2f} {:>12} {:>9}".format(
+                name, old["frame_ms"]["p50"], "failed", ""))
+            regressions.append(name)
+            continue
+        new, old = result["frame_ms"]["p50"], old["frame_ms"]["p50"]
+        change = new / old - 1
+        print("{:<26} {:>12.2f} {:>12.2f} {:>+8.1%}".format(
+            name, old, new, change))
+        if change > threshold and new - old > min_difference:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+
+    args = get_args()
+    if args.child:
+        print(json.dumps(run_case(args, json.loads(args.child))))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        cases = get_cases(args, directory)
+        results = {}
+        for case in cases:
+            print("Rendering", case["name"])
+            results[case["name"]] = run_child(args, case)
+
+    platform = Connector.get_platform()
+    report = {
+        "date": datetime.datetime.now().isoformat(),
+        "revision": get_revision(),
+        "devices": [Connector.get_devices(platform)[0].name],
+        "settings": {"width": args.w, "height": args.h,
+                     "frames": args.frames, "samples": args.samples,
+                     "camera_path": args.camera_path},
+        "cases": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print()
+    print_report(report)
+    print("Report written to", args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            report, baseline, args.threshold, args.min_difference)
+        if regressions:
+            print("Failed or slower than the baseline by more than "
+                  "{:.0%}: {}".format(args.threshold, ", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import contextlib
+import datetime
+import io
+import os
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from src.objects.camera import Camera
+from src.objects.light import Light
+from src.opencl_connector import Connector
+from src.scene import Scene
+from src.texture_compression import decode_bc1, get_psnr
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(
+        description="Memory, speed and quality of BC1 compressed textures")
+
+    parser.add_argument("--w", type=int, default=300)
+    parser.add_argument("--h", type=int, default=300)
+    parser.add_argument("--obj", type=str, default=None,
+                        help="Textured mesh, a plane with generated "
+                        "textures by default")
+    parser.add_argument("--texture-size", type=int, default=1024)
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--min-psnr", type=float, default=25,
+                        help="Fail when the texels of a texture or of one "
+                        "of its mip levels compress worse than this PSNR, "
+                        "in dB")
+
+    return parser.parse_args()
+
+
+def get_textures(size):
+
+    # a smooth one like most photos and a noisy one, the worst case for
+    # blocks of two colors. Amplitudes fall with frequency as in photos, so
+    # the mip levels look like the texture does and compress like it; the
+    # spectrum also makes it tile
+    random = np.random.RandomState(0)
+    frequency = np.hypot(*np.meshgrid(np.fft.fftfreq(size),
+                                      np.fft.fftfreq(size)))
+    frequency[0, 0] = np.inf
+
+    def get_field():
+        spectrum = random.normal(size=(2, size, size)) / frequency
+        field = np.fft.ifft2(spectrum[0] + 1j * spectrum[1]).real
+        return field / np.abs(field).max()
+
+    # the channels share most of their detail, as brightness
+    brightness = get_field()
+    smooth = np.stack(
+        [brightness + 0.3 * get_field() for _ in range(3)], axis=-1)
+    smooth = np.round(
+        (smooth / np.abs(smooth).max() + 1) * 127.5).astype(np.uint8)
+    noise = np.clip(smooth + random.normal(0, 12, smooth.shape), 0, 255)
+    return {"smooth.png": smooth, "noisy.png": noise.astype(np.uint8)}
+
+
+def write_plane(args, directory):
+
+    textures = get_textures(args.texture_size)
+    with open(os.path.join(directory, "plane.mtl"), "w") as f:
+        for name, texture in textures.items():
+            Image.fromarray(texture).save(os.path.join(directory, name))
+            f.write("newmtl {}\nKa 1 1 1\nKd 1 1 1\nKs 0 0 0\n"
+                    "map_Kd {}\n".format(name, name))
+
+    # one texture per half of the plane
+    with open(os.path.join(directory, "plane.obj"), "w") as f:
+        f.write("mtllib plane.mtl\n")
+        for x in [-10, 0, 10]:
+            f.write("v {} 0 -10\nv {} 0 10\n".format(x, x))
+        f.write("vt 0 0\nvt 1 0\nvt 1 1\nvt 0 1\nvn 0 1 0\n")
+        for i, name in enumerate(textures):
+            a, b, c, d = 2 * i + 1, 2 * i + 3, 2 * i + 4, 2 * i + 2
+            f.write("usemtl {}\nf {}/1/1 {}/4/1 {}/3/1\n"
+                    "f {}/1/1 {}/3/1 {}/2/1\n".format(
+                        name, a, d, c, a, c, b))
+    return os.path.join(directory, "plane.obj")
+
+
+def load_scene(args, obj):
+
+    scene = Scene(None, None)
+    scene.load_from_mesh(obj, use_cache=False)
+    scene.add_object(Light([0, 50, 0], [0.3] * 3, [0.7] * 3, [0] * 3))
+    scene.add_object(Camera(
+        args.w, args.h, position=[0, 12, 12], direction=[0, -1, -1]))
+    return scene
+
+
+def measure(args, scene, compress_textures):
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        connector = Connector(
+            "kernels/raytracer.cl", scene, args.w, args.h, 1,
+            compress_textures=compress_textures)
+    connector.run()
+    image = connector.get_result(True)
+
+    start = datetime.datetime.now()
+    for _ in range(args.frames):
+        connector.run()
+        image = connector.get_result(True)
+    total = (datetime.datetime.now() - start).total_seconds()
+    return total / args.frames, image
+
+
+def main():
+
+    args = get_args()
+    with tempfile.TemporaryDirectory() as directory:
+        with contextlib.redirect_stdout(io.StringIO()):
+            scene = load_scene(args, args.obj or write_plane(args, directory))
+        atlas = scene.get_packed_textures()
+        start = datetime.datetime.now()
+        atlas.compress()
+        encode_time = (datetime.datetime.now() - start).total_seconds()
+
+        results = [(compress, measure(args, scene, compress))
+                   for compress in [False, True]]
+
+    height, width, _ = atlas.image.shape
+    decoded = decode_bc1(atlas.blocks, width, height)
+    # every record, the mip levels compress on their own blocks too
+    texel_psnr = []
+    for record in atlas.records:
+        x, y = record["offset"]["x"], record["offset"]["y"]
+        w, h = record["scale"]["x"], record["scale"]["y"]
+        area = np.s_[int(y):int(y + h), int(x):int(x + w)]
+        texel_psnr.append(get_psnr(decoded[area], atlas.image[area][..., :3]))
+    reference = results[0][1][1]
+
+    print()
+    print("Texture atlas: {}x{}, {:.2f} MB as RGBA8, {:.2f} MB as BC1, "
+          "{:.1f}x smaller, encoded in {:.2f} s".format(
+              width, height, atlas.size / 2**20,
+              atlas.compressed_size / 2**20,
+              atlas.size / atlas.compressed_size, encode_time))
+    print("Texel PSNR per texture and mip level (dB):", " ".join(
+        "{:.2f}".format(psnr) for psnr in texel_psnr))
+    print("{:>10} {:>10} {:>18}".format(
+        "textures", "ms/frame", "frame PSNR (dB)"))
+    for compress, (frame, image) in results:
+        print("{:>10} {:>10.2f} {:>18.2f}".format(
+            "BC1" if compress else "RGBA8", frame * 1000,
+            get_psnr(image, reference)))
+
+    if min(texel_psnr) < args.min_psnr:
+        print("Texel PSNR below {:.2f} dB".format(args.min_psnr))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import contextlib
+import datetime
+import io
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from src.objects.camera import Camera
+from src.objects.light import Light
+from src.opencl_connector import Connector
+from src.scene import Scene
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(
+        description="Throughput and aliasing of textured scenes with and "
+        "without mip maps")
+
+    parser.add_argument("--w", type=int, default=300)
+    parser.add_argument("--h", type=int, default=300)
+    parser.add_argument("--obj", type=str, default=None,
+                        help="Textured mesh, a large tiled plane by default")
+    parser.add_argument("--texture-size", type=int, default=1024)
+    parser.add_argument("--tiles", type=int, default=64,
+                        help="Times the texture repeats across the plane")
+    parser.add_argument("--reference-samples", type=int, default=16,
+                        help="Samples per pixel of the image the error is "
+                        "measured against")
+    parser.add_argument("--frames", type=int, default=10)
+
+    return parser.parse_args()
+
+
+def write_plane(args, directory):
+
+    # noise is the worst case for minification, every texel differs
+    random = np.random.RandomState(0)
+    texture = random.randint(
+        0, 256, (args.texture_size, args.texture_size, 3), dtype=np.uint8)
+    Image.fromarray(texture).save(os.path.join(directory, "noise.png"))
+
+    with open(os.path.join(directory, "plane.mtl"), "w") as f:
+        f.write("newmtl plane\nKa 1 1 1\nKd 1 1 1\nKs 0 0 0\n"
+                "map_Kd noise.png\n")
+    size, tiles = 200, args.tiles
+    with open(os.path.join(directory, "plane.obj"), "w") as f:
+        f.write("mtllib plane.mtl\n")
+        for x, z in [(-1, -1), (1, -1), (1, 1), (-1, 1)]:
+            f.write("v {} 0 {}\n".format(x * size / 2, z * size / 2))
+        for u, v in [(0, 0), (tiles, 0), (tiles, tiles), (0, tiles)]:
+            f.write("vt {} {}\n".format(u, v))
+        f.write("vn 0 1 0\nusemtl plane\n"
+                "f 1/1/1 4/4/1 3/3/1\nf 1/1/1 3/3/1 2/2/1\n")
+    return os.path.join(directory, "plane.obj")
+
+
+def load_scene(args, obj):
+
+    scene = Scene(None, None)
+    scene.load_from_mesh(obj, use_cache=False)
+    scene.add_object(Light([0, 50, 0], [0.3] * 3, [0.7] * 3, [0] * 3))
+    # low over the plane, most of the frame is strongly minified
+    scene.add_object(Camera(
+        args.w, args.h, position=[0, 2, 90], direction=[0, -0.15, -1]))
+    return scene
+
+
+def measure(args, scene, mipmaps, samples=1, frames=None):
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        connector = Connector(
+            "kernels/raytracer.cl", scene, args.w, args.h, 1,
+            samples=samples, mipmaps=mipmaps)
+    connector.run()
+    image = connector.get_result(True)
+
+    frames = frames or args.frames
+    kernel_time = 0
+    start = datetime.datetime.now()
+    for _ in range(frames):
+        connector.run()
+        image = connector.get_result(True)
+        kernel_time += sum(
+            (event.profile.end - event.profile.start) * 1e-9
+            for _, event, _ in connector.last_tiles)
+    total = (datetime.datetime.now() - start).total_seconds()
+
+    rays = args.w * args.h * samples * frames
+    return total / frames, rays / kernel_time, image.astype(np.float32)
+
+
+def main():
+
+    args = get_args()
+    with tempfile.TemporaryDirectory() as directory:
+        with contextlib.redirect_stdout(io.StringIO()):
+            scene = load_scene(args, args.obj or write_plane(args, directory))
+            atlas = scene.get_packed_textures()
+
+        # what a box filter over the pixel converges to
+        _, _, reference = measure(
+            args, scene, False, args.reference_samples, 1)
+        results = [(mipmaps, measure(args, scene, mipmaps))
+                   for mipmaps in [False, True]]
+
+    print()
+    print("Texture atlas: {:.2f} MB with mip levels".format(
+        atlas.size / 2**20))
+    # OpenCL has no portable counters for the texture cache, on a
+    # minified texture its misses show up as lower throughput
+    print("{:>8} {:>10} {:>10} {:>16}".format(
+        "mipmaps", "ms/frame", "Mrays/s", "RMSE vs {}spp".format(
+            args.reference_samples)))
+    for mipmaps, (frame, rays, image) in results:
+        error = np.sqrt(np.mean((image - reference) ** 2))
+        print("{:>8} {:>10.2f} {:>10.2f} {:>16.2f}".format(
+            "on" if mipmaps else "off", frame * 1000, rays / 1e6, error))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,50 @@
+// Address spaces of the scene buffers, Connector picks __constant for the
+// ones that fit into the device constant memory and __global otherwise.
+#ifndef CAMERA_MEM
+#define CAMERA_MEM __constant
+#endif
+#ifndef MATERIAL_MEM
+#define MATERIAL_MEM __global
+#endif
+#ifndef LIGHT_MEM
+#define LIGHT_MEM __global
+#endif
+#ifndef SPHERE_MEM
+#define SPHERE_MEM __global
+#endif
+#ifndef TRIANGLE_MEM
+#define TRIANGLE_MEM __global
+#endif
+#ifndef BVH_MEM
+#define BVH_MEM __global
+#endif
+#ifndef TEXTURE_MEM
+#define TEXTURE_MEM __global
+#endif
+
+// With SPECIALIZED only the features the scene uses are compiled, the
+// Connector defines them from its materials and primitives.
+#ifndef SPECIALIZED
+#define HAS_SPHERES
+#define HAS_TRIANGLES
+#define HAS_TEXTURES
+#define HAS_REFLECTION
+#define HAS_REFRACTION
+#endif
+// bounces of refracted rays, reflected ones stop one earlier
+#ifndef MAX_DEPTH
+#define MAX_DEPTH 3
+#endif
+
+// The texture atlas is an RGBA8 image, or with COMPRESSED_TEXTURES its BC1
+// blocks: two RGB565 colors and 2 bits per pixel of a 4x4 block, row by
+// row, after an element with the atlas size.
+#ifdef COMPRESSED_TEXTURES
+#define TEXTURES __global const uint2*
+#else
+#define TEXTURES read_only image2d_t
+#endif
+
 struct Material {
     float3 ambient;
     float3 diffuse;
@@ -21,7 +68,7 @@ struct Texture { uchar* data;
 struct Sphere {
     float3 position;
     float radius;
-    struct Material material;
+    int material;
 };
 
 struct Triangle {
@@ -31,10 +78,10 @@ struct Triangle {
     float3 normalA;
     float3 normalB;
     float3 normalC;
-    float4 textureA;
-    float4 textureB;
-    float4 textureC;
-    struct Material material;
+    float2 textureA;
+    float2 textureB;
+    float2 textureC;
+    int material;
 };
 
 struct Camera {
@@ -52,40 +99,69 @@ struct Light {
     float3 ambient;
     float3 diffuse;
     float3 specular;
+    float radius;
 };
 
-struct RayTask {
-    float3 direction;
-    float3 origin;
-    float mult;
-    float depth;
+// uniform grid over bounding spheres, of the lights with a radius and of
+// the spheres, cells hold indices of the ones that touch them and
+// resolution.w is the cell for points outside
+struct Grid {
+    float3 boundsMin;
+    float3 invCellSize;
+    int4 resolution;
 };
 
-void push(__private uint* stack, uint value) {
+// where a texture sits in the atlas, in pixels, uv * scale + offset,
+// textures have their number of mip levels and the record of level 1,
+// the smaller levels follow it
+struct TextureRecord {
+    float2 offset;
+    float2 scale;
+    int levels;
+    int mips;
+};
 
-    uint bufLen = 64;
-    uint nextIndex=stack[0]%bufLen+2;
-    stack[nextIndex]=value;
-    stack[0] += 1;
-}
+struct BVHNode {
+    float3 boundsMin;
+    float3 boundsMax;
+    int first;
+    int count;
+};
 
-bool empty(__private uint* stack) {
-    return (stack[0] == stack[1]);
-}
+// rays still to trace, xyz direction and origin with the weight and
+// depth in w and the distance from the camera to the origin for the ray
+// cone, kept in a small ring that is traversed in FIFO order
+struct RayTask {
+    float4 direction;
+    float4 origin;
+    float distance;
+};
 
-uint pop(__private uint* stack)
-{
-    uint bufLen=64;
-    uint ptr=stack[1]%bufLen+2;
-    uint returnValue=stack[ptr];
-    stack[ptr]=0;
-    stack[1] += 1;
-    return returnValue;
-}
+#ifndef TASK_QUEUE_SIZE
+#define TASK_QUEUE_SIZE 8
+#endif
 
+void push_task(
+        struct RayTask* tasks,
+        const int head,
+        int* tail,
+        float3 direction,
+        float3 origin,
+        float mult,
+        float depth,
+        float distance) {
+
+    // a full queue drops the ray, it only happens for faint ones
+    if (*tail - head < TASK_QUEUE_SIZE) {
+        struct RayTask task = {(float4)(direction, mult), (float4)(origin, depth),
+                               distance};
+        tasks[*tail & (TASK_QUEUE_SIZE - 1)] = task;
+        *tail += 1;
+    }
+}
 
 float intersect_sphere(
-        __constant struct Sphere* sphere,
+        SPHERE_MEM struct Sphere* sphere,
         const float3 origin,
         const float3 direction) {
 
@@ -110,24 +186,8 @@ float intersect_sphere(
     return distance;
 }
 
-void push_struct(uint *stack, struct RayTask task) {
-    uint* p = (uint*)&task;
-    for (int i = 0; i < sizeof(struct RayTask) / 4; i++) {
-        push(stack, p[i]);
-    }
-}
-
-struct RayTask pop_struct(uint *stack) {
-    uint p[sizeof(struct RayTask) / 4];
-    for (int i = 0; i < sizeof(struct RayTask) / 4; i++) {
-        p[i] = pop(stack);
-    }
-
-    return *((struct RayTask*)p);
-}
-
 float intersect_triagle(
-        __constant struct Triangle* triangle,
+        TRIANGLE_MEM struct Triangle* triangle,
         const float3 origin,
         const float3 direction) {
 
@@ -154,14 +214,42 @@ float intersect_triagle(
     return dist;
 }
 
-float3 getSphereNormal(__constant struct Sphere* sphere, __private float3 crossPoint) {
+float3 getSphereNormal(SPHERE_MEM struct Sphere* sphere, __private float3 crossPoint) {
     return normalize(crossPoint - sphere->position);
 }
 
+int2 getLightCell(
+        LIGHT_MEM struct Grid* lightGrid,
+        LIGHT_MEM int2* lightCells,
+        float3 point) {
+
+    // first entry in the light indices and their count
+    int3 cell = convert_int3_sat_rtn((point - lightGrid->boundsMin) * lightGrid->invCellSize);
+    int4 resolution = lightGrid->resolution;
+    if (any(cell < 0) || any(cell >= resolution.xyz)) {
+        return lightCells[resolution.w];
+    }
+    return lightCells[(cell.z * resolution.y + cell.y) * resolution.x + cell.x];
+}
+
+float getLightFalloff(LIGHT_MEM struct Light* light, float dist) {
+
+    // lights without a radius reach everything at full strength
+    if (light->radius <= 0) {
+        return 1.0f;
+    }
+    float x = dist / light->radius;
+    float falloff = clamp(1.0f - x * x * x * x, 0.0f, 1.0f);
+    return falloff * falloff;
+}
+
 float3 getSphereColor(
-        __constant struct Sphere* sphere,
-        __constant struct Light* lights,
-        __private int nLights,
+        SPHERE_MEM struct Sphere* sphere,
+        MATERIAL_MEM struct Material* materials,
+        LIGHT_MEM struct Light* lights,
+        LIGHT_MEM struct Grid* lightGrid,
+        LIGHT_MEM int2* lightCells,
+        LIGHT_MEM int* lightIndices,
         __private float3 crossPoint,
         __private float3 observationVector,
         __private float3 normalVector) {
@@ -170,9 +258,12 @@ float3 getSphereColor(
         normalVector = - (normalVector);
     }
 
-    float3 resultColor = sphere->material.ambient * (float3)(0.4f, 0.4f, 0.4f); // ...* global ambient
-    for (int i = 0; i < nLights; i++) {
-        float3 lightVector = normalize(lights[i].position - crossPoint);
+    MATERIAL_MEM struct Material* material = materials + sphere->material;
+    float3 resultColor = material->ambient * (float3)(0.4f, 0.4f, 0.4f); // ...* global ambient
+    int2 cell = getLightCell(lightGrid, lightCells, crossPoint);
+    for (int j = cell.x; j < cell.x + cell.y; j++) {
+        LIGHT_MEM struct Light* light = lights + lightIndices[j];
+        float3 lightVector = normalize(light->position - crossPoint);
         float n_dot_l = dot(lightVector, normalVector);
         float3 reflectionVector = normalize(lightVector - (normalVector) * 2*n_dot_l);
         float v_dot_r = dot(reflectionVector, observationVector);
@@ -180,10 +271,11 @@ float3 getSphereColor(
             v_dot_r = 0;
         }
 
-        if(n_dot_l > 0.0001f) {//and no in shadow...
-            resultColor += sphere->material.diffuse * lights[i].diffuse * n_dot_l +
-                sphere->material.specular * lights[i].specular * pow(v_dot_r, 30) + //specShin
-                sphere->material.ambient * lights[i].ambient;
+        float falloff = getLightFalloff(light, distance(crossPoint, light->position));
+        if(n_dot_l > 0.0001f && falloff > 0) {//and no in shadow...
+            resultColor += falloff * (material->diffuse * light->diffuse * n_dot_l +
+                material->specular * light->specular * pow(v_dot_r, 30) + //specShin
+                material->ambient * light->ambient);
         }
     }
     return resultColor;
@@ -191,7 +283,7 @@ float3 getSphereColor(
 }
 
 float3 getTriangleNormal(
-        __constant struct Triangle* triangle,
+        TRIANGLE_MEM struct Triangle* triangle,
         __private float3 crossPoint,
         __private float3 *barVector) {
 
@@ -216,13 +308,49 @@ float3 getTriangleNormal(
     return normalize(triangle->normalA*u + triangle->normalB*v + triangle->normalC*w);
 }
 
-float3 getColorTexture(
-        float4 coordinates,
-        float3 texture,
-        read_only image2d_array_t textures) {
+#ifdef COMPRESSED_TEXTURES
+float3 decodeColor(uint color) {
+    return (float3)((color >> 11) & 31, (color >> 5) & 63, color & 31)
+        / (float3)(31.0f, 63.0f, 31.0f);
+}
+
+float3 getTexel(TEXTURES textures, int2 size, int x, int y) {
+
+    // the first color, the second, a third and two thirds of the way
+    const float weights[4] = {0.0f, 1.0f, 1.0f/3.0f, 2.0f/3.0f};
+
+    x = clamp(x, 0, size.x - 1);
+    y = clamp(y, 0, size.y - 1);
+    uint2 block = textures[1 + (y >> 2) * ((size.x + 3) >> 2) + (x >> 2)];
+    uint index = (block.y >> (((y & 3) * 4 + (x & 3)) * 2)) & 3;
+    return mix(decodeColor(block.x & 0xffff), decodeColor(block.x >> 16),
+               weights[index]);
+}
+
+float3 readTexture(TEXTURES textures, float2 coordinates) {
+
+    // bilinear like the image sampler, texel centers at .5
+    int2 size = as_int2(textures[0]);
+    coordinates -= 0.5f;
+    float2 low = floor(coordinates);
+    float2 t = coordinates - low;
+    int x = (int)low.x;
+    int y = (int)low.y;
+    return mix(mix(getTexel(textures, size, x, y),
+                   getTexel(textures, size, x + 1, y), t.x),
+               mix(getTexel(textures, size, x, y + 1),
+                   getTexel(textures, size, x + 1, y + 1), t.x),
+               t.y);
+}
+#endif
 
-    float width = texture.y;
-    float height = texture.z;
+float3 sampleTexture(
+        float2 coordinates,
+        TEXTURE_MEM struct TextureRecord* record,
+        TEXTURES textures) {
+
+    float width = record->scale.x;
+    float height = record->scale.y;
     coordinates.x = coordinates.x * width;
     coordinates.y = coordinates.y * height;
 
@@ -237,96 +365,475 @@ float3 getColorTexture(
         coordinates.y -= height * floor(coordinates.y/height);
     }
 
-    const sampler_t sampler = CLK_NORMALIZED_COORDS_FALSE | CLK_ADDRESS_REPEAT | CLK_FILTER_LINEAR;
+    // the atlas has a wrapped border around every texture, filtering at
+    // its edges never reaches the neighbours
+#ifdef COMPRESSED_TEXTURES
+    return readTexture(textures, coordinates + record->offset);
+#else
+    const sampler_t sampler = CLK_NORMALIZED_COORDS_FALSE | CLK_ADDRESS_CLAMP_TO_EDGE | CLK_FILTER_LINEAR;
     float4 _diffuse = read_imagef(
-            textures, sampler,
-            (float4)(coordinates.x, coordinates.y, texture.x, 0.0f));
+            textures, sampler, coordinates + record->offset);
     return (float3)(_diffuse.x, _diffuse.y, _diffuse.z);
+#endif
+}
+
+float3 getColorTexture(
+        float2 coordinates,
+        float3 texture,
+        float lod,
+        TEXTURES textures,
+        TEXTURE_MEM struct TextureRecord* textureRecords) {
+
+    // lod is log2 of the footprint in uv units, the texture size turns it
+    // into texels, blended between the two nearest levels
+    TEXTURE_MEM struct TextureRecord* record = textureRecords + (int)texture.x;
+#ifdef NO_MIPMAPS
+    return sampleTexture(coordinates, record, textures);
+#else
+    float level = clamp(lod + 0.5f * log2(record->scale.x * record->scale.y),
+                        0.0f, (float)(record->levels - 1));
+    int low = (int)level;
+    float3 color = sampleTexture(
+            coordinates, low > 0 ? textureRecords + record->mips + low - 1 : record,
+            textures);
+    if (level > low) {
+        color = mix(color, sampleTexture(
+                coordinates, textureRecords + record->mips + low, textures),
+                level - low);
+    }
+    return color;
+#endif
+}
+
+float getTriangleLod(
+        TRIANGLE_MEM struct Triangle* triangle,
+        float coneWidth,
+        float3 direction) {
+
+    // ray cone footprint, Akenine-Moller et al. "Texture Level of Detail
+    // Strategies for Real-Time Ray Tracing", without the texture size
+    float3 normal = cross(triangle->pointB - triangle->pointA,
+                          triangle->pointC - triangle->pointA);
+    float2 ab = triangle->textureB - triangle->textureA;
+    float2 ac = triangle->textureC - triangle->textureA;
+    float uvArea = fabs(ab.x * ac.y - ab.y * ac.x);
+    float worldArea = length(normal);
+    float cosine = fabs(dot(normal, direction)) / worldArea;
+    return 0.5f * log2(uvArea / worldArea) + log2(coneWidth / cosine);
+}
+
+#define BVH_STACK_SIZE 32
+
+float intersect_aabb(
+        BVH_MEM struct BVHNode* node,
+        const float3 origin,
+        const float3 invDirection,
+        const float maxDist) {
+
+    float3 t0 = (node->boundsMin - origin) * invDirection;
+    float3 t1 = (node->boundsMax - origin) * invDirection;
+    float3 tMin = fmin(t0, t1);
+    float3 tMax = fmax(t0, t1);
+    float tNear = fmax(fmax(tMin.x, tMin.y), fmax(tMin.z, 0.0f));
+    float tFar = fmin(fmin(tMax.x, tMax.y), tMax.z);
+
+    if (tNear > tFar + 0.0001f || tNear > maxDist) {
+        return -1;
+    }
+    return tNear;
+}
+
+int traverseTriangleBVH(
+        TRIANGLE_MEM struct Triangle* triangles,
+        BVH_MEM struct BVHNode* nodes,
+        BVH_MEM int* indices,
+        __private float* max_dist,
+        const float3 origin,
+        const float3 direction,
+        const bool anyHit) {
+
+    int closest = -1;
+    int stack[BVH_STACK_SIZE];
+    int top = 0;
+    float3 invDirection = 1.0f / direction;
+
+    if (intersect_aabb(nodes, origin, invDirection, *max_dist) < 0) {
+        return closest;
+    }
+    stack[top++] = 0;
+
+    while (top > 0) {
+        BVH_MEM struct BVHNode* node = nodes + stack[--top];
+
+        if (node->count > 0) {
+            for (int i = node->first; i < node->first + node->count; i++) {
+                float tempDist = intersect_triagle(triangles + indices[i], origin, direction);
+                if (tempDist > 0.0001f && tempDist < *max_dist) {
+                    closest = indices[i];
+                    *max_dist = tempDist;
+                    if (anyHit) {
+                        return closest;
+                    }
+                }
+            }
+            continue;
+        }
+
+        int near = node->first;
+        int far = node->first + 1;
+        float nearDist = intersect_aabb(nodes + near, origin, invDirection, *max_dist);
+        float farDist = intersect_aabb(nodes + far, origin, invDirection, *max_dist);
+        if (farDist >= 0 && (nearDist < 0 || farDist < nearDist)) {
+            int tempNode = near;
+            near = far;
+            far = tempNode;
+            float tempDist = nearDist;
+            nearDist = farDist;
+            farDist = tempDist;
+        }
+        // far child goes first so the near one is popped next
+        if (farDist >= 0) {
+            stack[top++] = far;
+        }
+        if (nearDist >= 0) {
+            stack[top++] = near;
+        }
+    }
+    return closest;
+}
+
+bool occludedTriangleBVH(
+        TRIANGLE_MEM struct Triangle* triangles,
+        BVH_MEM struct BVHNode* nodes,
+        BVH_MEM int* indices,
+        const float maxDist,
+        const float3 origin,
+        const float3 direction,
+        __private int* occluder) {
+
+    // any hit will do, so children are not sorted by distance
+    int stack[BVH_STACK_SIZE];
+    int top = 0;
+    float3 invDirection = 1.0f / direction;
+    stack[top++] = 0;
+
+    while (top > 0) {
+        BVH_MEM struct BVHNode* node = nodes + stack[--top];
+        if (intersect_aabb(node, origin, invDirection, maxDist) < 0) {
+            continue;
+        }
+
+        if (node->count > 0) {
+            for (int i = node->first; i < node->first + node->count; i++) {
+                float tempDist = intersect_triagle(triangles + indices[i], origin, direction);
+                if (tempDist > 0.0001f && tempDist < maxDist) {
+                    *occluder = indices[i];
+                    return true;
+                }
+            }
+            continue;
+        }
+        stack[top++] = node->first;
+        stack[top++] = node->first + 1;
+    }
+    return false;
+}
+
+int traverseSphereGrid(
+        SPHERE_MEM struct Sphere* spheres,
+        SPHERE_MEM struct Grid* grid,
+        SPHERE_MEM int2* cells,
+        SPHERE_MEM int* indices,
+        __private float* max_dist,
+        const float3 origin,
+        const float3 direction,
+        const bool anyHit) {
+
+    // walks the cells along the ray in order (Amanatides & Woo), spheres
+    // always have a radius so the cell outside the grid stays empty
+    int closest = -1;
+    int4 resolution = grid->resolution;
+    float3 cellSize = 1.0f / grid->invCellSize;
+    float3 boundsMin = grid->boundsMin;
+    float3 boundsMax = boundsMin + convert_float3(resolution.xyz) * cellSize;
+    float3 invDirection = 1.0f / direction;
+
+    float3 t0 = (boundsMin - origin) * invDirection;
+    float3 t1 = (boundsMax - origin) * invDirection;
+    float3 tMin = fmin(t0, t1);
+    float3 tMax = fmax(t0, t1);
+    float tNear = fmax(fmax(tMin.x, tMin.y), fmax(tMin.z, 0.0f));
+    float tFar = fmin(fmin(tMax.x, tMax.y), tMax.z);
+    if (tNear > tFar || tNear > *max_dist) {
+        return closest;
+    }
+
+    int3 cell = clamp(
+        convert_int3_rtn((origin + direction * tNear - boundsMin) * grid->invCellSize),
+        (int3)(0), resolution.xyz - 1);
+    int3 step = select((int3)(-1), (int3)(1), direction >= 0.0f);
+    float3 tDelta = fabs(cellSize * invDirection);
+    float3 tNext = (boundsMin + convert_float3(cell + max(step, 0)) * cellSize - origin) * invDirection;
+    tNext = select((float3)(INFINITY), tNext, direction != 0.0f);
+
+    while (true) {
+        int2 range = cells[(cell.z * resolution.y + cell.y) * resolution.x + cell.x];
+        for (int i = range.x; i < range.x + range.y; i++) {
+            float tempDist = intersect_sphere(spheres + indices[i], origin, direction);
+            if (tempDist > 0.0001f && tempDist < *max_dist) {
+                closest = indices[i];
+                *max_dist = tempDist;
+                if (anyHit) {
+                    return closest;
+                }
+            }
+        }
+
+        // a hit inside this cell is closer than anything in the next ones
+        float tExit = fmin(fmin(tNext.x, tNext.y), tNext.z);
+        if (*max_dist <= tExit || tExit > tFar) {
+            return closest;
+        }
+        if (tNext.x == tExit) {
+            cell.x += step.x;
+            tNext.x += tDelta.x;
+        }
+        else if (tNext.y == tExit) {
+            cell.y += step.y;
+            tNext.y += tDelta.y;
+        }
+        else {
+            cell.z += step.z;
+            tNext.z += tDelta.z;
+        }
+        if (any(cell < 0) || any(cell >= resolution.xyz)) {
+            return closest;
+        }
+    }
 }
 
-bool isInShadow(__constant struct Triangle* triangles,
-                float nTriangles,
+// last primitive that blocked a light, triangles by index, spheres as
+// -2 - index
+#define NO_OCCLUDER -1
+#ifndef OCCLUDER_CACHE_SIZE
+#define OCCLUDER_CACHE_SIZE 8
+#endif
+
+bool isInShadow(SPHERE_MEM struct Sphere* spheres,
+                const int nSpheres,
+                SPHERE_MEM struct Grid* sphereGrid,
+                SPHERE_MEM int2* sphereCells,
+                SPHERE_MEM int* sphereIndices,
+                TRIANGLE_MEM struct Triangle* triangles,
+                const int nTriangles,
+                BVH_MEM struct BVHNode* nodes,
+                BVH_MEM int* indices,
                 float dist,
                 float3 direction,
-                float3 origin) {
+                float3 origin,
+                __private int* occluder) {
+
+    // nearby shading points are usually blocked by the same primitive
+    float tempDist = -1;
+#ifdef HAS_TRIANGLES
+    if (*occluder >= 0) {
+        tempDist = intersect_triagle(triangles + *occluder, origin, direction);
+    }
+#endif
+#ifdef HAS_SPHERES
+    if (*occluder < NO_OCCLUDER) {
+        tempDist = intersect_sphere(spheres - 2 - *occluder, origin, direction);
+    }
+#endif
+    if (tempDist > 0.0001f && tempDist < dist) {
+        return true;
+    }
 
+#ifdef USE_BVH
+#ifdef HAS_SPHERES
+    if (nSpheres > 0) {
+        int sphere = traverseSphereGrid(spheres, sphereGrid, sphereCells,
+                                        sphereIndices, &dist, origin,
+                                        direction, true);
+        if (sphere >= 0) {
+            *occluder = -2 - sphere;
+            return true;
+        }
+    }
+#endif
+#ifdef HAS_TRIANGLES
+    if (nTriangles > 0 && occludedTriangleBVH(triangles, nodes, indices, dist,
+                                               origin, direction, occluder)) {
+        return true;
+    }
+#endif
+#else
+#ifdef HAS_SPHERES
+    for(int i = 0; i < nSpheres; i++) {
+        tempDist = intersect_sphere(spheres + i, origin, direction);
+        if (tempDist > 0.0001f && tempDist < dist) {
+            *occluder = -2 - i;
+            return true;
+        }
+    }
+#endif
+#ifdef HAS_TRIANGLES
     for(int i = 0; i < nTriangles; i++) {
-        float tempDist = intersect_triagle(triangles + i, origin, direction);
+        tempDist = intersect_triagle(triangles + i, origin, direction);
         if (tempDist > 0.0001f && tempDist < dist) {
+            *occluder = i;
             return true;
         }
     }
+#endif
+#endif
+    *occluder = NO_OCCLUDER;
     return false;
 }
 
-float3 getTriangleColor(
-        __constant struct Triangle* triangles,
-        int nTriangles,
-        __constant struct Triangle* triangle,
-        __constant struct Light* lights,
-        __private int nLights,
-        __private float3 crossPoint,
-        __private float3 observationVector,
-        __private float3 normalVector,
+void getTriangleSurface(
+        TRIANGLE_MEM struct Triangle* triangle,
+        MATERIAL_MEM struct Material* material,
         __private float3 barVector,
-        read_only image2d_array_t textures) {
-
-    float4 coordinates;
-    float3 diffuse = triangle->material.diffuse;
-    float3 specular = triangle->material.specular;
-    float3 ambient = triangle->material.ambient;
-    if (triangle->material.texture_diffuse.x >= 0.0f ||
-        triangle->material.texture_ambient.x >= 0.0f ||
-        triangle->material.texture_specular.x >= 0.0f) {
+        float coneWidth,
+        float3 direction,
+        TEXTURES textures,
+        TEXTURE_MEM struct TextureRecord* textureRecords,
+        __private float3* ambient,
+        __private float3* diffuse,
+        __private float3* specular) {
+
+    float2 coordinates;
+    *diffuse = material->diffuse;
+    *specular = material->specular;
+    *ambient = material->ambient;
+#ifdef HAS_TEXTURES
+    if (material->texture_diffuse.x >= 0.0f ||
+        material->texture_ambient.x >= 0.0f ||
+        material->texture_specular.x >= 0.0f) {
 
         coordinates = (triangle->textureA * barVector.x + 
                        triangle->textureB * barVector.y +
                        triangle->textureC * barVector.z);
+        float lod = getTriangleLod(triangle, coneWidth, direction);
 
-        if (triangle->material.texture_diffuse.x >= 0.0f) {
-            diffuse *= getColorTexture(coordinates, triangle->material.texture_diffuse, textures);
+        if (material->texture_diffuse.x >= 0.0f) {
+            *diffuse *= getColorTexture(coordinates, material->texture_diffuse, lod,
+                                        textures, textureRecords);
         }
-        if (triangle->material.texture_ambient.x >= 0.0f) {
-            ambient *= getColorTexture(coordinates, triangle->material.texture_ambient, textures);
+        if (material->texture_ambient.x >= 0.0f) {
+            *ambient *= getColorTexture(coordinates, material->texture_ambient, lod,
+                                        textures, textureRecords);
         }
-        if (triangle->material.texture_specular.x >= 0.0f) {
-            specular *= getColorTexture(coordinates, triangle->material.texture_specular, textures);
+        if (material->texture_specular.x >= 0.0f) {
+            *specular *= getColorTexture(coordinates, material->texture_specular, lod,
+                                         textures, textureRecords);
         }
     }
+#endif
+}
+
+float3 getTriangleLightColor(
+        LIGHT_MEM struct Light* light,
+        MATERIAL_MEM struct Material* material,
+        __private float3 ambient,
+        __private float3 diffuse,
+        __private float3 specular,
+        __private float3 lightVector,
+        __private float n_dot_l,
+        __private float3 observationVector,
+        __private float3 normalVector) {
+
+    float3 reflectionVector = normalize(-lightVector - normalVector * 2*n_dot_l);
+    float v_dot_r = dot(reflectionVector, observationVector);
+    if (v_dot_r < 0) {
+        v_dot_r = 0;
+    }
+    return diffuse * light->diffuse * n_dot_l +
+        specular * light->specular * pow(v_dot_r, material->shininess) +
+        ambient * light->ambient;
+}
+
+float3 getTriangleColor(
+        SPHERE_MEM struct Sphere* spheres,
+        int nSpheres,
+        SPHERE_MEM struct Grid* sphereGrid,
+        SPHERE_MEM int2* sphereCells,
+        SPHERE_MEM int* sphereIndices,
+        TRIANGLE_MEM struct Triangle* triangles,
+        int nTriangles,
+        BVH_MEM struct BVHNode* nodes,
+        BVH_MEM int* indices,
+        TRIANGLE_MEM struct Triangle* triangle,
+        MATERIAL_MEM struct Material* materials,
+        LIGHT_MEM struct Light* lights,
+        LIGHT_MEM struct Grid* lightGrid,
+        LIGHT_MEM int2* lightCells,
+        LIGHT_MEM int* lightIndices,
+        __private float3 crossPoint,
+        __private float3 observationVector,
+        __private float3 normalVector,
+        __private float3 barVector,
+        float coneWidth,
+        TEXTURES textures,
+        TEXTURE_MEM struct TextureRecord* textureRecords,
+        __private int* occluders) {
+
+    MATERIAL_MEM struct Material* material = materials + triangle->material;
+    float3 diffuse, specular, ambient;
+    getTriangleSurface(triangle, material, barVector, coneWidth,
+                       observationVector, textures, textureRecords,
+                       &ambient, &diffuse, &specular);
 
     if (dot(observationVector, normalVector) < 0) {
         normalVector = -normalVector; 
     }
 
     float3 resultColor = ambient * (float3)(0.6f, 0.6f, 0.6f);
-    for (int i = 0; i < nLights; i++) {
+    int2 cell = getLightCell(lightGrid, lightCells, crossPoint);
+    for (int j = cell.x; j < cell.x + cell.y; j++) {
+        int i = lightIndices[j];
         float3 lightVector = normalize(lights[i].position - crossPoint);
         float n_dot_l = dot(lightVector, normalVector);
-        float3 reflectionVector = normalize(-lightVector - normalVector * 2*n_dot_l);
 
         float dist = distance(crossPoint, lights[i].position);
-        if(n_dot_l > 0.0001f && !isInShadow(triangles, nTriangles, dist, lightVector, crossPoint)) {
-            float v_dot_r = dot(reflectionVector, observationVector);
-            if (v_dot_r < 0) {
-                v_dot_r = 0;
-            }
-            resultColor += diffuse * lights[i].diffuse * n_dot_l +
-                specular * lights[i].specular * pow(v_dot_r, triangle->material.shininess) +
-                ambient * lights[i].ambient;
+        float falloff = getLightFalloff(lights + i, dist);
+        if(n_dot_l > 0.0001f && falloff > 0 &&
+           !isInShadow(spheres, nSpheres, sphereGrid, sphereCells, sphereIndices,
+                       triangles, nTriangles, nodes, indices,
+                       dist, lightVector, crossPoint,
+                       occluders + i % OCCLUDER_CACHE_SIZE)) {
+            resultColor += falloff * getTriangleLightColor(
+                    lights + i, material, ambient, diffuse, specular,
+                    lightVector, n_dot_l, observationVector, normalVector);
         }
     }
     return resultColor;
 
 }
 
-__constant struct Sphere* getClosestSphere(
-        __constant struct Sphere* spheres,
+SPHERE_MEM struct Sphere* getClosestSphere(
+        SPHERE_MEM struct Sphere* spheres,
         const int n_spheres,
+        SPHERE_MEM struct Grid* sphereGrid,
+        SPHERE_MEM int2* sphereCells,
+        SPHERE_MEM int* sphereIndices,
         __private float* max_dist,
         __private float3 origin,
         __private float3 direction) {
 
-    __constant struct Sphere* sphere = 0;
+#ifndef HAS_SPHERES
+    return 0;
+#elif defined(USE_BVH)
+    if (n_spheres == 0) {
+        return 0;
+    }
+    int closest = traverseSphereGrid(spheres, sphereGrid, sphereCells,
+                                     sphereIndices, max_dist, origin,
+                                     direction, false);
+    return closest >= 0 ? spheres + closest : 0;
+#else
+    SPHERE_MEM struct Sphere* sphere = 0;
     float tempDist = *max_dist;
     for(int i = 0; i < n_spheres; i++) {
         tempDist = intersect_sphere(spheres + i, origin, direction);
@@ -338,16 +845,29 @@ __constant struct Sphere* getClosestSphere(
         }
     }
     return sphere;
+#endif
 }
 
-__constant struct Triangle* getClosestTriangle(
-        __constant struct Triangle* triangles,
+TRIANGLE_MEM struct Triangle* getClosestTriangle(
+        TRIANGLE_MEM struct Triangle* triangles,
         const int n_triangles,
+        BVH_MEM struct BVHNode* nodes,
+        BVH_MEM int* indices,
         __private float* max_dist,
         __private float3 origin,
         __private float3 direction) {
 
-    __constant struct Triangle* triangle = 0;
+#ifndef HAS_TRIANGLES
+    return 0;
+#elif defined(USE_BVH)
+    if (n_triangles == 0) {
+        return 0;
+    }
+    int closest = traverseTriangleBVH(triangles, nodes, indices, max_dist,
+                                      origin, direction, false);
+    return closest >= 0 ? triangles + closest : 0;
+#else
+    TRIANGLE_MEM struct Triangle* triangle = 0;
     float tempDist = *max_dist;
     for(int i = 0; i < n_triangles; i++) {
         tempDist = intersect_triagle(triangles + i, origin, direction);
@@ -359,6 +879,7 @@ __constant struct Triangle* getClosestTriangle(
         }
     }
     return triangle;
+#endif
 }
 
 
@@ -386,70 +907,96 @@ float3 trace(
         float3 origin,
         float3 direction,
         const int zFar,
-        __constant struct Light* lights,
-        const int nLights,
-        __constant struct Sphere* spheres,
+        MATERIAL_MEM struct Material* materials,
+        LIGHT_MEM struct Light* lights,
+        LIGHT_MEM struct Grid* lightGrid,
+        LIGHT_MEM int2* lightCells,
+        LIGHT_MEM int* lightIndices,
+        SPHERE_MEM struct Sphere* spheres,
         const int n_spheres,
-        __constant struct Triangle* triangles,
+        SPHERE_MEM struct Grid* sphereGrid,
+        SPHERE_MEM int2* sphereCells,
+        SPHERE_MEM int* sphereIndices,
+        TRIANGLE_MEM struct Triangle* triangles,
         const int n_triangles,
-        read_only image2d_array_t textures){
-
+        BVH_MEM struct BVHNode* nodes,
+        BVH_MEM int* indices,
+        TEXTURES textures,
+        TEXTURE_MEM struct TextureRecord* textureRecords,
+        __private int* occluders,
+        const float spread){
+
+    // spread is the angle of the ray cone, flat mirrors and glass keep it
     float3 color = (float3)(0,0,0);
     float mult = 1;
     float depth = 0;
-    uint stack[100];
-    stack[0] = 0;
-    stack[1] = 0;
+    struct RayTask tasks[TASK_QUEUE_SIZE];
+    int head = 0;
+    int tail = 0;
 
-    struct RayTask task = {direction, origin, mult, depth};
-    push_struct(stack, task);
+    push_task(tasks, head, &tail, direction, origin, mult, depth, 0.0f);
 
-    while(!empty(stack)) {   
-        task = pop_struct(stack);
-        origin = task.origin;
-        direction = task.direction;
-        depth = task.depth;
-        mult = task.mult;
+    while(head != tail) {
+        struct RayTask task = tasks[head & (TASK_QUEUE_SIZE - 1)];
+        head += 1;
+        direction = task.direction.xyz;
+        mult = task.direction.w;
+        origin = task.origin.xyz;
+        depth = task.origin.w;
+        float travelled = task.distance;
 
         float dist = zFar;
-        __constant struct Sphere* sphere = getClosestSphere(spheres, n_spheres,
+        SPHERE_MEM struct Sphere* sphere = getClosestSphere(spheres, n_spheres,
+                                                 sphereGrid, sphereCells, sphereIndices,
                                                  &dist, origin, direction);
-        __constant struct Triangle* triangle = getClosestTriangle(triangles, n_triangles,
+        TRIANGLE_MEM struct Triangle* triangle = getClosestTriangle(triangles, n_triangles,
+                                                 nodes, indices,
                                                  &dist, origin, direction);
 
         __private float3 normalVector;
         float3 phongColor = (float3)(0, 0, 0);
         origin = origin + direction * dist;
+        travelled += dist;
 
         if (triangle) {
             float3 barVector;
             normalVector = getTriangleNormal(triangle, origin, &barVector);
-
-            if (triangle->material.transparency > 0) {
-                float3 new_ray = get_refracted_ray(direction, normalVector, triangle->material.density, 1.0f);
-                if (depth < 3 && mult * triangle->material.transparency > 0.05) {
-                    struct RayTask task = {new_ray, origin, mult * triangle->material.transparency, depth+1};
-                    push_struct(stack, task);
+            MATERIAL_MEM struct Material* material = materials + triangle->material;
+
+#ifdef HAS_REFRACTION
+            if (material->transparency > 0) {
+                float3 new_ray = get_refracted_ray(direction, normalVector, material->density, 1.0f);
+                if (depth < MAX_DEPTH && mult * material->transparency > 0.05) {
+                    push_task(tasks, head, &tail, new_ray, origin,
+                              mult * material->transparency, depth+1, travelled);
                 }
             }
-            if (triangle->material.reflectiveness > 0) {
+#endif
+#ifdef HAS_REFLECTION
+            if (material->reflectiveness > 0) {
                 float3 new_ray = get_reflected_ray(direction, normalVector);
-                if (depth < 2 && mult * triangle->material.reflectiveness > 0.05) {
-                    struct RayTask task = {new_ray, origin, mult * triangle->material.reflectiveness, depth+1};
-                    push_struct(stack, task);
+                if (depth < MAX_DEPTH - 1 && mult * material->reflectiveness > 0.05) {
+                    push_task(tasks, head, &tail, new_ray, origin,
+                              mult * material->reflectiveness, depth+1, travelled);
                 }
-                mult = 1 - triangle->material.reflectiveness;
+                mult = 1 - material->reflectiveness;
             }
-            if (triangle->material.reflectiveness < 1 && triangle->material.transparency == 0) {
+#endif
+            if (material->reflectiveness < 1 && material->transparency == 0) {
                 phongColor = getTriangleColor(
+                        spheres, n_spheres,
+                        sphereGrid, sphereCells, sphereIndices,
                         triangles, n_triangles,
-                        triangle, lights,
-                        nLights,
+                        nodes, indices,
+                        triangle, materials, lights,
+                        lightGrid, lightCells, lightIndices,
                         origin,
                         -direction,
                         normalVector,
                         barVector,
-                        textures);
+                        spread * travelled,
+                        textures, textureRecords,
+                        occluders);
             }
             color += mult * phongColor;
         }
@@ -458,116 +1005,167 @@ float3 trace(
             normalVector = getSphereNormal(sphere, origin);
             color += mult * getSphereColor(
                     sphere,
+                    materials,
                     lights,
-                    nLights,
+                    lightGrid, lightCells, lightIndices,
                     origin,
                     -direction,
                     normalVector);
         }
         else {
             color += mult * (float3)(0.0f, 0.7f, 0.95f);
-            break;
+            continue;
         }
-        mult *= 0.25f;
-        direction = get_reflected_ray(direction, normalVector);
     }
     return color;
 }
 
+uint hash(uint x) {
+    // pcg output permutation, cheap and well mixed
+    uint state = x * 747796405u + 2891336453u;
+    uint word = ((state >> ((state >> 28u) + 4u)) ^ state) * 277803737u;
+    return (word >> 22u) ^ word;
+}
+
+float random_float(uint* state) {
+    *state = hash(*state);
+    return (*state >> 8) * (1.0f / 16777216.0f);
+}
+
+float2 getSampleOffset(
+        const int sample,
+        const int samples,
+        const bool jitter,
+        uint* state) {
+
+    float2 offset = (float2)(0.0f, 0.0f);
+    if (jitter) {
+        // samples are jittered inside the cells of a grid over the pixel
+        int columns = (int)ceil(sqrt((float)samples));
+        int rows = (samples + columns - 1) / columns;
+        offset.x = (sample % columns + random_float(state)) / columns;
+        offset.y = (sample / columns + random_float(state)) / rows;
+    }
+    return offset;
+}
+
 float3 getCameraRay(
-        __constant struct Camera* camera,
-        const int pixelX,
-        const int pixelY,
+        CAMERA_MEM struct Camera* camera,
+        const float pixelX,
+        const float pixelY,
         const int pixelWidth,
-        const int pixelHeight,
-        const int sample) { 
+        const int pixelHeight) {
     float distanceX = pixelX/(float)pixelWidth;
     float distanceY = pixelY/(float)pixelHeight;
     float3 worldPixel = camera->topLeftCorner + distanceX * camera->worldWidth * camera->rightVector;
     worldPixel -= distanceY * camera->worldHeight * camera->upVector;
 
-    switch(sample) {
-
-        case 0:
-            break;
-
-        case 1:
-            worldPixel += 1/(2*(float)pixelWidth) * camera->worldHeight * camera->upVector;
-            worldPixel += 1/2*(float)pixelHeight * camera->worldWidth * camera->rightVector;
-            break;
-
-        case 2:
-            worldPixel -= 1/(2*(float)pixelWidth) * camera->worldHeight * camera->upVector;
-            worldPixel += 1/(2*(float)pixelHeight) * camera->worldWidth * camera->rightVector;
-            break;
-        case 3:
-            worldPixel += 1/(2*(float)pixelWidth) * camera->worldHeight * camera->upVector;
-            worldPixel -= 1/(2*(float)pixelHeight) * camera->worldWidth * camera->rightVector;
-            break;
-        case 4:
-            worldPixel -= 1/(2*(float)pixelWidth) * camera->worldHeight * camera->upVector;
-            worldPixel -= 1/(2*(float)pixelHeight) * camera->worldWidth * camera->rightVector;
-            break;
-        case 5:
-            worldPixel += 1/(2*(float)pixelWidth) * camera->worldHeight * camera->upVector;
-            break;
-        case 6:
-            worldPixel -= 1/(2*(float)pixelWidth) * camera->worldHeight * camera->upVector;
-            break;
-        case 7:
-            worldPixel += 1/(2*(float)pixelHeight) * camera->worldWidth * camera->rightVector;
-            break;
-        case 8:
-            worldPixel -= 1/(2*(float)pixelHeight) * camera->worldWidth * camera->rightVector;
-            break;
+    return normalize(worldPixel - camera->position);
+}
+
+float getPixelSpread(
+        CAMERA_MEM struct Camera* camera,
+        const int pixelHeight) {
+
+    // angle a pixel covers, the image plane is zNear in front of the camera
+    float3 center = camera->topLeftCorner +
+        0.5f * camera->worldWidth * camera->rightVector -
+        0.5f * camera->worldHeight * camera->upVector;
+    return camera->worldHeight / (pixelHeight * distance(center, camera->position));
+}
+
+void storePixel(
+        float3 result,
+        const int pixel,
+        const int accumulatedFrames,
+        __global float* accumulation,
+        __global uchar* output) {
 
+    result = clamp(result, 0.0f, 1.0f);
 
+    if (accumulatedFrames >= 0) {
+        // running sum of every frame since the scene last changed
+        float3 sum = result;
+        if (accumulatedFrames > 0) {
+            sum += vload3(pixel, accumulation);
+        }
+        vstore3(sum, pixel, accumulation);
+        result = sum / (accumulatedFrames + 1);
     }
 
-    return normalize(worldPixel - camera->position);
+    output[pixel * 3] = convert_uchar(result.x * 255);
+    output[pixel * 3 + 1] = convert_uchar(result.y * 255);
+    output[pixel * 3 + 2] = convert_uchar(result.z * 255);
 }
 
-__kernel void get_image(__constant struct Camera* camera,
-        __constant struct Light* lights,
-        const int nLights,
-        __constant struct Sphere* spheres,
+__kernel void get_image(CAMERA_MEM struct Camera* camera,
+        MATERIAL_MEM struct Material* materials,
+        LIGHT_MEM struct Light* lights,
+        LIGHT_MEM struct Grid* lightGrid,
+        LIGHT_MEM int2* lightCells,
+        LIGHT_MEM int* lightIndices,
+        SPHERE_MEM struct Sphere* spheres,
         const int nSpheres,
-        __constant struct Triangle* triangles,
+        SPHERE_MEM struct Grid* sphereGrid,
+        SPHERE_MEM int2* sphereCells,
+        SPHERE_MEM int* sphereIndices,
+        TRIANGLE_MEM struct Triangle* triangles,
         const int nTriangles,
+        BVH_MEM struct BVHNode* nodes,
+        BVH_MEM int* indices,
         const int noise,
-        read_only image2d_array_t textures,
+        const int pixelWidth,
+        const int pixelHeight,
+        const int samples,
+        TEXTURES textures,
+        TEXTURE_MEM struct TextureRecord* textureRecords,
+        const int accumulatedFrames,
+        __global float* accumulation,
         __global uchar* output) {
 
+    // tiles are launched with a global offset, ids are frame coordinates
     int pixelX = get_global_id(0);
     int pixelY = get_global_id(1);
-    int pixelWidth = get_global_size(0) * noise;
-    int pixelHeight = get_global_size(1);
+
+    if (pixelX >= pixelWidth / noise || pixelY >= pixelHeight) {
+        return;
+    }
 
     if (noise > 1) {
         pixelX += pixelX * (noise - 1);
         pixelX += pixelY % noise;
     }
 
-    int samples = 1;
+    // accumulated frames need their own jitter, negative when disabled
+    uint state = hash(hash(max(accumulatedFrames, 0)) + pixelY * pixelWidth + pixelX);
+    bool jitter = samples > 1 || accumulatedFrames > 0;
     float3 result = (float3)(0.0f, 0.0f, 0.0f);
+    int occluders[OCCLUDER_CACHE_SIZE];
+    for (int i = 0; i < OCCLUDER_CACHE_SIZE; i++) {
+        occluders[i] = NO_OCCLUDER;
+    }
+    float spread = getPixelSpread(camera, pixelHeight);
 
     for(int i = 0; i < samples; i++) {
-
-    result += trace(camera->position,
-        getCameraRay(camera, pixelX,
-            pixelY, pixelWidth,
-            pixelHeight, i),
-        camera->zFar,
-        lights, nLights,
-        spheres, nSpheres,
-        triangles, nTriangles,
-        textures);
+        float2 offset = getSampleOffset(i, samples, jitter, &state);
+
+        result += trace(camera->position,
+            getCameraRay(camera, pixelX + offset.x,
+                pixelY + offset.y, pixelWidth,
+                pixelHeight),
+            camera->zFar,
+            materials,
+            lights, lightGrid, lightCells, lightIndices,
+            spheres, nSpheres, sphereGrid, sphereCells, sphereIndices,
+            triangles, nTriangles,
+            nodes, indices,
+            textures, textureRecords,
+            occluders,
+            spread);
     }
 
-    result  = result/samples;
+    result = result / samples;
 
-    result = clamp(result, 0.0f, 1.0f);
-    output[pixelY * pixelWidth * 3 + pixelX * 3 ] = convert_uchar(result.x * 255);
-    output[pixelY * pixelWidth * 3 + pixelX * 3 + 1] = convert_uchar(result.y * 255);
-    output[pixelY * pixelWidth * 3 + pixelX * 3 + 2] = convert_uchar(result.z * 255);
+    storePixel(result, pixelY * pixelWidth + pixelX,
+               accumulatedFrames, accumulation, output);
 }
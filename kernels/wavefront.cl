@@ -0,0 +1,288 @@
+// Wavefront path: instead of one work-item tracing a whole pixel, every
+// bounce runs as separate kernels over global queues. Work-items only
+// ever run the same stage, so glass and sky rays no longer diverge.
+// Built after raytracer.cl, whose intersection and shading it reuses.
+
+// queue counters, rays waiting for a bounce and shadow rays of a batch
+#define RAY_COUNT 0
+#define SHADOW_COUNT 1
+
+// xyz origin with the depth in w, xyz direction with the weight in w,
+// intersect() fills in the hit, distance is from the camera to the origin
+struct Ray {
+    float4 origin;
+    float4 direction;
+    int pixel;
+    int triangle;
+    int sphere;
+    float dist;
+    float distance;
+};
+
+// origin with the distance to the light in w, color the light adds
+// to the pixel if nothing is in the way
+struct ShadowRay {
+    float4 origin;
+    float4 direction;
+    float4 color;
+    int pixel;
+    int padding[3];
+};
+
+void atomic_add_float(volatile __global float* address, float value) {
+
+    union { uint word; float value; } old, sum;
+    do {
+        old.value = *address;
+        sum.value = old.value + value;
+    } while (atomic_cmpxchg((volatile __global uint*)address,
+                            old.word, sum.word) != old.word);
+}
+
+void addColor(__global float* radiance, const int pixel, float3 color) {
+
+    atomic_add_float(radiance + pixel * 3, color.x);
+    atomic_add_float(radiance + pixel * 3 + 1, color.y);
+    atomic_add_float(radiance + pixel * 3 + 2, color.z);
+}
+
+void pushRay(
+        __global struct Ray* rays,
+        const int capacity,
+        volatile __global int* count,
+        float3 origin,
+        float3 direction,
+        float mult,
+        float depth,
+        float distance,
+        const int pixel) {
+
+    // a full queue drops the ray like trace() does with its own
+    int slot = atomic_inc(count);
+    if (slot < capacity) {
+        struct Ray ray = {(float4)(origin, depth), (float4)(direction, mult),
+                          pixel, -1, -1, 0.0f, distance};
+        rays[slot] = ray;
+    }
+}
+
+__kernel void generate(
+        CAMERA_MEM struct Camera* camera,
+        const int noise,
+        const int pixelWidth,
+        const int pixelHeight,
+        const int samples,
+        const int accumulatedFrames,
+        __global struct Ray* rays,
+        const int capacity,
+        volatile __global int* counters) {
+
+    int pixelX = get_global_id(0);
+    int pixelY = get_global_id(1);
+
+    if (pixelX >= pixelWidth / noise || pixelY >= pixelHeight) {
+        return;
+    }
+
+    if (noise > 1) {
+        pixelX += pixelX * (noise - 1);
+        pixelX += pixelY % noise;
+    }
+
+    int pixel = pixelY * pixelWidth + pixelX;
+    // same sequence as get_image so both modes render the same samples
+    uint state = hash(hash(max(accumulatedFrames, 0)) + pixel);
+    bool jitter = samples > 1 || accumulatedFrames > 0;
+
+    for(int i = 0; i < samples; i++) {
+        float2 offset = getSampleOffset(i, samples, jitter, &state);
+        pushRay(rays, capacity, counters + RAY_COUNT, camera->position,
+                getCameraRay(camera, pixelX + offset.x, pixelY + offset.y,
+                             pixelWidth, pixelHeight),
+                1.0f, 0.0f, 0.0f, pixel);
+    }
+}
+
+__kernel void intersect(
+        CAMERA_MEM struct Camera* camera,
+        SPHERE_MEM struct Sphere* spheres,
+        const int nSpheres,
+        SPHERE_MEM struct Grid* sphereGrid,
+        SPHERE_MEM int2* sphereCells,
+        SPHERE_MEM int* sphereIndices,
+        TRIANGLE_MEM struct Triangle* triangles,
+        const int nTriangles,
+        BVH_MEM struct BVHNode* nodes,
+        BVH_MEM int* indices,
+        __global struct Ray* rays) {
+
+    __global struct Ray* ray = rays + get_global_id(0);
+    float3 origin = ray->origin.xyz;
+    float3 direction = ray->direction.xyz;
+
+    // trace() gets zFar as an int
+    float dist = (int)camera->zFar;
+    SPHERE_MEM struct Sphere* sphere = getClosestSphere(
+            spheres, nSpheres, sphereGrid, sphereCells, sphereIndices,
+            &dist, origin, direction);
+    TRIANGLE_MEM struct Triangle* triangle = getClosestTriangle(
+            triangles, nTriangles, nodes, indices, &dist, origin, direction);
+
+    ray->triangle = triangle ? triangle - triangles : -1;
+    ray->sphere = !triangle && sphere ? sphere - spheres : -1;
+    ray->dist = dist;
+}
+
+__kernel void shade(
+        CAMERA_MEM struct Camera* camera,
+        const int pixelHeight,
+        MATERIAL_MEM struct Material* materials,
+        LIGHT_MEM struct Light* lights,
+        LIGHT_MEM struct Grid* lightGrid,
+        LIGHT_MEM int2* lightCells,
+        LIGHT_MEM int* lightIndices,
+        SPHERE_MEM struct Sphere* spheres,
+        TRIANGLE_MEM struct Triangle* triangles,
+        TEXTURES textures,
+        TEXTURE_MEM struct TextureRecord* textureRecords,
+        __global struct Ray* rays,
+        const int start,
+        __global struct Ray* nextRays,
+        const int capacity,
+        __global struct ShadowRay* shadowRays,
+        volatile __global int* counters,
+        __global float* radiance) {
+
+    struct Ray ray = rays[start + get_global_id(0)];
+    float3 direction = ray.direction.xyz;
+    float mult = ray.direction.w;
+    float depth = ray.origin.w;
+    float3 origin = ray.origin.xyz + direction * ray.dist;
+    float travelled = ray.distance + ray.dist;
+
+    if (ray.triangle >= 0) {
+        TRIANGLE_MEM struct Triangle* triangle = triangles + ray.triangle;
+        MATERIAL_MEM struct Material* material = materials + triangle->material;
+        float3 barVector;
+        float3 normalVector = getTriangleNormal(triangle, origin, &barVector);
+
+        // same rules as trace(), new rays go to the next bounce
+#ifdef HAS_REFRACTION
+        if (material->transparency > 0) {
+            float3 newRay = get_refracted_ray(direction, normalVector, material->density, 1.0f);
+            if (depth < MAX_DEPTH && mult * material->transparency > 0.05) {
+                pushRay(nextRays, capacity, counters + RAY_COUNT, origin, newRay,
+                        mult * material->transparency, depth + 1, travelled,
+                        ray.pixel);
+            }
+        }
+#endif
+#ifdef HAS_REFLECTION
+        if (material->reflectiveness > 0) {
+            float3 newRay = get_reflected_ray(direction, normalVector);
+            if (depth < MAX_DEPTH - 1 && mult * material->reflectiveness > 0.05) {
+                pushRay(nextRays, capacity, counters + RAY_COUNT, origin, newRay,
+                        mult * material->reflectiveness, depth + 1, travelled,
+                        ray.pixel);
+            }
+            mult = 1 - material->reflectiveness;
+        }
+#endif
+        if (material->reflectiveness >= 1 || material->transparency != 0) {
+            return;
+        }
+
+        float3 diffuse, specular, ambient;
+        getTriangleSurface(triangle, material, barVector,
+                           getPixelSpread(camera, pixelHeight) * travelled,
+                           -direction, textures, textureRecords,
+                           &ambient, &diffuse, &specular);
+        if (dot(-direction, normalVector) < 0) {
+            normalVector = -normalVector;
+        }
+        addColor(radiance, ray.pixel,
+                 mult * ambient * (float3)(0.6f, 0.6f, 0.6f));
+
+        // lights are added by shadow() once it knows they are visible
+        int2 cell = getLightCell(lightGrid, lightCells, origin);
+        for (int j = cell.x; j < cell.x + cell.y; j++) {
+            LIGHT_MEM struct Light* light = lights + lightIndices[j];
+            float3 lightVector = normalize(light->position - origin);
+            float n_dot_l = dot(lightVector, normalVector);
+            float dist = distance(origin, light->position);
+            float falloff = getLightFalloff(light, dist);
+            if (n_dot_l <= 0.0001f || falloff <= 0) {
+                continue;
+            }
+            struct ShadowRay shadowRay;
+            shadowRay.origin = (float4)(origin, dist);
+            shadowRay.direction = (float4)(lightVector, 0.0f);
+            shadowRay.color = (float4)(mult * falloff * getTriangleLightColor(
+                    light, material, ambient, diffuse, specular,
+                    lightVector, n_dot_l, -direction, normalVector), 0.0f);
+            shadowRay.pixel = ray.pixel;
+            shadowRays[atomic_inc(counters + SHADOW_COUNT)] = shadowRay;
+        }
+    }
+    else if (ray.sphere >= 0) {
+        SPHERE_MEM struct Sphere* sphere = spheres + ray.sphere;
+        addColor(radiance, ray.pixel, mult * getSphereColor(
+                sphere, materials, lights, lightGrid, lightCells, lightIndices,
+                origin, -direction,
+                getSphereNormal(sphere, origin)));
+    }
+    else {
+        addColor(radiance, ray.pixel, mult * (float3)(0.0f, 0.7f, 0.95f));
+    }
+}
+
+__kernel void shadow(
+        SPHERE_MEM struct Sphere* spheres,
+        const int nSpheres,
+        SPHERE_MEM struct Grid* sphereGrid,
+        SPHERE_MEM int2* sphereCells,
+        SPHERE_MEM int* sphereIndices,
+        TRIANGLE_MEM struct Triangle* triangles,
+        const int nTriangles,
+        BVH_MEM struct BVHNode* nodes,
+        BVH_MEM int* indices,
+        __global struct ShadowRay* shadowRays,
+        __global float* radiance) {
+
+    // every shadow ray has its own work-item, nothing to cache
+    struct ShadowRay shadowRay = shadowRays[get_global_id(0)];
+    int occluder = NO_OCCLUDER;
+    if (!isInShadow(spheres, nSpheres, sphereGrid, sphereCells, sphereIndices,
+                    triangles, nTriangles, nodes, indices,
+                    shadowRay.origin.w, shadowRay.direction.xyz,
+                    shadowRay.origin.xyz, &occluder)) {
+        addColor(radiance, shadowRay.pixel, shadowRay.color.xyz);
+    }
+}
+
+__kernel void finish(
+        const int noise,
+        const int pixelWidth,
+        const int pixelHeight,
+        const int samples,
+        __global float* radiance,
+        const int accumulatedFrames,
+        __global float* accumulation,
+        __global uchar* output) {
+
+    int pixelX = get_global_id(0);
+    int pixelY = get_global_id(1);
+
+    if (pixelX >= pixelWidth / noise || pixelY >= pixelHeight) {
+        return;
+    }
+
+    if (noise > 1) {
+        pixelX += pixelX * (noise - 1);
+        pixelX += pixelY % noise;
+    }
+
+    int pixel = pixelY * pixelWidth + pixelX;
+    storePixel(vload3(pixel, radiance) / samples, pixel,
+               accumulatedFrames, accumulation, output);
+}
@@ -1,4 +1,5 @@
 import argparse
+from src.backend import Backend
 from src.engine import Engine
 
 
@@ -14,6 +15,36 @@ def get_args():
     parser.add_argument("--obj", type=str, default=None)
     parser.add_argument("--animation", action="store_true")
     parser.add_argument("--record", action="store_true")
+    parser.add_argument("--brute-force", action="store_true",
+                        help="Test every triangle instead of using the BVH")
+    parser.add_argument("--pipeline-depth", type=int, default=2,
+                        help="Frames rendered ahead of the displayed one, "
+                        "1 disables pipelining")
+    parser.add_argument("--samples", type=int, default=1,
+                        help="Antialiasing rays per pixel")
+    parser.add_argument("--no-accumulate", action="store_true",
+                        help="Don't average frames while the camera is still")
+    parser.add_argument("--wavefront", action="store_true",
+                        help="Trace with a kernel per bounce stage instead "
+                        "of one kernel per pixel")
+    parser.add_argument("--tile-size", type=str, default="0",
+                        help="Render in tiles of this many pixels per side, "
+                        "0 for whole frames, auto to pick the fastest")
+    parser.add_argument("--compress-textures", action="store_true",
+                        help="Keep textures BC1 compressed on the device")
+    parser.add_argument("--backend", type=str, default="opencl",
+                        choices=sorted(Backend.subclasses),
+                        help="Renderer, numpy is the slow reference")
+    parser.add_argument("--platform", type=str, default=None,
+                        help="OpenCL platform, by index or name")
+    parser.add_argument("--device", type=str, default=None,
+                        help="OpenCL devices by index or name separated by "
+                        "commas, all to split frames over every device")
+    parser.add_argument("--list-devices", action="store_true",
+                        help="Print the OpenCL platforms and devices")
+    parser.add_argument("--generic-kernel", action="store_true",
+                        help="Build every path of the kernel instead of "
+                        "only the ones the scene uses")
 
     return parser.parse_args()
 
@@ -21,6 +52,9 @@ def get_args():
 def main():
 
     args = get_args()
+    if args.list_devices:
+        Backend.subclasses["opencl"].list_devices()
+        return
     engine = Engine(
         "kernels/raytracer.cl",
         args.scene,
@@ -30,7 +64,18 @@ def main():
         args.obj,
         args.animation,
         args.record,
-        args.no_gui)
+        args.no_gui,
+        not args.brute_force,
+        args.pipeline_depth,
+        args.tile_size if args.tile_size == "auto" else int(args.tile_size),
+        args.samples,
+        not args.no_accumulate,
+        args.wavefront,
+        args.compress_textures,
+        args.backend,
+        args.platform,
+        args.device,
+        not args.generic_kernel)
     engine.run()
 
 
@@ -88,25 +88,24 @@ class Sphere(object):
 
 
 class Light(object):
-    def __init__(self, position, ambient, specular, diffuse):
+    def __init__(self, position, ambient, specular, diffuse, radius=0):
         self.position = position
-        self.material = Material(ambient, specular, diffuse)
+        self.ambient = ambient
+        self.specular = specular
+        self.diffuse = diffuse
+        self.radius = radius
 
 
 class Triangle(object):
     def __init__(self, point_a, point_b, point_c):
-        self.pointA = point_a
-        self.pointB = point_b
-        self.pointC = point_c
+        self.vertices = [point_a, point_b, point_c]
 
         vec_ab = point_b - point_a
         vec_ac = point_c - point_a
         normal = vec_ab.cross(vec_ac)
         normal.normalize()
 
-        self.normalA = normal
-        self.normalB = normal
-        self.normalC = normal
+        self.normals = [normal, normal, normal]
         self.material = Material(Vector3.get_random(),
                                  Vector3.get_random(),
                                  Vector3.get_random())
@@ -166,6 +165,14 @@ def get_args():
     main_parser = argparse.ArgumentParser(description="Scene Generator")
     main_parser.add_argument("--lights", type=int, help="Number of lights "
                              "(default: %(default)s)", default=3)
+    main_parser.add_argument("--light-radius", type=float,
+                             help="Distance the lights reach, 0 for the "
+                             "whole scene (default: %(default)s)", default=0)
+    main_parser.add_argument("--seed", type=int, help="Seed of the random "
+                             "positions and colors, the same scene every "
+                             "time when given", default=None)
+    main_parser.add_argument("--output", type=str, help="Scene file "
+                             "(default: %(default)s)", default="scene.json")
 
     subparsers = main_parser.add_subparsers(dest="parser_name")
     subparsers.required = True
@@ -236,13 +243,14 @@ def get_camera():
                   1, 10, 90)
 
 
-def get_lights(n_lights):
+def get_lights(n_lights, radius):
     lights = []
     for _ in range(n_lights):
         light = Light(Vector3.get_random(-10, 10),
                       Vector3.get_random(),
                       Vector3.get_random(),
-                      Vector3.get_random())
+                      Vector3.get_random(),
+                      radius)
         lights.append(light)
 
     return lights
@@ -283,9 +291,10 @@ def main():
 
     output = dict()
     args = get_args()
+    random.seed(args.seed)
     # output["Camera"] = [get_camera()]
     # output["Scene"] = get_scene_config()
-    output["Light"] = get_lights(args.lights)
+    output["Light"] = get_lights(args.lights, args.light_radius)
 
     options = {"random":
                lambda: generate_random_scene(args.spheres, args.triangles),
@@ -296,7 +305,7 @@ def main():
 
     output.update(options[args.parser_name]())
 
-    with open('scene.json', 'w') as outfile:
+    with open(args.output, 'w') as outfile:
         json.dump(output, outfile, cls=CommonEncoder)
 
 if __name__ == "__main__":
@@ -0,0 +1,26 @@
+class Backend(object):
+
+    # renderers Engine can drive, by name; they render with run() and hand
+    # out frames with get_result()
+    subclasses = {}
+
+    @classmethod
+    def register_object(cls, name):
+
+        def decorator(subclass):
+            cls.subclasses[name] = subclass
+            return subclass
+
+        return decorator
+
+    @classmethod
+    def create(cls, name, scene, width, height, noise, **options):
+
+        if name not in cls.subclasses:
+            raise ValueError("Bad backend name: {}".format(name))
+        return cls.subclasses[name].from_options(
+            scene, width, height, noise, **options)
+
+    @classmethod
+    def from_options(cls, scene, width, height, noise, **options):
+        raise NotImplementedError
@@ -0,0 +1,101 @@
+import datetime
+
+from src.camera_path import CameraPath
+from src.denoiser.base import Denoiser
+from src.frame_writer import FrameWriter
+from src.objects.camera import Camera
+from src.opencl_connector import Connector
+from src.scene import Scene
+
+
+class BatchRenderer(object):
+
+    def __init__(
+            self, kernel_filename, scene_filename, width, height,
+            noise=1, obj=None, camera_path=None, output="frames",
+            image_format="png", workers=None, denoiser=None,
+            use_bvh=True, pipeline_depth=2, samples=1, wavefront=False):
+
+        self.width, self.height = width, height
+        self.timings = dict.fromkeys(
+                ["enqueue", "render", "denoise", "submit", "encode"], 0)
+
+        start = datetime.datetime.now()
+        scene = Scene(None, None)
+        scene.load_from_json(scene_filename)
+        if obj:
+            scene.load_from_mesh(obj)
+        self.camera = Camera(width, height)
+        if camera_path:
+            self.camera_path = CameraPath.load(camera_path)
+        else:
+            self.camera_path = CameraPath.from_actions(
+                    Camera(width, height))
+        scene.add_object(self.camera)
+        self.connector = Connector(
+                kernel_filename, scene, width, height, noise, use_bvh,
+                pipeline_depth, samples=samples, wavefront=wavefront)
+        self.denoiser = None
+        if denoiser:
+            self.denoiser = Denoiser.create(denoiser, width, height)
+        self.writer = FrameWriter(
+                output, width, height, image_format, workers)
+        self.setup_time = self.elapsed(start)
+
+    @staticmethod
+    def elapsed(start):
+        return (datetime.datetime.now() - start).total_seconds()
+
+    def run(self, start_frame=0, end_frame=None):
+
+        if end_frame is None:
+            end_frame = len(self.camera_path)
+        frames = list(range(start_frame, end_frame))
+        queued = 0
+
+        def enqueue():
+            nonlocal queued
+            point = datetime.datetime.now()
+            self.camera_path.apply(self.camera, frames[queued])
+            self.connector.run()
+            queued += 1
+            self.timings["enqueue"] += self.elapsed(point)
+
+        start = datetime.datetime.now()
+        while queued < min(len(frames), self.connector.pipeline_depth):
+            enqueue()
+
+        for frame in frames:
+            point = datetime.datetime.now()
+            image = self.connector.get_result(True)
+            self.timings["render"] += self.elapsed(point)
+
+            if self.denoiser:
+                point = datetime.datetime.now()
+                image = self.denoiser.denoise(image, self.connector)
+                self.timings["denoise"] += self.elapsed(point)
+
+            point = datetime.datetime.now()
+            self.writer.write(frame, image)
+            self.timings["submit"] += self.elapsed(point)
+
+            if queued < len(frames):
+                enqueue()
+
+        self.writer.close()
+        self.timings["encode"] = self.writer.encode_time
+        total = self.elapsed(start)
+        self.report(len(frames), total)
+
+    def report(self, frames, total):
+
+        print("Rendered {} frames in {:.2f}s ({:.2f} fps), "
+              "setup {:.2f}s".format(
+                  frames, total, frames / total if total else 0,
+                  self.setup_time))
+        for stage, value in self.timings.items():
+            per_frame = value / frames if frames else 0
+            print("{:>8}: {:8.3f}s total {:8.4f}s/frame".format(
+                stage, value, per_frame))
+        print("{:>8}: {:8.3f}s blocked on encoder workers".format(
+            "writer", self.writer.wait_time))
@@ -0,0 +1,182 @@
+import hashlib
+import os
+
+import numpy as np
+import pyopencl as cl
+import pyopencl.cltypes  # noqa: F401
+
+from src.cache import get_cache_dir
+
+
+class BVH(object):
+
+    # "first" is the left child index for inner nodes (the right child
+    # is always first + 1) and the first entry in indices for leaves.
+    node_struct = np.dtype(
+        [("bounds_min", cl.cltypes.float3),
+         ("bounds_max", cl.cltypes.float3),
+         ("first", np.int32),
+         ("count", np.int32),
+         ("padding", np.int32, 2)])
+
+    # keep in sync with BVH_STACK_SIZE in kernels/raytracer.cl
+    max_depth = 30
+
+    def __init__(self, bounds_min, bounds_max, n_bins=16, leaf_size=4):
+        self.n_bins = n_bins
+        self.leaf_size = leaf_size
+        self.bounds_min = np.asarray(bounds_min, dtype=np.float32)
+        self.bounds_max = np.asarray(bounds_max, dtype=np.float32)
+        self.centroids = (self.bounds_min + self.bounds_max) / 2
+        self.indices = np.arange(len(self.bounds_min), dtype=np.int32)
+        self.nodes = None
+        self.build()
+
+    @classmethod
+    def from_vertices(cls, vertices, **kwargs):
+
+        bounds_min = vertices.min(axis=1)
+        bounds_max = vertices.max(axis=1)
+        # intersect_triagle accepts hits slightly outside of the edges
+        padding = 0.001 * (bounds_max - bounds_min).max(axis=1, keepdims=True)
+        return cls(bounds_min - padding, bounds_max + padding, **kwargs)
+
+    @classmethod
+    def from_triangles(cls, triangles, **kwargs):
+
+        return cls.from_vertices(np.array(
+                [t.vertices for t in triangles],
+                dtype=np.float32).reshape(-1, 3, 3), **kwargs)
+
+    @classmethod
+    def from_packed(cls, triangles, **kwargs):
+
+        # vertices are the first three float3 of Triangle.triangle_struct
+        triangles = np.asarray(triangles)
+        words = triangles.view(np.float32).reshape(
+                len(triangles), triangles.dtype.itemsize // 4)
+        return cls.from_vertices(
+                words[:, :12].reshape(-1, 3, 4)[..., :3], **kwargs)
+
+    @classmethod
+    def from_packed_cached(cls, triangles):
+
+        # the build is slow in Python, meshes reuse their last one
+        filename = os.path.join(
+            get_cache_dir("bvh"), hashlib.sha1(triangles).hexdigest() + ".npz")
+        if os.path.exists(filename):
+            return cls.load(filename)
+        bvh = cls.from_packed(triangles)
+        bvh.save(filename)
+        return bvh
+
+    @classmethod
+    def load(cls, filename):
+
+        bvh = cls.__new__(cls)
+        with np.load(filename) as data:
+            bvh.nodes = data["nodes"]
+            bvh.indices = data["indices"]
+        return bvh
+
+    def save(self, filename):
+        np.savez(filename, nodes=self.nodes, indices=self.indices)
+
+    @staticmethod
+    def get_area(bounds_min, bounds_max):
+        size = np.maximum(bounds_max - bounds_min, 0)
+        return 2 * (size[..., 0] * size[..., 1] +
+                    size[..., 1] * size[..., 2] +
+                    size[..., 2] * size[..., 0])
+
+    def find_split(self, idx):
+        # binned SAH over all three axes at once
+        centroids = self.centroids[idx]
+        c_min = centroids.min(axis=0)
+        extent = centroids.max(axis=0) - c_min
+        valid = extent > 0
+        if not valid.any():
+            return None
+
+        scale = np.where(valid, self.n_bins / np.where(valid, extent, 1), 0)
+        bins = ((centroids - c_min) * scale).astype(np.int32)
+        np.clip(bins, 0, self.n_bins - 1, out=bins)
+
+        flat = (bins + np.arange(3) * self.n_bins).ravel()
+        size = 3 * self.n_bins
+        counts = np.bincount(flat, minlength=size).reshape(3, self.n_bins)
+        bin_min = np.full((size, 3), np.inf, dtype=np.float32)
+        bin_max = np.full((size, 3), -np.inf, dtype=np.float32)
+        np.minimum.at(bin_min, flat, np.repeat(self.bounds_min[idx], 3, 0))
+        np.maximum.at(bin_max, flat, np.repeat(self.bounds_max[idx], 3, 0))
+        bin_min = bin_min.reshape(3, self.n_bins, 3)
+        bin_max = bin_max.reshape(3, self.n_bins, 3)
+
+        left_count = np.cumsum(counts, axis=1)[:, :-1]
+        right_count = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1][:, 1:]
+        with np.errstate(invalid="ignore"):
+            left_area = self.get_area(
+                    np.minimum.accumulate(bin_min, axis=1),
+                    np.maximum.accumulate(bin_max, axis=1))[:, :-1]
+            right_area = self.get_area(
+                    np.minimum.accumulate(bin_min[:, ::-1], axis=1),
+                    np.maximum.accumulate(bin_max[:, ::-1], axis=1)
+                    )[:, ::-1][:, 1:]
+            cost = left_area * left_count + right_area * right_count
+        cost[(left_count == 0) | (right_count == 0)] = np.inf
+        cost[~valid] = np.inf
+
+        axis, split = np.unravel_index(np.argmin(cost), cost.shape)
+        if not np.isfinite(cost[axis, split]):
+            return None
+
+        return cost[axis, split], bins[:, axis] <= split
+
+    def build(self):
+
+        nodes = [None]
+        # node index, first, end, depth
+        stack = [(0, 0, len(self.indices), 0)]
+
+        while stack:
+            node, start, end, depth = stack.pop()
+            idx = self.indices[start:end]
+            if len(idx):
+                b_min = self.bounds_min[idx].min(axis=0)
+                b_max = self.bounds_max[idx].max(axis=0)
+            else:
+                b_min = b_max = np.zeros(3, dtype=np.float32)
+
+            split = None
+            if len(idx) > self.leaf_size and depth < self.max_depth:
+                split = self.find_split(idx)
+                leaf_cost = self.get_area(b_min, b_max) * len(idx)
+                if split is not None and split[0] >= leaf_cost and \
+                        len(idx) <= 4 * self.leaf_size:
+                    split = None
+
+            if split is None:
+                nodes[node] = (b_min, b_max, start, len(idx))
+                continue
+
+            mask = split[1]
+            n_left = int(mask.sum())
+            self.indices[start:end] = np.concatenate((idx[mask], idx[~mask]))
+
+            left = len(nodes)
+            nodes += [None, None]
+            nodes[node] = (b_min, b_max, left, 0)
+            stack.append((left + 1, start + n_left, end, depth + 1))
+            stack.append((left, start, start + n_left, depth + 1))
+
+        b_min, b_max, first, count = zip(*nodes)
+        self.nodes = np.zeros(len(nodes), dtype=self.node_struct)
+        words = self.nodes.view(np.float32).reshape(len(nodes), -1)
+        words[:, 0:3] = b_min
+        words[:, 4:7] = b_max
+        words = self.nodes.view(np.int32).reshape(len(nodes), -1)
+        words[:, 8] = first
+        words[:, 9] = count
+
+        if not len(self.indices):
+            self.indices = np.zeros(1, dtype=np.int32)
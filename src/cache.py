@@ -0,0 +1,10 @@
+import os
+
+
+def get_cache_dir(*parts):
+
+    root = os.environ.get(
+            "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    path = os.path.join(root, "raytracer", *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
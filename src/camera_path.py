@@ -0,0 +1,117 @@
+import json
+import numpy as np
+
+
+def get_action_list():
+    action_list = []
+    action_list += ["Nothing"] * 10
+    action_list += ["q"] * 60
+    action_list += ["w"] * 250
+    action_list += ["Up"] * 30
+    action_list += ["Nothing"] * 10
+    action_list += ["Down"] * 30
+    action_list += ["q"] * 90
+    action_list += ["e"] * 150
+    action_list += ["w"] * 280
+    action_list += ["e"] * 45
+    action_list += ["Up"] * 30
+    action_list += ["Nothing"] * 10
+    action_list += ["Down"] * 30
+    action_list += ["e"] * 90
+    action_list += ["q"] * 45
+    action_list += ["w"] * 125
+    action_list += ["e"] * 90
+    action_list += ["w"] * 60
+    action_list += ["e"] * 365
+
+    return action_list
+
+
+class CameraPath(object):
+
+    def __init__(self, keyframes):
+        # keyframes: [{"frame": 0, "position": [..], "direction": [..],
+        #              "up": [..]}, ...], "up" is optional
+        keyframes = sorted(keyframes, key=lambda k: k["frame"])
+        self.frames = np.array([k["frame"] for k in keyframes])
+        self.positions = np.array(
+                [k["position"] for k in keyframes], dtype=np.float64)
+        self.directions = np.array(
+                [k["direction"] for k in keyframes], dtype=np.float64)
+        self.ups = np.array(
+                [k.get("up", [0, 1, 0]) for k in keyframes], dtype=np.float64)
+
+    def __len__(self):
+        return int(self.frames[-1]) + 1
+
+    @classmethod
+    def load(cls, filename):
+
+        with open(filename) as f:
+            return cls(json.load(f))
+
+    def save(self, filename):
+
+        keyframes = [
+            {"frame": int(frame),
+             "position": self.positions[i].tolist(),
+             "direction": self.directions[i].tolist(),
+             "up": self.ups[i].tolist()}
+            for i, frame in enumerate(self.frames)]
+        with open(filename, "w") as f:
+            json.dump(keyframes, f)
+
+    @classmethod
+    def from_actions(cls, camera, actions=None):
+        # replays key presses the same way Engine.animation_run does
+        if actions is None:
+            actions = get_action_list()
+
+        keyframes = []
+        for frame, action in enumerate(actions):
+            camera.move(
+                    action == "w", action == "s",
+                    action == "a", action == "d")
+            camera.rotate(
+                    action == "Up", action == "Left",
+                    action == "Down", action == "Right")
+            camera.rotate_off_its_axis(action == "q", action == "e")
+            keyframes.append(
+                {"frame": frame,
+                 "position": camera.position.tolist(),
+                 "direction": camera.direction.tolist(),
+                 "up": camera.up.tolist()})
+
+        return cls(keyframes)
+
+    @classmethod
+    def orbit(cls, center, distance, frames, keyframes=16, height=0.5):
+        # one turn around center, looking at it from a little above
+        center = np.asarray(center, dtype=np.float64)
+        path = []
+        for i in range(keyframes + 1):
+            angle = 2 * np.pi * i / keyframes
+            offset = np.array([np.sin(angle), height, np.cos(angle)])
+            offset *= distance / np.linalg.norm(offset)
+            path.append(
+                {"frame": (frames - 1) * i / keyframes,
+                 "position": (center + offset).tolist(),
+                 "direction": (-offset).tolist()})
+
+        return cls(path)
+
+    def get(self, frame):
+
+        def interpolate(values):
+            return np.array([
+                np.interp(frame, self.frames, values[:, i])
+                for i in range(3)])
+
+        return (interpolate(self.positions),
+                interpolate(self.directions),
+                interpolate(self.ups))
+
+    def apply(self, camera, frame):
+
+        position, direction, up = self.get(frame)
+        camera.set_orientation(position, direction, up)
@@ -4,7 +4,9 @@ from src.denoiser.mean_pixel import MeanPixel  # noqa: F401
 from src.denoiser.median_pixel import MedianPixel  # noqa: F401
 from src.denoiser.cnn import CnnAutoencoder
 
-from src.opencl_connector import Connector
+from src.backend import Backend
+from src.opencl_connector import Connector  # noqa: F401
+from src.numpy_connector import NumpyConnector  # noqa: F401
 from src.gui.main_window import MainWindow
 from src.denoiser.base import Denoiser
 from src.scene import Scene
@@ -13,14 +15,15 @@ gi.require_version('Gtk', '3.0')  # noqa: E402
 from gi.repository import Gtk
 
 from src.objects.camera import Camera
+from src.camera_path import get_action_list
+from src.frame_writer import FrameWriter
 from multiprocessing import Pipe, Process
 import datetime
-import png
-import numpy as np
-import os
 
 
 MS_PER_UPDATE = 0.02
+# shortest time between two partial frames sent to the GUI
+TILE_UPDATE = 0.05
 
 
 def gui_worker(child_conn, w=300, h=300):
@@ -35,13 +38,16 @@ class Engine(object):
 
     def __init__(
             self, kernel_filename, scene_filename,
-            width, height, noise, obj, animation, record, no_gui):
+            width, height, noise, obj, animation, record, no_gui,
+            use_bvh=True, pipeline_depth=2, tile_size=0, samples=1,
+            accumulate=True, wavefront=False, compress_textures=False,
+            backend="opencl", platform=None, devices=None, specialize=True):
 
         self._run = self.animation_run if animation else self.normal_run
         self.record = record
         self.no_gui = no_gui
         if self.record:
-            os.makedirs("animation")
+            self.writer = FrameWriter("animation", width, height)
         self.frame = 0
         self.wait = animation
         self.width, self.height = width, height
@@ -52,8 +58,15 @@ class Engine(object):
             scene.load_from_mesh(obj)
         self.camera = Camera(width, height)
         scene.add_object(self.camera)
-        self.connector = Connector(
-                kernel_filename, scene, width, height, noise)
+        self.connector = Backend.create(
+                backend, scene, width, height, noise,
+                filename=kernel_filename, use_bvh=use_bvh,
+                pipeline_depth=pipeline_depth, tile_size=tile_size,
+                samples=samples, accumulate=accumulate, wavefront=wavefront,
+                compress_textures=compress_textures, platform=platform,
+                devices=devices, specialize=specialize)
+        # slow frames are shown tile by tile as they are rendered
+        self.stream = bool(self.connector.tile_size) and not self.no_gui
 
         if not self.no_gui:
             self.parent_conn, child_conn = Pipe()
@@ -112,7 +125,7 @@ class Engine(object):
         self.previous = self.current
         self.lag += self.elapsed
 
-        if self.parent_conn.poll():
+        if not self.no_gui and self.parent_conn.poll():
             try:
                 msg = self.parent_conn.recv()
             except EOFError:
@@ -126,29 +139,7 @@ class Engine(object):
         return True
 
     def get_action_list(self):
-        action_list = []
-        action_list += ["Nothing"] * 10
-        action_list += ["q"] * 60
-        action_list += ["w"] * 250
-        action_list += ["Up"] * 30
-        action_list += ["Nothing"] * 10
-        action_list += ["Down"] * 30
-        action_list += ["q"] * 90
-        action_list += ["e"] * 150 
-        action_list += ["w"] * 280
-        action_list += ["e"] * 45
-        action_list += ["Up"] * 30
-        action_list += ["Nothing"] * 10
-        action_list += ["Down"] * 30
-        action_list += ["e"] * 90
-        action_list += ["q"] * 45
-        action_list += ["w"] * 125
-        action_list += ["e"] * 90
-        action_list += ["w"] * 60
-        action_list += ["e"] * 365
-
-
-        return action_list
+        return get_action_list()
 
     def action_generator(self):
 
@@ -176,14 +167,19 @@ class Engine(object):
 
     def run(self):
 
-        self.connector.run()
+        # keep the device busy while the host handles the previous frame
+        for _ in range(self.connector.pipeline_depth):
+            self.connector.run()
         time_point_a = datetime.datetime.now()
         total = 0
+        frames = 0
         self.previous = datetime.datetime.now()
         self.lag = 0
         while self.running:
             if not self._run():
                 break
+            if self.stream and not self.stream_tiles():
+                break
             image = self.connector.get_result(self.wait)
             if image is not None:
                 image = self.denoiser.denoise(image, self.connector)
@@ -191,6 +187,7 @@ class Engine(object):
                 diff = time_point_b - time_point_a
                 diff = diff.total_seconds()
                 total += diff
+                frames += 1
                 print("frame: ", diff)
                 time_point_a = time_point_b
                 if self.record:
@@ -203,10 +200,31 @@ class Engine(object):
                         break
                 self.connector.run()
 
+        if frames:
+            print("Frames: {}, {:.2f} fps (pipeline depth {})".format(
+                frames, frames / total, self.connector.pipeline_depth))
         print("Quitting")
-        self.parent_conn.close()
-        self.gui_process.terminate()
-        self.gui_process.join()
+        if self.record:
+            self.writer.close()
+        if not self.no_gui:
+            self.parent_conn.close()
+            self.gui_process.terminate()
+            self.gui_process.join()
+
+    def stream_tiles(self):
+
+        last = datetime.datetime.now()
+        for tile, image in self.connector.iter_tiles():
+            now = datetime.datetime.now()
+            if (now - last).total_seconds() < TILE_UPDATE:
+                continue
+            last = now
+            try:
+                self.parent_conn.send(image.tobytes())
+            except BrokenPipeError:
+                self.running = False
+                return False
+        return True
 
     def send_and_query(self, status):
         image = self.connector.get_result(self.wait)
@@ -219,9 +237,5 @@ class Engine(object):
 
     def save_frame(self, data):
 
-        data = np.reshape(data, (self.height, self.width*3))
-        with open("animation_cnn/{}.png".format(self.frame), "wb") as f:
-            w = png.Writer(self.width, self.height)
-            w.write(f, data)
-
+        self.writer.write(self.frame, data)
         self.frame += 1
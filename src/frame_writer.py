@@ -0,0 +1,68 @@
+import collections
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import png
+
+
+def write_frame(filename, image, width, height):
+
+    start = time.time()
+    image = np.reshape(image, (height, width, 3))
+    if filename.endswith(".exr"):
+        # OpenCV only writes EXR when asked to before it is imported
+        os.environ.setdefault("OPENCV_IO_ENABLE_OPENEXR", "1")
+        import cv2
+        cv2.imwrite(filename, image[:, :, ::-1].astype(np.float32) / 255)
+    else:
+        with open(filename, "wb") as f:
+            w = png.Writer(width, height, greyscale=False)
+            w.write(f, np.reshape(image, (height, width * 3)))
+
+    return time.time() - start
+
+
+class FrameWriter(object):
+
+    def __init__(
+            self, directory, width, height, image_format="png",
+            workers=None):
+        self.directory = directory
+        self.width = width
+        self.height = height
+        self.image_format = image_format
+        workers = workers or os.cpu_count()
+        self.pool = ProcessPoolExecutor(workers)
+        # enough to keep every worker busy without piling frames in memory
+        self.max_pending = 2 * workers
+        self.pending = collections.deque()
+        self.encode_time = 0
+        self.wait_time = 0
+        self.frames = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, frame, image):
+
+        while len(self.pending) >= self.max_pending:
+            self.collect()
+
+        filename = os.path.join(
+                self.directory, "{}.{}".format(frame, self.image_format))
+        # the image may live in a buffer that is reused for the next frames
+        self.pending.append(self.pool.submit(
+            write_frame, filename, np.array(image), self.width, self.height))
+
+    def collect(self):
+
+        start = time.time()
+        self.encode_time += self.pending.popleft().result()
+        self.wait_time += time.time() - start
+        self.frames += 1
+
+    def close(self):
+
+        while self.pending:
+            self.collect()
+        self.pool.shutdown()
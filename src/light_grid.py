@@ -0,0 +1,21 @@
+from src.sphere_grid import SphereGrid
+
+
+class LightGrid(SphereGrid):
+
+    # a light reaches the sphere of its radius, lights without one are
+    # everywhere and end up in every cell
+    def __init__(self, positions, radii, lights_per_cell=2,
+                 max_resolution=32):
+        super(LightGrid, self).__init__(
+            positions, radii, lights_per_cell, max_resolution)
+
+    @classmethod
+    def from_lights(cls, lights, **kwargs):
+
+        return cls([light.position for light in lights],
+                   [light.radius or 0 for light in lights], **kwargs)
+
+    @property
+    def max_lights(self):
+        return self.max_count
@@ -58,6 +58,23 @@ class Material(object):
         if self.transparency > 0:
             self.reflectiveness = 1 - self.transparency
 
+    def get_args(self):
+
+        # keyword arguments that create an equal material
+        return dict(
+            ambient=list(self.ambient),
+            diffuse=list(self.diffuse),
+            specular=list(self.specular),
+            emissive=list(self.emissive),
+            transparency=self.transparency,
+            optical_density=self.optical_density,
+            shininess=self.shininess,
+            reflectiveness=self.reflectiveness,
+            texture_diffuse=list(self.texture_diffuse),
+            texture_ambient=list(self.texture_ambient),
+            texture_specular_color=list(self.texture_specular),
+            texture_bump=list(self.texture_bump))
+
     def _get_cl_repr(self):
 
         return np.array((cl.array.vec.make_float3(*self.ambient),
@@ -0,0 +1,628 @@
+import collections
+
+import numpy as np
+
+from src.backend import Backend
+from src.bvh import BVH
+from src.objects.base import BaseObject
+
+
+# the same constants as kernels/raytracer.cl
+EPSILON = np.float32(0.0001)
+SKY = np.array([0, 0.7, 0.95], dtype=np.float32)
+# pairs of rays and primitives tested at once without a BVH
+BATCH = 2**20
+
+
+def dot(a, b):
+    return (a * b).sum(axis=-1)
+
+
+def normalize(a):
+    return a / np.linalg.norm(a, axis=-1, keepdims=True)
+
+
+def mix(a, b, t):
+    return a + (b - a) * t
+
+
+def pcg_hash(x):
+    # hash() of the kernel on uint32 arrays, overflow wraps the same way
+    state = x * np.uint32(747796405) + np.uint32(2891336453)
+    word = ((state >> ((state >> np.uint32(28)) + np.uint32(4))) ^ state) * \
+        np.uint32(277803737)
+    return (word >> np.uint32(22)) ^ word
+
+
+@Backend.register_object("numpy")
+class NumpyConnector(Backend):
+
+    # Renders the scene like get_image in kernels/raytracer.cl, with whole
+    # batches of rays at once. Slow, but needs no OpenCL platform and is
+    # the reference the kernels are checked against.
+
+    updatable = ("Camera", "Light", "Sphere")
+
+    def __init__(
+            self, scene, width, height, noise=1, use_bvh=True, samples=1,
+            accumulate=False, mipmaps=True):
+        self.scene = scene
+        self.width = width
+        self.height = height
+        self.noise = noise
+        self.use_bvh = use_bvh
+        self.samples = samples
+        self.accumulate = accumulate
+        self.mipmaps = mipmaps
+        # frames are rendered by run() itself, nothing is in flight
+        self.pipeline_depth = 1
+        self.tile_size = 0
+        self.setup()
+
+    @classmethod
+    def from_options(cls, scene, width, height, noise, use_bvh=True,
+                     samples=1, accumulate=False, mipmaps=True, **options):
+        # pipelining, tiles and device memory layout mean nothing here
+        return cls(scene, width, height, noise, use_bvh, samples, accumulate,
+                   mipmaps)
+
+    def setup(self):
+
+        get = BaseObject.get_field
+        materials = self.scene.get_packed_materials()
+        self.materials = {
+            name: get(materials, name).astype(np.float32)
+            for name in materials.dtype.names}
+
+        triangles = self.scene.get_packed("Triangle")
+        if triangles is None:
+            triangles = np.zeros(0, dtype=BaseObject.subclasses[
+                "Triangle"].triangle_struct)
+        vertices = get(triangles, "vertices")
+        self.triangle_points = vertices[:, 0]
+        self.triangle_edges = (vertices[:, 1] - vertices[:, 0],
+                               vertices[:, 2] - vertices[:, 0])
+        self.triangle_normals = get(triangles, "normals")
+        self.triangle_uvs = get(triangles, "textures")
+        self.triangle_materials = triangles["material"]
+        self.triangle_bvh = None
+        if self.use_bvh and len(triangles):
+            self.triangle_bvh = self.get_nodes(
+                BVH.from_packed_cached(triangles))
+
+        atlas = self.scene.get_packed_textures()
+        self.atlas = atlas.image.astype(np.float32) / 255
+        records = atlas.records
+        self.texture_records = {
+            name: get(records, name) for name in records.dtype.names}
+
+        self.image = np.zeros(self.width * self.height * 3, dtype=np.uint8)
+        self.accumulation = np.zeros(
+            (self.width * self.height, 3), dtype=np.float32)
+        self.accumulated = 0
+        self.pending = collections.deque()
+        self.update_objects(self.updatable)
+        self.scene.pop_dirty()
+
+    def update_objects(self, types):
+
+        # repacks the object types that changed, like Connector only the
+        # ones it can update
+        get = BaseObject.get_field
+        if "Camera" in types:
+            camera = self.scene.get_packed("Camera")[0]
+            self.camera = {
+                name: get(camera[np.newaxis], name)[0].astype(np.float32)
+                for name in camera.dtype.names}
+        if "Light" in types:
+            self.update_lights()
+        if "Sphere" in types:
+            self.update_spheres()
+
+    def update_lights(self):
+
+        get = BaseObject.get_field
+        lights = self.scene.get_packed("Light")
+        if lights is None:
+            lights = np.zeros(0, dtype=BaseObject.subclasses[
+                "Light"].light_struct)
+        self.lights = [
+            {name: get(lights[i:i + 1], name)[0] for name in
+             ["position", "ambience", "diffuse", "specular", "radius"]}
+            for i in range(len(lights))]
+
+    def update_spheres(self):
+
+        get = BaseObject.get_field
+        spheres = self.scene.get_packed("Sphere")
+        if spheres is None:
+            spheres = np.zeros(0, dtype=BaseObject.subclasses[
+                "Sphere"].sphere_struct)
+        self.sphere_centers = get(spheres, "center")
+        self.sphere_radii = spheres["radius"]
+        self.sphere_materials = spheres["material"]
+        self.sphere_bvh = None
+        if self.use_bvh and len(spheres):
+            radius = self.sphere_radii[:, np.newaxis]
+            self.sphere_bvh = self.get_nodes(BVH(
+                self.sphere_centers - radius, self.sphere_centers + radius))
+
+    @staticmethod
+    def get_nodes(bvh):
+        get = BaseObject.get_field
+        return (get(bvh.nodes, "bounds_min"), get(bvh.nodes, "bounds_max"),
+                bvh.nodes["first"], bvh.nodes["count"], bvh.indices)
+
+    def intersect_spheres(self, index, origins, directions):
+
+        # (rays, primitives) distances like intersect_sphere, -1 for misses
+        center = self.sphere_centers[index]
+        radius = self.sphere_radii[index]
+        to_center = origins[:, np.newaxis] - center
+        b = dot(to_center, directions[:, np.newaxis])
+        c = dot(to_center, to_center) - radius * radius
+        delta = b * b - c
+        with np.errstate(invalid="ignore"):
+            root = np.sqrt(delta)
+            distance = -b - root
+            distance = np.where(distance < EPSILON, -b + root, distance)
+            miss = ((c > EPSILON) & (b > EPSILON)) | (delta < EPSILON)
+        return np.where(miss, -1, distance)
+
+    def intersect_triangles(self, index, origins, directions):
+
+        # (rays, primitives) distances like intersect_triagle
+        point = self.triangle_points[index]
+        v0v1 = self.triangle_edges[0][index]
+        v0v2 = self.triangle_edges[1][index]
+        directions = directions[:, np.newaxis]
+        pvec = np.cross(directions, v0v2)
+        det = dot(v0v1, pvec)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv_det = 1 / det
+            tvec = origins[:, np.newaxis] - point
+            u = dot(tvec, pvec) * inv_det
+            qvec = np.cross(tvec, v0v1)
+            v = dot(directions, qvec) * inv_det
+            distance = dot(v0v2, qvec) * inv_det
+            miss = (((det < EPSILON) & (det > -EPSILON)) |
+                    (u < -EPSILON) | (u > 1 + EPSILON) |
+                    (v < -EPSILON) | (u + v > 1 + EPSILON) |
+                    (distance < EPSILON))
+        return np.where(miss, -1, distance)
+
+    @staticmethod
+    def update_closest(distance, index, rays, best, hit):
+
+        # keeps the nearest of the tested primitives per ray
+        with np.errstate(invalid="ignore"):
+            distance = np.where(
+                (distance > EPSILON) & (distance < best[rays, np.newaxis]),
+                distance, np.inf)
+        nearest = distance.argmin(axis=1)
+        distance = distance[np.arange(len(rays)), nearest]
+        closer = distance < np.inf
+        best[rays[closer]] = distance[closer]
+        hit[rays[closer]] = index[nearest[closer]]
+
+    def find_closest(self, intersect, nodes, count, origins, directions,
+                     best, rays, any_hit=False):
+
+        # index of the closest primitive per ray or -1, best is updated
+        # with its distance
+        hit = np.full(len(origins), -1, dtype=np.int32)
+        if nodes is None:
+            step = max(1, BATCH // max(len(rays), 1))
+            for start in range(0, count, step):
+                index = np.arange(start, min(start + step, count))
+                self.update_closest(
+                    intersect(index, origins[rays], directions[rays]),
+                    index, rays, best, hit)
+            return hit
+
+        # depth first through the BVH, every node with the rays that
+        # reach its bounds before their closest hit so far
+        bounds_min, bounds_max, first, counts, indices = nodes
+        with np.errstate(divide="ignore"):
+            inv_direction = 1 / directions
+        stack = [(0, rays)]
+        while stack:
+            node, rays = stack.pop()
+            if any_hit:
+                rays = rays[hit[rays] < 0]
+            with np.errstate(invalid="ignore"):
+                t0 = (bounds_min[node] - origins[rays]) * inv_direction[rays]
+                t1 = (bounds_max[node] - origins[rays]) * inv_direction[rays]
+            t_min, t_max = np.fmin(t0, t1), np.fmax(t0, t1)
+            near = np.fmax(np.fmax(t_min[:, 0], t_min[:, 1]),
+                           np.fmax(t_min[:, 2], 0))
+            far = np.fmin(np.fmin(t_max[:, 0], t_max[:, 1]), t_max[:, 2])
+            rays = rays[~((near > far + EPSILON) | (near > best[rays]))]
+            if not len(rays):
+                continue
+            if counts[node] > 0:
+                index = indices[first[node]:first[node] + counts[node]]
+                self.update_closest(
+                    intersect(index, origins[rays], directions[rays]),
+                    index, rays, best, hit)
+            else:
+                stack.append((first[node] + 1, rays))
+                stack.append((first[node], rays))
+        return hit
+
+    def intersect(self, origins, directions, best, any_hit=False):
+
+        # (sphere, triangle) hit per ray, triangles are only hit closer
+        # than the sphere
+        rays = np.arange(len(origins))
+        sphere = self.find_closest(
+            self.intersect_spheres, self.sphere_bvh, len(self.sphere_radii),
+            origins, directions, best, rays, any_hit)
+        if any_hit:
+            rays = rays[sphere < 0]
+        triangle = self.find_closest(
+            self.intersect_triangles, self.triangle_bvh,
+            len(self.triangle_materials), origins, directions, best, rays,
+            any_hit)
+        return sphere, triangle
+
+    def is_in_shadow(self, points, directions, distance):
+        sphere, triangle = self.intersect(
+            points, directions, distance.copy(), True)
+        return (sphere >= 0) | (triangle >= 0)
+
+    @staticmethod
+    def get_falloff(light, distance):
+
+        if light["radius"] <= 0:
+            return np.ones_like(distance)
+        falloff = np.clip(1 - (distance / light["radius"]) ** 4, 0, 1)
+        return falloff * falloff
+
+    def get_sphere_color(self, sphere, points, observation):
+
+        material = self.sphere_materials[sphere]
+        normal = normalize(points - self.sphere_centers[sphere])
+        normal = np.where(
+            dot(observation, normal)[:, np.newaxis] < 0, -normal, normal)
+
+        ambient = self.materials["ambience"][material]
+        diffuse = self.materials["diffuse"][material]
+        specular = self.materials["specular"][material]
+        color = ambient * np.float32(0.4)
+        for light in self.lights:
+            light_vector = normalize(light["position"] - points)
+            n_dot_l = dot(light_vector, normal)
+            reflection = normalize(
+                light_vector - normal * 2 * n_dot_l[:, np.newaxis])
+            v_dot_r = np.maximum(dot(reflection, observation), 0)
+            falloff = self.get_falloff(
+                light, np.linalg.norm(points - light["position"], axis=-1))
+            lit = (n_dot_l > EPSILON) & (falloff > 0)
+            color[lit] += (falloff[:, np.newaxis] * (
+                diffuse * light["diffuse"] * n_dot_l[:, np.newaxis] +
+                specular * light["specular"] *
+                (v_dot_r ** 30)[:, np.newaxis] +
+                ambient * light["ambience"]))[lit]
+        return color
+
+    def sample_texture(self, coordinates, record):
+
+        # bilinear, clamped to the atlas, like the image sampler
+        scale = self.texture_records["scale"][record]
+        offset = self.texture_records["offset"][record]
+        coordinates = coordinates * scale
+        coordinates = np.where(
+            coordinates > 0, np.fmod(coordinates, scale),
+            coordinates - scale * np.floor(coordinates / scale))
+        coordinates = coordinates + offset - 0.5
+
+        height, width = self.atlas.shape[:2]
+        low = np.floor(coordinates)
+        t = coordinates - low
+        x = np.clip(low[:, 0].astype(np.int64) + [[0], [1]], 0, width - 1)
+        y = np.clip(low[:, 1].astype(np.int64) + [[0], [1]], 0, height - 1)
+        texels = self.atlas[y[:, np.newaxis], x[np.newaxis], :3]
+        top = mix(texels[0, 0], texels[0, 1], t[:, 0, np.newaxis])
+        bottom = mix(texels[1, 0], texels[1, 1], t[:, 0, np.newaxis])
+        return mix(top, bottom, t[:, 1, np.newaxis])
+
+    def get_texture_color(self, coordinates, texture, lod):
+
+        record = texture.astype(np.int32)
+        if not self.mipmaps:
+            return self.sample_texture(coordinates, record)
+
+        scale = self.texture_records["scale"][record]
+        levels = self.texture_records["levels"][record]
+        mips = self.texture_records["mips"][record]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            level = lod + 0.5 * np.log2(scale[:, 0] * scale[:, 1])
+        level = np.fmin(np.fmax(level, 0), (levels - 1).astype(np.float32))
+        low = level.astype(np.int32)
+        color = self.sample_texture(
+            coordinates, np.where(low > 0, mips + low - 1, record))
+        blend = level > low
+        color[blend] = mix(
+            color[blend],
+            self.sample_texture(coordinates[blend], (mips + low)[blend]),
+            (level - low.astype(np.float32))[blend, np.newaxis])
+        return color
+
+    def get_triangle_lod(self, triangle, cone_width, direction):
+
+        normal = np.cross(*(edge[triangle] for edge in self.triangle_edges))
+        uv = self.triangle_uvs[triangle]
+        ab, ac = uv[:, 1] - uv[:, 0], uv[:, 2] - uv[:, 0]
+        uv_area = np.abs(ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0])
+        world_area = np.linalg.norm(normal, axis=-1)
+        cosine = np.abs(dot(normal, direction)) / world_area
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return 0.5 * np.log2(uv_area / world_area) + \
+                np.log2(cone_width / cosine)
+
+    def get_triangle_surface(self, triangle, material, weights, cone_width,
+                             direction):
+
+        surface = [self.materials[name][material].copy()
+                   for name in ["ambience", "diffuse", "specular"]]
+        textures = [self.materials[name][material][:, 0] for name in [
+            "texture_ambient", "texture_diffuse", "texture_specular"]]
+        textured = np.any([texture >= 0 for texture in textures], axis=0)
+        if not textured.any():
+            return surface
+
+        uv = self.triangle_uvs[triangle[textured]]
+        coordinates = (uv * weights[textured, :, np.newaxis]).sum(axis=1)
+        lod = self.get_triangle_lod(
+            triangle[textured], cone_width[textured], direction[textured])
+        for color, texture in zip(surface, textures):
+            texture = texture[textured]
+            used = texture >= 0
+            rows = np.flatnonzero(textured)[used]
+            color[rows] *= self.get_texture_color(
+                coordinates[used], texture[used], lod[used])
+        return surface
+
+    def get_triangle_color(self, triangle, points, observation, normal,
+                           weights, cone_width):
+
+        material = self.triangle_materials[triangle]
+        ambient, diffuse, specular = self.get_triangle_surface(
+            triangle, material, weights, cone_width, observation)
+        shininess = self.materials["shininess"][material]
+        normal = np.where(
+            dot(observation, normal)[:, np.newaxis] < 0, -normal, normal)
+
+        color = ambient * np.float32(0.6)
+        for light in self.lights:
+            light_vector = normalize(light["position"] - points)
+            n_dot_l = dot(light_vector, normal)
+            distance = np.linalg.norm(points - light["position"], axis=-1)
+            falloff = self.get_falloff(light, distance)
+            lit = np.flatnonzero((n_dot_l > EPSILON) & (falloff > 0))
+            lit = lit[~self.is_in_shadow(
+                points[lit], light_vector[lit], distance[lit])]
+
+            n_dot_l = n_dot_l[lit, np.newaxis]
+            reflection = normalize(
+                -light_vector[lit] - normal[lit] * 2 * n_dot_l)
+            v_dot_r = np.maximum(dot(reflection, observation[lit]), 0)
+            color[lit] += falloff[lit, np.newaxis] * (
+                diffuse[lit] * light["diffuse"] * n_dot_l +
+                specular[lit] * light["specular"] *
+                (v_dot_r ** shininess[lit])[:, np.newaxis] +
+                ambient[lit] * light["ambience"])
+        return color
+
+    def get_triangle_normal(self, triangle, points):
+
+        # interpolated normal and barycentric weights of the points
+        ba, ca = (edge[triangle] for edge in self.triangle_edges)
+        pa = points - self.triangle_points[triangle]
+        d00, d01, d11 = dot(ba, ba), dot(ba, ca), dot(ca, ca)
+        d20, d21 = dot(pa, ba), dot(pa, ca)
+        denom = d00 * d11 - d01 * d01
+        v = (d11 * d20 - d01 * d21) / denom
+        w = (d00 * d21 - d01 * d20) / denom
+        weights = np.stack([1 - v - w, v, w], axis=-1)
+        normal = (self.triangle_normals[triangle] *
+                  weights[..., np.newaxis]).sum(axis=1)
+        return normalize(normal), weights
+
+    @staticmethod
+    def get_reflected_ray(direction, normal):
+        n_dot_l = dot(direction, normal)[:, np.newaxis]
+        return normalize(direction - normal * 2 * n_dot_l)
+
+    @staticmethod
+    def get_refracted_ray(direction, normal, a, b):
+
+        cosa = dot(direction, normal)
+        entering = cosa < 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = np.where(entering, b / a, a / b)[:, np.newaxis]
+            normal = np.where(entering[:, np.newaxis], normal, -normal)
+            cosa = np.abs(cosa)[:, np.newaxis]
+            k = 1 - r * r * (1 - cosa * cosa)
+            return normalize(direction * r + normal * (r * cosa - np.sqrt(k)))
+
+    def trace(self, origins, directions, spread):
+
+        # every bounce of all rays at once, in place of the task queue
+        z_far = np.float32(int(self.camera["zFar"]))
+        color = np.zeros((len(origins), 3), dtype=np.float32)
+        pixels = np.arange(len(origins))
+        mult = np.ones(len(origins), dtype=np.float32)
+        depth = np.zeros(len(origins), dtype=np.int32)
+        travelled = np.zeros(len(origins), dtype=np.float32)
+
+        while len(pixels):
+            distance = np.full(len(pixels), z_far, dtype=np.float32)
+            sphere, triangle = self.intersect(origins, directions, distance)
+            points = origins + directions * distance[:, np.newaxis]
+            travelled = travelled + distance
+
+            missed = (sphere < 0) & (triangle < 0)
+            np.add.at(color, pixels[missed], mult[missed, np.newaxis] * SKY)
+
+            hit = np.flatnonzero((sphere >= 0) & (triangle < 0))
+            np.add.at(color, pixels[hit], mult[hit, np.newaxis] *
+                      self.get_sphere_color(
+                          sphere[hit], points[hit], -directions[hit]))
+
+            hit = np.flatnonzero(triangle >= 0)
+            next_rays = []
+            if len(hit):
+                next_rays = self.shade_triangles(
+                    hit, triangle[hit], points[hit], directions[hit],
+                    mult[hit], depth[hit], travelled[hit], spread, pixels,
+                    color)
+
+            if not next_rays:
+                break
+            origins, directions, pixels, mult, depth, travelled = (
+                np.concatenate(field) for field in zip(*next_rays))
+        return color
+
+    def shade_triangles(self, hit, triangle, points, directions, mult, depth,
+                        travelled, spread, pixels, color):
+
+        # adds the color of the hits, returns the reflected and refracted
+        # rays they spawn
+        normal, weights = self.get_triangle_normal(triangle, points)
+        material = self.triangle_materials[triangle]
+        transparency = self.materials["transparency"][material]
+        reflectiveness = self.materials["reflectiveness"][material]
+
+        next_rays = []
+        spawn = [
+            ((transparency > 0) & (depth < 3) & (mult * transparency > 0.05),
+             transparency, lambda rays: self.get_refracted_ray(
+                 directions[rays], normal[rays],
+                 self.materials["optical_density"][material[rays]], 1)),
+            ((reflectiveness > 0) & (depth < 2) &
+             (mult * reflectiveness > 0.05),
+             reflectiveness, lambda rays: self.get_reflected_ray(
+                 directions[rays], normal[rays]))]
+        for rays, weight, get_ray in spawn:
+            rays = np.flatnonzero(rays)
+            if len(rays):
+                next_rays.append((
+                    points[rays], get_ray(rays), pixels[hit[rays]],
+                    mult[rays] * weight[rays], depth[rays] + 1,
+                    travelled[rays]))
+
+        # a reflective surface weighs its own color by what it doesn't
+        # reflect, whatever the ray carried
+        mult = np.where(reflectiveness > 0, 1 - reflectiveness, mult)
+        shaded = np.flatnonzero((reflectiveness < 1) & (transparency == 0))
+        if len(shaded):
+            np.add.at(color, pixels[hit[shaded]], mult[
+                shaded, np.newaxis] * self.get_triangle_color(
+                    triangle[shaded], points[shaded], -directions[shaded],
+                    normal[shaded], weights[shaded],
+                    spread * travelled[shaded]))
+        return next_rays
+
+    def get_pixels(self):
+
+        # every noise-th pixel of a row, shifted by one per row
+        columns = self.width // self.noise
+        y, x = np.mgrid[0:self.height, 0:columns]
+        x = x * self.noise + y % self.noise
+        return x.ravel(), y.ravel()
+
+    def get_camera_rays(self, x, y):
+
+        camera = self.camera
+        pixel = (camera["topLeftCorner"] +
+                 (x / np.float32(self.width))[:, np.newaxis] *
+                 camera["worldWidth"] * camera["rightVector"] -
+                 (y / np.float32(self.height))[:, np.newaxis] *
+                 camera["worldHeight"] * camera["upVector"])
+        return normalize(pixel - camera["position"])
+
+    def get_pixel_spread(self):
+
+        camera = self.camera
+        center = (camera["topLeftCorner"] +
+                  0.5 * camera["worldWidth"] * camera["rightVector"] -
+                  0.5 * camera["worldHeight"] * camera["upVector"])
+        return camera["worldHeight"] / (
+            self.height * np.linalg.norm(center - camera["position"]))
+
+    @staticmethod
+    def get_random(state):
+        return (state >> np.uint32(8)).astype(np.float32) * \
+            np.float32(1 / 16777216)
+
+    def render(self, accumulated):
+
+        x, y = self.get_pixels()
+        pixel = y * self.width + x
+        x, y = x.astype(np.float32), y.astype(np.float32)
+        state = pcg_hash(pcg_hash(
+            np.full(1, max(accumulated, 0), dtype=np.uint32)) +
+            pixel.astype(np.uint32))
+        jitter = self.samples > 1 or accumulated > 0
+        columns = int(np.ceil(np.sqrt(self.samples)))
+        rows = (self.samples + columns - 1) // columns
+        spread = self.get_pixel_spread()
+        origins = np.repeat(
+            self.camera["position"][np.newaxis], len(pixel), axis=0)
+
+        result = np.zeros((len(pixel), 3), dtype=np.float32)
+        for i in range(self.samples):
+            offset_x = offset_y = np.float32(0)
+            if jitter:
+                state = pcg_hash(state)
+                offset_x = (i % columns + self.get_random(state)) / \
+                    np.float32(columns)
+                state = pcg_hash(state)
+                offset_y = (i // columns + self.get_random(state)) / \
+                    np.float32(rows)
+            directions = self.get_camera_rays(x + offset_x, y + offset_y)
+            result += self.trace(origins, directions, spread)
+        result = np.clip(result / np.float32(self.samples), 0, 1)
+
+        if accumulated >= 0:
+            if accumulated > 0:
+                result += self.accumulation[pixel]
+            self.accumulation[pixel] = result
+            result = result / np.float32(accumulated + 1)
+
+        image = self.image.reshape(-1, 3)
+        # convert_uchar rounds towards zero
+        image[pixel] = (result * 255).astype(np.uint8)
+
+    def run(self, callback=None):
+
+        types = {obj.__class__.__name__ for obj in self.scene.pop_dirty()}
+        for obj_type in types.difference(self.updatable):
+            raise ValueError(
+                "{} can't be updated after setup".format(obj_type))
+        if types:
+            self.update_objects(types)
+            self.accumulated = 0
+        accumulated = -1
+        if self.accumulate:
+            accumulated = self.accumulated
+            self.accumulated += 1
+
+        self.render(accumulated)
+        self.pending.append(self.image)
+        if callback:
+            callback(None)
+
+    def get_result(self, wait):
+
+        if not self.pending:
+            return None
+        # like Connector, valid until the next frame is run
+        return self.pending.popleft()
+
+    def iter_tiles(self):
+
+        if self.pending:
+            yield (0, 0, self.width, self.height), self.pending[0]
@@ -1,6 +1,12 @@
+import numpy as np
+
+
 class BaseObject(object):
 
     subclasses = {}
+    # set by Scene.add_object, changed objects are re-uploaded from there
+    dirty_objects = None
+    scene_index = 0
 
     @classmethod
     def register_object(cls):
@@ -18,5 +24,44 @@ class BaseObject(object):
             raise ValueError("Bad object name: {}".format(name))
         return cls.subclasses[name](**args)
 
+    @classmethod
+    def pack(cls, objects):
+        return np.array([obj.get_cl_repr() for obj in objects])
+
+    @staticmethod
+    def set_field(array, name, values):
+        # writes plain (n, ..., lanes) values into a field of cl vector types
+        field, offset = array.dtype.fields[name][:2]
+        base = field.base
+        lane = base.fields["x"][0] if base.fields else base
+        words = array.view(lane).reshape(
+                len(array), array.dtype.itemsize // lane.itemsize)
+        start = offset // lane.itemsize
+        view = words[:, start:start + field.itemsize // lane.itemsize]
+        view = view.reshape(
+                (len(array),) + field.shape +
+                (base.itemsize // lane.itemsize,))
+
+        values = np.asarray(values, dtype=lane)
+        if not base.fields:
+            values = values[..., np.newaxis]
+        view[..., :values.shape[-1]] = values
+
+    @staticmethod
+    def get_field(array, name):
+        # a field of cl vector types as plain (n, ..., lanes) values,
+        # without the padding lane of 3 component types
+        field = array.dtype.fields[name][0]
+        base = field.base
+        if not base.fields:
+            return array[name]
+        lanes = [lane for lane in base.names if not lane.startswith("padding")]
+        return np.stack([array[name][lane] for lane in lanes], axis=-1)
+
+    def mark_dirty(self):
+
+        if self.dirty_objects is not None:
+            self.dirty_objects.add(self)
+
     def get_cl_repr(self):
         return self._get_cl_repr()
@@ -56,6 +56,9 @@ class Camera(BaseObject):
 
     def move(self, forward, backward, left, right):
 
+        if not (forward or backward or left or right):
+            return
+
         if forward:
             self.position = self.position + self.direction * self.speed
         elif backward:
@@ -82,6 +85,9 @@ class Camera(BaseObject):
         elif up:
             angle_ud *= -1
 
+        if angle_ud == 0 and angle_lr == 0:
+            return
+
         if angle_ud != 0:
             axis = self.right
             self.up = rotate_vec(self.up, axis, angle_ud)
@@ -98,6 +104,16 @@ class Camera(BaseObject):
 
         self.update()
 
+    def set_orientation(self, position, direction, up):
+
+        self.position = np.array(position)
+        self.direction = np.array(direction)
+        self.direction = self.direction / np.linalg.norm(self.direction)
+        self.up = np.cross(np.cross(self.direction, up), self.direction)
+        self.up = self.up / np.linalg.norm(self.up)
+        self.right = np.cross(self.direction, self.up)
+        self.update()
+
     def set_options(self, position, direction):
         self.position = position
         self.direction = direction / np.linalg.norm(direction)
@@ -108,6 +124,7 @@ class Camera(BaseObject):
         self.top_left = self.position + self.z_near * self.direction
         self.top_left = self.top_left + self.world_height/2 * self.up
         self.top_left = self.top_left - self.world_width/2 * self.right
+        self.mark_dirty()
 
     def get_cl_repr(self):
 
@@ -115,9 +132,9 @@ class Camera(BaseObject):
                          cl.array.vec.make_float3(*self.top_left.tolist()),
                          cl.array.vec.make_float3(*self.right.tolist()),
                          cl.array.vec.make_float3(*self.up.tolist()),
-                         np.float(self.world_width),
-                         np.float(self.world_height),
-                         np.float(self.z_far)),
+                         np.float32(self.world_width),
+                         np.float32(self.world_height),
+                         np.float32(self.z_far)),
                         dtype=Camera.camera_struct)
 
     def rotate_aroud_center(self):
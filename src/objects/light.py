@@ -10,13 +10,17 @@ class Light(BaseObject):
         [("position", cl.cltypes.float3),
          ("ambience", cl.cltypes.float3),
          ("diffuse", cl.cltypes.float3),
-         ("specular", cl.cltypes.float3)])
+         ("specular", cl.cltypes.float3),
+         ("radius", np.float32),
+         ("padding", np.float32, 3)])
 
-    def __init__(self, position, ambient, diffuse, specular):
+    def __init__(self, position, ambient, diffuse, specular, radius=0):
         self.position = position
         self.ambient = ambient
         self.diffuse = diffuse
         self.specular = specular
+        # lights fade out at their radius, 0 lights the whole scene
+        self.radius = radius
 
     def get_cl_repr(self):
 
@@ -24,5 +28,7 @@ class Light(BaseObject):
                 cl.array.vec.make_float3(*self.position),
                 cl.array.vec.make_float3(*self.ambient),
                 cl.array.vec.make_float3(*self.diffuse),
-                cl.array.vec.make_float3(*self.specular)
+                cl.array.vec.make_float3(*self.specular),
+                self.radius or 0,
+                (0, 0, 0)
                 ), dtype=self.light_struct)
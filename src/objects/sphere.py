@@ -10,7 +10,9 @@ class Sphere(VisibleObject):
 
     sphere_struct = np.dtype(
         [("center", cl.cltypes.float3),
-         ("radius", np.float32)])
+         ("radius", np.float32),
+         ("material", np.int32),
+         ("padding", np.int32, 2)])
 
     def __init__(self, material, center, radius):
         super(Sphere, self).__init__(material)
@@ -20,4 +22,16 @@ class Sphere(VisibleObject):
     def _get_cl_repr(self):
 
         return np.array((cl.array.vec.make_float3(*self.center),
-                        self.radius), dtype=self.sphere_struct)
+                        self.radius, self.material_index, (0, 0)),
+                        dtype=self.sphere_struct)
+
+    @classmethod
+    def pack(cls, spheres):
+
+        result = np.zeros(len(spheres), dtype=cls.sphere_struct)
+        cls.set_field(result, "center", [s.center for s in spheres])
+        cls.set_field(result, "radius", [s.radius for s in spheres])
+        cls.set_field(
+                result, "material", [s.material_index for s in spheres])
+
+        return result
@@ -10,11 +10,18 @@ class Triangle(VisibleObject):
     triangle_struct = np.dtype(
         [("vertices", cl.cltypes.float3, 3),
          ("normals", cl.cltypes.float3, 3),
-         ("textures", cl.cltypes.float4, 3)])
+         ("textures", cl.cltypes.float2, 3),
+         ("material", np.int32),
+         ("padding", np.int32)])
 
     def __init__(self, material, vertices, normals=None, texture_coord=None):
         super(Triangle, self).__init__(material)
-        self.vertices = vertices
+        # scene files give plain lists
+        self.vertices = [np.asarray(v, dtype=float) for v in vertices]
+        if normals:
+            normals = [np.asarray(n, dtype=float) for n in normals]
+        if texture_coord:
+            texture_coord = [np.asarray(t, dtype=float) for t in texture_coord]
         if not normals:
             ab = self.vertices[0] - self.vertices[1]
             ac = self.vertices[0] - self.vertices[2]
@@ -25,7 +32,7 @@ class Triangle(VisibleObject):
 
         self.texture_coord = texture_coord
         if not texture_coord:
-            self.texture_coord = self.normals
+            self.texture_coord = [np.zeros(2)] * 3
         self.texture_coord = [a.tolist() for a in self.texture_coord]
         self.vertices = [a.tolist() for a in self.vertices]
         self.normals = [a.tolist() for a in self.normals]
@@ -35,7 +42,59 @@ class Triangle(VisibleObject):
         a = np.array(
             ([cl.array.vec.make_float3(*el) for el in self.vertices],
              [cl.array.vec.make_float3(*el) for el in self.normals],
-             [cl.array.vec.make_float4(*el) for el in self.texture_coord]),
+             [cl.array.vec.make_float2(*el) for el in self.texture_coord],
+             self.material_index,
+             0),
             dtype=self.triangle_struct)
 
         return a
+
+    @classmethod
+    def pack(cls, triangles):
+
+        result = np.zeros(len(triangles), dtype=cls.triangle_struct)
+        cls.set_field(result, "vertices", [t.vertices for t in triangles])
+        cls.set_field(result, "normals", [t.normals for t in triangles])
+        cls.set_field(
+                result, "textures", [t.texture_coord for t in triangles])
+        cls.set_field(
+                result, "material", [t.material_index for t in triangles])
+
+        return result
+
+    @classmethod
+    def pack_vertices(cls, vertices, vertex_format, material_index):
+
+        # interleaved pywavefront data, e.g. T2F_N3F_V3F, three vertices
+        # per face, straight into the packed layout
+        sizes = [int(el[1]) for el in vertex_format.split("_")]
+        vertices = np.asarray(vertices, dtype=np.float32).reshape(
+                -1, 3, sum(sizes))
+        fields = {}
+        offset = 0
+        for el, size in zip(vertex_format.split("_"), sizes):
+            fields[el] = vertices[..., offset:offset + size]
+            offset += size
+
+        result = np.zeros(len(vertices), dtype=cls.triangle_struct)
+        points = fields["V3F"]
+        cls.set_field(result, "vertices", points)
+
+        if "N3F" in fields:
+            cls.set_field(result, "normals", fields["N3F"])
+        else:
+            # flat normal of the face, as Triangle computes it
+            normal = np.cross(points[:, 0] - points[:, 1],
+                              points[:, 0] - points[:, 2])
+            with np.errstate(invalid="ignore", divide="ignore"):
+                normal /= np.linalg.norm(normal, axis=1, keepdims=True)
+            cls.set_field(
+                    result, "normals", np.repeat(normal[:, np.newaxis], 3, 1))
+
+        if "T2F" in fields:
+            uv = fields["T2F"].copy()
+            uv[..., 1] = 1 - uv[..., 1]
+            cls.set_field(result, "textures", uv)
+
+        result["material"] = material_index
+        return result
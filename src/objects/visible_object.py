@@ -1,5 +1,3 @@
-import numpy as np
-
 from src.objects.base import BaseObject
 from src.material import Material
 
@@ -12,13 +10,5 @@ class VisibleObject(BaseObject):
             self.material = Material(**material)
         else:
             self.material = material
-
-    def get_cl_repr(self):
-        child_repr = self._get_cl_repr()
-        child_mat_repr = self.material._get_cl_repr()
-        new_type = np.dtype(
-                child_repr.dtype.descr + child_mat_repr.dtype.descr)
-        result = np.array(
-                child_repr.tolist() + child_mat_repr.tolist(), dtype=new_type)
-
-        return result
+        # position in Scene.materials, assigned by Scene.add_object
+        self.material_index = 0
@@ -1,81 +1,201 @@
+import collections
+import datetime
+import hashlib
+import json
+import os
 import numpy as np
 import pyopencl as cl
-from PIL import Image
 
-
-class Connector(object):
-
-    def __init__(self, filename, scene, width, height, noise):
+from src.backend import Backend
+from src.bvh import BVH
+from src.cache import get_cache_dir
+from src.light_grid import LightGrid
+from src.material import Material
+from src.objects.light import Light
+from src.objects.sphere import Sphere
+from src.objects.triangle import Triangle
+from src.sphere_grid import SphereGrid
+from src.texture_atlas import TextureAtlas
+
+
+@Backend.register_object("opencl")
+class Connector(Backend):
+
+    def __init__(
+            self, filename, scene, width, height, noise, use_bvh=True,
+            pipeline_depth=2, tile_size=0, samples=1, accumulate=False,
+            wavefront=False, cull_lights=True, mipmaps=True,
+            compress_textures=False, platform=None, devices=None,
+            specialize=True):
         self.scene = scene
-        self.platform = cl.get_platforms()[0]
-        self.device = self.platform.get_devices()
+        self.use_bvh = use_bvh
+        # frames that may be in flight at once, 1 disables pipelining
+        self.pipeline_depth = pipeline_depth
+        # work-items per tile side, 0 renders the frame in one launch
+        self.tile_size = 0
+        self.platform = self.get_platform(platform)
+        self.device = self.get_devices(self.platform, devices)
+        print("Devices:", ", ".join(d.name for d in self.device))
+        if wavefront and len(self.device) > 1:
+            raise ValueError("The wavefront kernels run on a single device")
         self.context = cl.Context(self.device)
-        self.queue = cl.CommandQueue(self.context)
-        self.program = self.build_program(filename)
+        # a queue per device, with several each renders a band of rows
+        self.queues = [
+            cl.CommandQueue(
+                self.context, device,
+                properties=cl.command_queue_properties.PROFILING_ENABLE)
+            for device in self.device]
+        self.queue = self.queues[0]
+        # readbacks go through their own queues to overlap with rendering
+        self.copy_queues = [
+            cl.CommandQueue(self.context, device) for device in self.device]
+        self.copy_queue = self.copy_queues[0]
         self.width = width
         self.height = height
         self.noise = np.int32(noise)
+        # rays per pixel, jittered on a grid over the pixel
+        self.samples = np.int32(samples)
+        # average frames on the device while the scene stays the same
+        self.accumulate = accumulate
+        # separate kernels per bounce stage instead of get_image
+        self.wavefront = wavefront
+        # off puts every light into a single grid cell
+        self.cull_lights = cull_lights
+        # off samples every texture at full resolution
+        self.mipmaps = mipmaps
+        # BC1 blocks decoded by the kernel instead of an RGBA8 image
+        self.compress_textures = compress_textures
+        # off builds every path of the kernel whatever the scene holds
+        self.specialize = specialize
+        self.filename = filename
         self.setup()
-
-    def load_image(self, filename):
-
-        img = Image.open(filename)
-        img.load()
-        data = np.asarray(img, dtype=np.uint8)
-        if len(data.shape) == 2:
-            data = np.repeat(data[:, :, np.newaxis], 3, axis=2)
-        return data
+        if self.wavefront:
+            self.setup_wavefront()
+        self.address_spaces = self.get_address_spaces()
+        self.build_kernels()
+        if self.wavefront:
+            # frames are not split, the stages already run in batches
+            tile_size = 0
+        if len(self.device) > 1:
+            # bands take the place of tiles
+            tile_size = 0
+        if tile_size == "auto":
+            tile_size = self.autotune_tiles()
+        self.tile_size = int(tile_size)
+
+    @classmethod
+    def from_options(cls, scene, width, height, noise,
+                     filename="kernels/raytracer.cl", **options):
+        return cls(filename, scene, width, height, noise, **options)
+
+    @staticmethod
+    def get_platform(platform=None):
+
+        # by index or a part of its name, the first one by default
+        platforms = cl.get_platforms()
+        if platform is None:
+            return platforms[0]
+        if str(platform).isdigit() and int(platform) < len(platforms):
+            return platforms[int(platform)]
+        for candidate in platforms:
+            if str(platform).lower() in candidate.name.lower():
+                return candidate
+        raise ValueError("No OpenCL platform matches {}".format(platform))
+
+    @staticmethod
+    def get_devices(platform, devices=None):
+
+        # "all", or indices and parts of names separated by commas, the
+        # first device by default
+        available = platform.get_devices()
+        if devices is None:
+            return available[:1]
+        if devices == "all":
+            return available
+        if not isinstance(devices, (list, tuple)):
+            devices = str(devices).split(",")
+
+        result = []
+        for device in devices:
+            device = str(device).strip()
+            if device.isdigit() and int(device) < len(available):
+                matches = [available[int(device)]]
+            else:
+                matches = [d for d in available
+                           if device.lower() in d.name.lower()]
+            if not matches:
+                raise ValueError(
+                    "No OpenCL device matches {}".format(device))
+            result.extend(d for d in matches if d not in result)
+        return result
+
+    @staticmethod
+    def list_devices():
+
+        for i, platform in enumerate(cl.get_platforms()):
+            print("Platform {}: {}".format(i, platform.name))
+            for j, device in enumerate(platform.get_devices()):
+                print("  Device {}: {}, {} compute units".format(
+                    j, device.name, device.max_compute_units))
+
+    def get_kernel_args(self):
+
+        return [
+            self.camera_d,
+            self.materials_d,
+            self.lights_d,
+            self.light_grid_d,
+            self.light_cells_d,
+            self.light_indices_d,
+            self.spheres_d,
+            self.n_spheres,
+            self.sphere_grid_d,
+            self.sphere_cells_d,
+            self.sphere_indices_d,
+            self.triangles_d,
+            self.n_triangles,
+            self.bvh_nodes_d,
+            self.bvh_indices_d,
+            self.noise,
+            np.int32(self.width),
+            np.int32(self.height),
+            self.samples,
+            self.textures,
+            self.texture_records_d,
+            np.int32(-1),
+            self.accumulation_buf,
+            self.result_bufs[0]]
 
     def send_textures(self):
 
-        images = []
-        max_width = 0
-        max_height = 0
-        if self.scene.textures:
-            textures = {k: v[0] for k, v in self.scene.textures.items()}
-            textures = {v: k for k, v in self.scene.textures.items()}
-
-            for i in sorted(textures.keys()):
-                print(i)
-                v = textures[i]
-                if v is None:
-                    continue
-                print(v)
-                image = self.load_image(v)
-
-                if image.shape[0] > max_height:
-                    max_height = image.shape[0]
-
-                if image.shape[1] > max_width:
-                    max_width = image.shape[1]
-
-                images.append(image)
-
-        if len(images) == 0:
-            images = [np.zeros((128, 128, 3))]
-            max_width = 128
-            max_height = 128
-
-        print(max_width, max_height)
-        images = [
-            np.pad(
-                image,
-                ((0, max_height - image.shape[0]),
-                 (0, max_width - image.shape[1]),
-                 (0, 4 - image.shape[2])),
-                "wrap") for image in images]
-
-        n_images = len(images)
-
-        images = np.concatenate(images, 0)
+        if self.compress_textures:
+            atlas = self.scene.get_compressed_textures()
+        else:
+            atlas = self.scene.get_packed_textures()
+        height, width, _ = atlas.image.shape
+        print("Textures: {} in a {}x{} atlas, {:.2f} MB ({:.2f} MB as an "
+              "array padded to the largest)".format(
+                  len(atlas.records), width, height, atlas.size / 2**20,
+                  atlas.array_size / 2**20))
+        self.texture_records_d = self.create_buffer(
+            atlas.records, TextureAtlas.record_struct)
+
+        if self.compress_textures:
+            print("Compressed textures: {:.2f} MB, {:.1f}x smaller".format(
+                atlas.compressed_size / 2**20,
+                atlas.size / atlas.compressed_size))
+            # the atlas size goes first, the kernel finds the blocks by it
+            blocks = np.concatenate([
+                np.array([[width, height]], dtype=np.uint32), atlas.blocks])
+            self.textures = self.create_buffer(blocks, np.uint32)
+            return
+
         img_format = cl.ImageFormat(cl.channel_order.RGBA,
                                     cl.channel_type.UNORM_INT8)
         image = cl.Image(self.context,
                          cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR,
-                         img_format, hostbuf=images.flatten(), is_array=True,
-                         shape=(max_width, max_height, n_images),
-                         pitches=(max_width * 4, max_width * max_height * 4)
-                         )
+                         img_format, hostbuf=atlas.image,
+                         shape=(width, height), pitches=(width * 4,))
 
         self.textures = image
 
@@ -86,42 +206,279 @@ class Connector(object):
                                       ("diffuse", cl.cltypes.float3),
                                       ("specular", cl.cltypes.float3)])
 
-        self.result = np.zeros(
-                (self.width * self.height * 3), dtype=np.uint8)  # dtype=cl.cltypes.char)
         self.camera_d = cl.Buffer(
             self.context,
             cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR,
-            hostbuf=np.array(self.scene.get_objects("Camera")))
-        self.lights_d = cl.Buffer(
-            self.context, cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR,
-            hostbuf=np.array(self.scene.get_objects("Light")))
-        self.n_lights = np.int32(len(self.scene.get_objects("Light")))
-        self.spheres_d = cl.Buffer(
-            self.context,
-            cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR,
-            hostbuf=np.array(self.scene.get_objects("Sphere")))
-        if self.scene.get_objects("Sphere"):
-            self.n_spheres = np.int32(len(self.scene.get_objects("Sphere")))
-        else:
-            self.n_spheres = np.int32(0)
+            hostbuf=self.scene.get_packed("Camera"))
+        materials = self.scene.get_packed_materials()
+        self.materials_d = self.create_buffer(
+            materials, Material.material_struct)
+        self.lights_d = self.create_buffer(
+            self.scene.get_packed("Light"), Light.light_struct)
+        self.setup_light_grid()
+
+        spheres = self.scene.get_packed("Sphere")
+        self.spheres_d = self.create_buffer(spheres, Sphere.sphere_struct)
+        self.n_spheres = np.int32(0 if spheres is None else len(spheres))
+        self.setup_sphere_grid()
+
+        triangles = self.scene.get_packed("Triangle")
+        self.triangles_d = self.create_buffer(
+            triangles, Triangle.triangle_struct)
+        self.n_triangles = np.int32(
+            0 if triangles is None else len(triangles))
+        print("Triangle buffer: {:.2f} MB, materials: {}".format(
+            self.n_triangles * Triangle.triangle_struct.itemsize / 2**20,
+            len(self.scene.materials)))
+        self.setup_bvh(triangles)
+        self.features = self.get_features(materials, triangles)
+
+        self.setup_results()
+
+    def get_features(self, materials, triangles):
+
+        # neither can be changed after setup, only spheres and triangles
+        # bounce rays or sample textures through their materials
+        used = materials[:0]
+        if triangles is not None and len(triangles):
+            used = materials[np.unique(triangles["material"])]
+        textured = np.concatenate([
+            used[name]["x"] for name in
+            ["texture_ambient", "texture_diffuse", "texture_specular"]])
+        features = {
+            "HAS_SPHERES": bool(self.n_spheres > 0),
+            "HAS_TRIANGLES": bool(self.n_triangles > 0),
+            "HAS_TEXTURES": bool((textured >= 0).any()),
+            "HAS_REFLECTION": bool((used["reflectiveness"] > 0).any()),
+            "HAS_REFRACTION": bool((used["transparency"] > 0).any())}
+        print("Scene features:", " ".join(
+            name for name, present in features.items() if present) or
+            "none")
+        return features
+
+    def get_light_grid(self):
+
+        # kernels only visit the lights whose radius reaches the hit point
+        grid = LightGrid.from_lights(
+            self.scene.get_objects("Light", False) or [],
+            max_resolution=32 if self.cull_lights else 1)
+        self.max_cell_lights = grid.max_lights
+        return grid
+
+    def setup_light_grid(self):
+
+        grid = self.get_light_grid()
+        self.light_grid_d = self.create_buffer(
+            grid.grid, LightGrid.grid_struct)
+        self.light_cells_d = self.create_buffer(grid.cells, np.int32)
+        self.light_indices_d = self.create_buffer(grid.indices, np.int32)
+        print("Light grid: {} cells, at most {} lights per cell".format(
+            len(grid.cells), self.max_cell_lights))
+
+    def get_sphere_grid(self):
+
+        # rays walk the cells they cross instead of testing every sphere
+        if not self.use_bvh:
+            return SphereGrid([], [])
+        return SphereGrid.from_spheres(
+            self.scene.get_objects("Sphere", False) or [])
+
+    def setup_sphere_grid(self):
+
+        start = datetime.datetime.now()
+        grid = self.get_sphere_grid()
+        diff = (datetime.datetime.now() - start).total_seconds()
+        if self.use_bvh:
+            print("Sphere grid: {} cells, at most {} spheres per cell, "
+                  "build time: {}".format(
+                      len(grid.cells), grid.max_count, diff))
+
+        self.sphere_grid_d = self.create_buffer(
+            grid.grid, SphereGrid.grid_struct)
+        self.sphere_cells_d = self.create_buffer(grid.cells, np.int32)
+        self.sphere_indices_d = self.create_buffer(grid.indices, np.int32)
+
+    def update_buffer(self, name, hostbuf, dtype, wait_for):
+
+        # refilled in place while the data fits, kernels read only as much
+        # as the grid says; a larger buffer has room for it to grow again
+        if hostbuf is None or len(hostbuf) == 0:
+            hostbuf = np.zeros(1, dtype=dtype)
+        hostbuf = np.ascontiguousarray(hostbuf, dtype=dtype)
+        buf = getattr(self, name)
+        if hostbuf.nbytes > buf.size:
+            buf = cl.Buffer(self.context, cl.mem_flags.READ_ONLY,
+                            2 * hostbuf.nbytes)
+            setattr(self, name, buf)
+        self.update_events.append(cl.enqueue_copy(
+            self.queue, buf, hostbuf, wait_for=wait_for, is_blocking=False))
+
+    def setup_results(self):
+
+        size = self.width * self.height * 3
+        # every device writes its own buffers, only its rows are read back
+        self.device_bufs = []
+        for _ in self.device:
+            self.device_bufs.append((
+                [cl.Buffer(self.context, cl.mem_flags.WRITE_ONLY, size)
+                 for _ in range(self.pipeline_depth)],
+                # float sums of the frames rendered since the last change
+                cl.Buffer(
+                    self.context, cl.mem_flags.READ_WRITE,
+                    size * 4 if self.accumulate else 4)))
+        self.result_bufs, self.accumulation_buf = self.device_bufs[0]
+
+        self.pinned_bufs = []
+        self.results = []
+        for _ in range(self.pipeline_depth):
+            # host side of the readback lives in page-locked memory
+            pinned = cl.Buffer(
+                self.context,
+                cl.mem_flags.READ_WRITE | cl.mem_flags.ALLOC_HOST_PTR,
+                size)
+            result, _ = cl.enqueue_map_buffer(
+                self.copy_queue, pinned,
+                cl.map_flags.READ | cl.map_flags.WRITE,
+                0, (size,), np.uint8)
+            self.pinned_bufs.append(pinned)
+            self.results.append(result)
+        self.accumulated = 0
+
+        # (y, rows) per device and their rows per second, the first guess
+        # is their compute units times clock
+        self.bands = None
+        self.throughput = np.array([
+            d.max_compute_units * d.max_clock_frequency for d in self.device],
+            dtype=np.float64)
+        self.measured = False
+        # [(device, rows, kernel event), ...] of frames not yet timed
+        self.unmeasured = collections.deque()
+        # scene updates the next bands wait for, on other devices' queues
+        self.update_events = []
+
+        self.frames = 0
+        # (slot, [(tile, kernel event, readback event), ...]) in flight
+        self.pending = collections.deque()
+        self.last_tiles = []
+        self.event = None
 
-        triangles = self.scene.get_objects("Triangle")
-        self.triangles_d = cl.Buffer(
+    def setup_wavefront(self):
+
+        # sizes of struct Ray and struct ShadowRay in kernels/wavefront.cl
+        ray_size, shadow_ray_size = 64, 64
+        rays = int(self.width / self.noise) * self.height * int(self.samples)
+        # glass and mirrors split rays, the ones that don't fit are dropped
+        self.ray_capacity = 2 * rays
+
+        flags = cl.mem_flags.READ_WRITE
+        self.rays_d = [
+            cl.Buffer(self.context, flags, self.ray_capacity * ray_size)
+            for _ in range(2)]
+        self.shadow_rays_d = cl.Buffer(
+            self.context, flags, self.ray_capacity * shadow_ray_size)
+        self.radiance_d = cl.Buffer(
+            self.context, flags, self.width * self.height * 3 * 4)
+        self.counters_d = cl.Buffer(self.context, flags, 8)
+
+    def build_kernels(self):
+
+        self.program = self.build_program(
+            self.filename, self.get_build_options())
+        self.kernel = cl.Kernel(self.program, "get_image")
+        args = self.get_kernel_args()
+        # the output buffer is always last, run() swaps it per frame
+        self.result_arg = len(args) - 1
+        self.accumulated_arg = len(args) - 3
+        self.kernel.set_args(*args)
+        if self.wavefront:
+            for name in ["generate", "intersect", "shade", "shadow",
+                         "finish"]:
+                setattr(self, name, cl.Kernel(self.program, name))
+
+    def create_buffer(self, hostbuf, dtype):
+
+        # OpenCL does not allow empty buffers, kernels get a zeroed entry
+        if hostbuf is None or len(hostbuf) == 0:
+            hostbuf = np.zeros(1, dtype=dtype)
+
+        return cl.Buffer(
             self.context,
             cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR,
-            hostbuf=np.array(triangles))
-        if triangles:
-            self.n_triangles = np.int32(len(triangles))
+            hostbuf=hostbuf)
+
+    def setup_bvh(self, triangles):
+
+        if self.use_bvh:
+            start = datetime.datetime.now()
+            if triangles is None:
+                triangles = np.zeros(0, dtype=Triangle.triangle_struct)
+            bvh = BVH.from_packed_cached(triangles)
+            diff = (datetime.datetime.now() - start).total_seconds()
+            print("BVH nodes:", len(bvh.nodes), "build time:", diff)
+            nodes, indices = bvh.nodes, bvh.indices
         else:
-            self.n_triangles = np.int32(0)
-
-        self.result_buf = cl.Buffer(
-            self.context,
-            cl.mem_flags.WRITE_ONLY,
-            self.result.nbytes)
-        self.event = None
-
-    def build_program(self, filename):
+            nodes = np.zeros(1, dtype=BVH.node_struct)
+            indices = np.zeros(1, dtype=np.int32)
+
+        self.bvh_nodes_d = self.create_buffer(nodes, BVH.node_struct)
+        self.bvh_indices_d = self.create_buffer(indices, np.int32)
+
+    def get_address_spaces(self):
+
+        # in order of how often the kernel reads them
+        buffers = [
+            ("CAMERA_MEM", [self.camera_d]),
+            ("LIGHT_MEM", [self.lights_d, self.light_grid_d,
+                           self.light_cells_d, self.light_indices_d]),
+            ("MATERIAL_MEM", [self.materials_d]),
+            ("TEXTURE_MEM", [self.texture_records_d]),
+            ("SPHERE_MEM", [self.spheres_d, self.sphere_grid_d,
+                            self.sphere_cells_d, self.sphere_indices_d]),
+            ("BVH_MEM", [self.bvh_nodes_d, self.bvh_indices_d]),
+            ("TRIANGLE_MEM", [self.triangles_d])]
+
+        # CPU runtimes gain nothing from __constant
+        use_constant = all(
+            not device.type & cl.device_type.CPU for device in self.device)
+        max_size = min(d.max_constant_buffer_size for d in self.device)
+        max_args = min(d.max_constant_args for d in self.device)
+
+        address_spaces = {}
+        for name, bufs in buffers:
+            size = sum(buf.size for buf in bufs)
+            if (use_constant and size <= max_size and len(bufs) <= max_args):
+                address_spaces[name] = "__constant"
+                max_size -= size
+                max_args -= len(bufs)
+            else:
+                address_spaces[name] = "__global"
+
+        print("Address spaces:", " ".join(
+            "{}={}".format(k, v) for k, v in address_spaces.items()))
+        return address_spaces
+
+    def get_build_options(self):
+
+        options = []
+        if self.use_bvh:
+            options.append("-D USE_BVH")
+        if not self.mipmaps:
+            options.append("-D NO_MIPMAPS")
+        if self.compress_textures:
+            options.append("-D COMPRESSED_TEXTURES")
+        if self.specialize:
+            options.append("-D SPECIALIZED")
+            options.extend("-D {}".format(name) for name, present in
+                           self.features.items() if present)
+            # without bounces a ray never queues another one
+            if not (self.features["HAS_REFLECTION"] or
+                    self.features["HAS_REFRACTION"]):
+                options.extend(["-D MAX_DEPTH=0", "-D TASK_QUEUE_SIZE=1"])
+        for name, space in self.address_spaces.items():
+            options.append("-D {}={}".format(name, space))
+        return options
+
+    def build_program(self, filename, options=None):
 
         with open(filename) as f:
             code = f.read()
@@ -129,48 +486,435 @@ class Connector(object):
         with open("kernels/tools.cl") as f:
             code += f.read()
 
-        return cl.Program(self.context, code).build()
+        if self.wavefront:
+            with open("kernels/wavefront.cl") as f:
+                code += f.read()
+
+        options = options or []
+        start = datetime.datetime.now()
+        program, cached = self.load_program(code, options)
+        if program is None:
+            program = cl.Program(self.context, code).build(options=options)
+            self.save_program(program, code, options)
+        self.build_time = (datetime.datetime.now() - start).total_seconds()
+        print("Kernel build time: {}{}".format(
+            self.build_time, " (cached binary)" if cached else ""))
+        return program
+
+    def get_program_files(self, code, options):
+
+        # binaries only load on the driver that compiled them
+        key = hashlib.sha1(code.encode())
+        key.update(" ".join(options).encode())
+        for device in self.device:
+            key.update("|".join([
+                device.platform.name, device.platform.version, device.name,
+                device.version, device.driver_version]).encode())
+        key = key.hexdigest()
+        return [os.path.join(get_cache_dir("kernels"),
+                             "{}_{}.bin".format(key, i))
+                for i in range(len(self.device))]
+
+    def load_program(self, code, options):
+
+        filenames = self.get_program_files(code, options)
+        if not all(os.path.exists(f) for f in filenames):
+            return None, False
+
+        binaries = []
+        for filename in filenames:
+            with open(filename, "rb") as f:
+                binaries.append(f.read())
+        try:
+            program = cl.Program(self.context, self.device, binaries)
+            return program.build(options=options), True
+        except cl.Error as e:
+            print("Cached kernel binary rejected, building from source:", e)
+            return None, False
+
+    def save_program(self, program, code, options):
+
+        binaries = program.binaries
+        # some drivers hand out no binaries, those build every time
+        if not all(binaries):
+            return
+        for filename, binary in zip(
+                self.get_program_files(code, options), binaries):
+            with open(filename + ".tmp", "wb") as f:
+                f.write(binary)
+            os.replace(filename + ".tmp", filename)
 
     def get_result(self, wait):
 
-        if (wait or
-                self.event.get_info(cl.event_info.COMMAND_EXECUTION_STATUS) ==
-                cl.command_execution_status.COMPLETE):
-            self.queue.finish()
-            cl.enqueue_copy(self.queue, self.result, self.result_buf)
-            return self.result
-
-        return None
+        if not self.pending:
+            return None
+
+        slot, tiles = self.pending[0]
+        copy_events = [copy_event for _, _, copy_event in tiles]
+        if not wait and any(
+                event.get_info(cl.event_info.COMMAND_EXECUTION_STATUS) !=
+                cl.command_execution_status.COMPLETE
+                for event in copy_events):
+            return None
+
+        cl.wait_for_events(copy_events)
+        self.pending.popleft()
+        # stays valid until pipeline_depth more frames have been run
+        return self.results[slot]
+
+    def iter_tiles(self):
+
+        # (x, y, width, height) in pixels of the oldest frame as its tiles
+        # land, with the partly updated array get_result will return
+        if not self.pending:
+            return
+
+        slot, tiles = self.pending[0]
+        for tile, _, copy_event in tiles:
+            copy_event.wait()
+            yield tile, self.results[slot]
+
+    def get_tiles(self, tile_size):
+
+        columns = int(self.width / self.noise)
+        if not tile_size:
+            return [(0, 0, columns, self.height)]
+
+        tiles = [
+            (x, y, min(tile_size, columns - x),
+             min(tile_size, self.height - y))
+            for y in range(0, self.height, tile_size)
+            for x in range(0, columns, tile_size)]
+
+        # the middle of the frame is what the user looks at first
+        def distance(tile):
+            x, y, w, h = tile
+            return ((x + w / 2 - columns / 2) ** 2 +
+                    (y + h / 2 - self.height / 2) ** 2)
+
+        return sorted(tiles, key=distance)
+
+    def copy_tile(self, slot, tile, wait_for, device=0):
+
+        x, y, w, h = tile
+        queue = self.copy_queues[device]
+        result_buf = self.device_bufs[device][0][slot]
+        if w * h == self.width * self.height:
+            return cl.enqueue_copy(
+                queue, self.results[slot], result_buf,
+                wait_for=wait_for, is_blocking=False)
+
+        pitch = self.width * 3
+        return cl.enqueue_copy(
+            queue, self.results[slot], result_buf,
+            buffer_origin=(x * 3, y), host_origin=(x * 3, y),
+            region=(w * 3, h),
+            buffer_pitches=(pitch,), host_pitches=(pitch,),
+            wait_for=wait_for, is_blocking=False)
+
+    def autotune_tiles(self, candidates=(16, 32, 64, 128, 256),
+                       max_tile_time=0.1):
+
+        # fastest size whose longest launch stays under the driver watchdog
+        filename = os.path.join(get_cache_dir(), "tiles.json")
+        key = "{} {}x{}/{}x{}".format(
+            ",".join(d.name for d in self.device),
+            self.width, self.height, self.noise, self.samples)
+        tuned = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                tuned = json.load(f)
+        if key in tuned:
+            return tuned[key]
+
+        results = []
+        for tile_size in (0,) + candidates:
+            if tile_size >= max(self.width / self.noise, self.height):
+                continue
+            self.tile_size = tile_size
+            # some drivers compile the kernel again for new launch sizes
+            self.run()
+            self.get_result(True)
+            start = datetime.datetime.now()
+            self.run()
+            self.get_result(True)
+            total = (datetime.datetime.now() - start).total_seconds()
+            longest = max(
+                (event.profile.end - event.profile.start) * 1e-9
+                for _, event, _ in self.last_tiles)
+            print("Tile size {}: {:.4f}s, longest launch {:.4f}s".format(
+                tile_size or "full frame", total, longest))
+            results.append((longest > max_tile_time, total, tile_size))
+
+        tile_size = min(results)[2]
+        print("Tile size:", tile_size or "full frame")
+        tuned[key] = tile_size
+        with open(filename, "w") as f:
+            json.dump(tuned, f)
+
+        return tile_size
+
+    def update_objects(self):
+
+        # only changed objects are copied, into their slot of the buffer
+        buffers = {
+            "Camera": self.camera_d,
+            "Light": self.lights_d,
+            "Sphere": self.spheres_d}
+
+        # other devices may still be rendering the last frame from them
+        wait_for = None
+        if len(self.device) > 1:
+            wait_for = [event for _, event, _ in self.last_tiles] or None
+
+        dirty = self.scene.pop_dirty()
+        for obj in dirty:
+            obj_type = obj.__class__.__name__
+            if obj_type not in buffers:
+                raise ValueError(
+                    "{} can't be updated after setup".format(obj_type))
+            data = obj.get_cl_repr()
+            self.update_events.append(cl.enqueue_copy(
+                self.queue, buffers[obj_type], data,
+                dst_offset=obj.scene_index * data.itemsize,
+                wait_for=wait_for, is_blocking=False))
+
+        grids = []
+        if any(isinstance(obj, Light) for obj in dirty):
+            grid = self.get_light_grid()
+            grids += [("light_grid_d", grid.grid, LightGrid.grid_struct),
+                      ("light_cells_d", grid.cells, np.int32),
+                      ("light_indices_d", grid.indices, np.int32)]
+        if any(isinstance(obj, Sphere) for obj in dirty):
+            grid = self.get_sphere_grid()
+            grids += [("sphere_grid_d", grid.grid, SphereGrid.grid_struct),
+                      ("sphere_cells_d", grid.cells, np.int32),
+                      ("sphere_indices_d", grid.indices, np.int32)]
+        buffers = [getattr(self, name) for name, _, _ in grids]
+        for name, hostbuf, dtype in grids:
+            self.update_buffer(name, hostbuf, dtype, wait_for)
+
+        # a grown grid may no longer fit into __constant memory
+        if any(getattr(self, name) is not buf
+               for (name, _, _), buf in zip(grids, buffers)):
+            address_spaces = self.get_address_spaces()
+            if address_spaces != self.address_spaces:
+                self.address_spaces = address_spaces
+                self.build_kernels()
+            else:
+                self.kernel.set_args(*self.get_kernel_args())
+
+        return bool(dirty)
 
     def run(self, callback=None):
 
-        self.camera_d = cl.Buffer(
-            self.context,
-            cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR,
-            hostbuf=np.array(self.scene.get_objects("Camera")))
+        if len(self.pending) >= self.pipeline_depth:
+            raise RuntimeError("All result buffers are in use")
+
+        slot = self.frames % self.pipeline_depth
+        self.frames += 1
+
+        if self.update_objects():
+            self.accumulated = 0
+        accumulated = np.int32(-1)
+        if self.accumulate:
+            accumulated = np.int32(self.accumulated)
+            self.accumulated += 1
+
+        if self.wavefront:
+            self.event = self.run_wavefront(slot, accumulated)
+            tile = (0, 0, self.width, self.height)
+            tiles = [(tile, self.event,
+                      self.copy_tile(slot, tile, [self.event]))]
+            self.copy_queue.flush()
+        elif len(self.device) > 1:
+            tiles = self.run_bands(slot, accumulated)
+        else:
+            tiles = self.run_tiles(slot, accumulated)
+        self.update_events = []
+        copy_event = tiles[-1][2]
+        if len(self.device) > 1:
+            copy_event = cl.enqueue_marker(
+                self.copy_queue, wait_for=[event for _, _, event in tiles])
 
-        self.event = self.program.get_image(
-            self.queue,
-            (np.int32(self.width/self.noise), np.int32(self.height)),
-            None,
-            self.camera_d,
-            self.lights_d,
-            self.n_lights,
-            self.spheres_d,
-            self.n_spheres,
-            self.triangles_d,
-            self.n_triangles,
-            self.noise,
-            self.textures,
-            self.result_buf
-            )
+        self.pending.append((slot, tiles))
+        self.last_tiles = tiles
 
         if callback:
-            self.event.set_callback(
+            copy_event.set_callback(
                     cl.command_execution_status.COMPLETE,
                     callback)
 
-        self.queue.flush()
+    def run_tiles(self, slot, accumulated):
+
+        self.kernel.set_arg(self.accumulated_arg, accumulated)
+        self.kernel.set_arg(self.result_arg, self.result_bufs[slot])
+        tiles = []
+        for x, y, w, h in self.get_tiles(self.tile_size):
+            self.event = cl.enqueue_nd_range_kernel(
+                self.queue,
+                self.kernel,
+                (w, h),
+                None,
+                global_work_offset=(x, y))
+            # with noise a work-item may write up to noise - 1 columns
+            # past its tile, those are read back with it
+            noise = int(self.noise)
+            tile = (x * noise, y,
+                    min((w + 1) * noise - 1, self.width - x * noise), h)
+            copy_event = self.copy_tile(slot, tile, [self.event])
+            tiles.append((tile, self.event, copy_event))
+            # start the device on the first tiles right away
+            self.queue.flush()
+            self.copy_queue.flush()
+
+        return tiles
+
+    def measure_bands(self):
+
+        # rows per second of each device, from the frames that finished
+        while self.unmeasured:
+            bands = self.unmeasured[0]
+            if any(event.get_info(cl.event_info.COMMAND_EXECUTION_STATUS) !=
+                   cl.command_execution_status.COMPLETE
+                   for _, _, event in bands):
+                return
+            self.unmeasured.popleft()
+            throughput = self.throughput.copy()
+            for device, rows, event in bands:
+                seconds = (event.profile.end - event.profile.start) * 1e-9
+                throughput[device] = rows / max(seconds, 1e-6)
+            # smoothed, single frames are noisy
+            if self.measured:
+                throughput = 0.5 * (self.throughput + throughput)
+            self.throughput = throughput
+            self.measured = True
+
+    def get_bands(self):
+
+        # rows in proportion to the throughput; every device keeps at least
+        # one to stay measured, the rest go to the fastest
+        weights = self.throughput / self.throughput.sum()
+        rows = np.maximum(np.floor(weights * self.height).astype(int), 1)
+        rows[np.argmax(weights)] += self.height - rows.sum()
+
+        # the bands only move for a clearly faster frame, moving them
+        # restarts accumulation
+        if self.bands is not None:
+            current = np.array([r for _, r in self.bands])
+            if ((rows / self.throughput).max() >
+                    0.95 * (current / self.throughput).max()):
+                rows = current
+        starts = np.cumsum(rows) - rows
+        return [(int(y), int(r)) for y, r in zip(starts, rows)]
+
+    def run_bands(self, slot, accumulated):
+
+        # split-frame over several devices, a band of rows each
+        self.measure_bands()
+        bands = self.get_bands()
+        if bands != self.bands:
+            print("Rows per device:", " ".join(str(r) for _, r in bands))
+            # each device sums its own rows, ones that moved have no sums
+            if self.bands is not None and accumulated > 0:
+                accumulated = np.int32(0)
+                self.accumulated = 1
+            self.bands = bands
+
+        self.kernel.set_arg(self.accumulated_arg, accumulated)
+        # the scene updates were queued on the first device
+        wait_for = self.update_events or None
+        columns = int(self.width / self.noise)
+        tiles = []
+        timed = []
+        for device, (y, rows) in enumerate(bands):
+            if not rows:
+                continue
+            results, accumulation = self.device_bufs[device]
+            self.kernel.set_arg(self.accumulated_arg + 1, accumulation)
+            self.kernel.set_arg(self.result_arg, results[slot])
+            event = cl.enqueue_nd_range_kernel(
+                self.queues[device], self.kernel, (columns, rows), None,
+                global_work_offset=(0, y), wait_for=wait_for)
+            tile = (0, y, self.width, rows)
+            copy_event = self.copy_tile(slot, tile, [event], device)
+            tiles.append((tile, event, copy_event))
+            timed.append((device, rows, event))
+            self.queues[device].flush()
+            self.copy_queues[device].flush()
+
+        self.unmeasured.append(timed)
+        return tiles
+
+    def run_wavefront(self, slot, accumulated):
+
+        # one kernel per stage, the ray counts are read back between
+        # bounces to size the next launches
+        columns = int(self.width / self.noise)
+        counters = np.zeros(2, dtype=np.int32)
+        zero = np.int32(0)
+        cl.enqueue_fill_buffer(
+            self.queue, self.radiance_d, np.float32(0), 0,
+            self.radiance_d.size)
+        cl.enqueue_fill_buffer(
+            self.queue, self.counters_d, zero, 0, self.counters_d.size)
+
+        rays, next_rays = self.rays_d
+        self.generate(
+            self.queue, (columns, self.height), None,
+            self.camera_d, self.noise, np.int32(self.width),
+            np.int32(self.height), self.samples, accumulated, rays,
+            np.int32(self.ray_capacity), self.counters_d)
+
+        while True:
+            cl.enqueue_copy(self.queue, counters, self.counters_d)
+            n_rays = min(int(counters[0]), self.ray_capacity)
+            if not n_rays:
+                break
+            cl.enqueue_fill_buffer(self.queue, self.counters_d, zero, 0, 4)
+
+            self.intersect(
+                self.queue, (n_rays,), None,
+                self.camera_d, self.spheres_d, self.n_spheres,
+                self.sphere_grid_d, self.sphere_cells_d,
+                self.sphere_indices_d, self.triangles_d, self.n_triangles,
+                self.bvh_nodes_d, self.bvh_indices_d, rays)
+
+            # each ray may need a shadow ray per light, batches keep
+            # them within the shadow queue
+            batch = self.ray_capacity // max(self.max_cell_lights, 1)
+            for start in range(0, n_rays, batch):
+                cl.enqueue_fill_buffer(
+                    self.queue, self.counters_d, zero, 4, 4)
+                self.shade(
+                    self.queue, (min(batch, n_rays - start),),
+                    None,
+                    self.camera_d, np.int32(self.height),
+                    self.materials_d, self.lights_d, self.light_grid_d,
+                    self.light_cells_d, self.light_indices_d,
+                    self.spheres_d, self.triangles_d, self.textures,
+                    self.texture_records_d,
+                    rays, np.int32(start), next_rays,
+                    np.int32(self.ray_capacity), self.shadow_rays_d,
+                    self.counters_d, self.radiance_d)
+                cl.enqueue_copy(self.queue, counters, self.counters_d)
+                if counters[1]:
+                    self.shadow(
+                        self.queue, (int(counters[1]),), None,
+                        self.spheres_d, self.n_spheres,
+                        self.sphere_grid_d, self.sphere_cells_d,
+                        self.sphere_indices_d,
+                        self.triangles_d, self.n_triangles,
+                        self.bvh_nodes_d, self.bvh_indices_d,
+                        self.shadow_rays_d, self.radiance_d)
+
+            rays, next_rays = next_rays, rays
+
+        return self.finish(
+            self.queue, (columns, self.height), None,
+            self.noise, np.int32(self.width), np.int32(self.height),
+            self.samples, self.radiance_d, accumulated,
+            self.accumulation_buf, self.result_bufs[slot])
 
     def run_denoise(self, image, function_name):
 
@@ -1,4 +1,6 @@
+import datetime
 import json
+import os
 import pywavefront
 from src.objects.base import BaseObject
 
@@ -7,6 +9,9 @@ from src.objects.camera import Camera
 from src.objects.sphere import Sphere
 from src.objects.light import Light
 from src.objects.triangle import Triangle
+from src.objects.visible_object import VisibleObject
+from src.scene_cache import SceneCache
+from src.texture_atlas import TextureAtlas
 from PIL import Image
 
 import numpy as np
@@ -18,15 +23,47 @@ class Scene(object):
         self.background_color = background_color
         self.global_ambient = global_ambient
         self.objects = dict()
+        # already packed objects without a Python object each, e.g. meshes
+        # mapped from the scene cache
+        self.packed = dict()
         self.textures = None
+        self.texture_atlas = None
+        # where compressed textures are kept once encoded
+        self.scene_cache = None
+        self.materials = []
+        self.material_keys = dict()
+        self.material_ids = dict()
+        self.dirty_objects = set()
+
+    def add_material(self, material):
+
+        if id(material) not in self.material_ids:
+            # equal materials created separately (e.g. from json) share a slot
+            key = material._get_cl_repr().tobytes()
+            if key not in self.material_keys:
+                self.material_keys[key] = len(self.materials)
+                self.materials.append(material)
+            self.material_ids[id(material)] = self.material_keys[key]
+
+        return self.material_ids[id(material)]
 
     def add_object(self, obj):
 
+        if isinstance(obj, VisibleObject):
+            obj.material_index = self.add_material(obj.material)
+
         obj_type = obj.__class__.__name__
         if obj_type not in self.objects:
-            self.objects[obj_type] = [obj]
-        else:
-            self.objects[obj_type].append(obj)
+            self.objects[obj_type] = []
+        obj.scene_index = len(self.objects[obj_type])
+        obj.dirty_objects = self.dirty_objects
+        self.objects[obj_type].append(obj)
+
+    def pop_dirty(self):
+
+        dirty = list(self.dirty_objects)
+        self.dirty_objects.clear()
+        return dirty
 
     def get_objects(self, obj_type, cl_repr=True):
 
@@ -38,6 +75,47 @@ class Scene(object):
 
         return self.objects[obj_type]
 
+    def get_packed(self, obj_type):
+
+        arrays = list(self.packed.get(obj_type, []))
+        if obj_type in self.objects:
+            # objects go first, their scene_index is their slot
+            objects = self.objects[obj_type]
+            arrays.insert(0, BaseObject.subclasses[obj_type].pack(objects))
+
+        if not arrays:
+            return None
+        if len(arrays) == 1:
+            # a mapped cache goes to the device without a copy
+            return arrays[0]
+        return np.concatenate(arrays)
+
+    def add_packed(self, obj_type, array):
+
+        if obj_type not in self.packed:
+            self.packed[obj_type] = []
+        self.packed[obj_type].append(array)
+
+    def add_mesh(self, triangles, materials):
+
+        # triangles index into materials, which become scene materials
+        remap = np.array(
+                [self.add_material(material) for material in materials],
+                dtype=np.int32)
+        if len(triangles) and not np.array_equal(
+                remap, np.arange(len(remap))):
+            # copies a mapped buffer, only when the scene already had
+            # other materials
+            triangles = np.array(triangles)
+            triangles["material"] = remap[triangles["material"]]
+        self.add_packed("Triangle", triangles)
+
+    def get_packed_materials(self):
+
+        return np.array(
+                [material._get_cl_repr() for material in self.materials],
+                dtype=Material.material_struct)
+
     def load_from_json(self, filename):
 
         with open(filename) as f:
@@ -48,46 +126,6 @@ class Scene(object):
                 obj = BaseObject.create(k, obj)
                 self.add_object(obj)
 
-    def triangle_gen(
-            self, vertices, vertices_format, material, width=0, height=0):
-        formats = vertices_format.split("_")
-
-        print(width, height)
-        normals = []
-        tri_vertices = []
-        texture_coord = []
-
-        i = 0
-        for el in formats:
-            i += int(el[1])
-
-        for x in zip(*[iter(vertices)] * i * 3):
-            x = list(x)
-            while x:
-                for el in formats:
-                    if el == "T2F":
-                        texture_coord.append(
-                                np.array([x[0], 1 - x[1], width, height]))
-                        x = x[2:]
-                    elif el == "C3F":
-                        x = x[3:]
-                    elif el == "N3F":
-                        normals.append(np.array(x[:3]))
-                        x = x[3:]
-                    else:
-                        tri_vertices.append(np.array(x[:3]))
-                        x = x[3:]
-
-            yield Triangle(
-                    material,
-                    tri_vertices,
-                    normals,
-                    texture_coord)
-
-            normals = []
-            tri_vertices = []
-            texture_coord = []
-
     def load_image(self, filename):
 
         img = Image.open(filename)
@@ -96,7 +134,55 @@ class Scene(object):
 
         return data
 
-    def load_from_mesh(self, filename):
+    def get_packed_textures(self):
+
+        # TextureAtlas of all textures, records in texture index order
+        if self.texture_atlas is not None:
+            return self.texture_atlas
+
+        images = []
+        if self.textures:
+            textures = {v: k for k, v in self.textures.items()}
+            for i in sorted(textures.keys()):
+                path = textures[i]
+                if path is None:
+                    continue
+                image = self.load_image(path)
+                if len(image.shape) == 2:
+                    image = np.repeat(image[:, :, np.newaxis], 3, axis=2)
+                images.append(image)
+
+        if len(images) == 0:
+            images = [np.zeros((128, 128, 3), dtype=np.uint8)]
+
+        self.texture_atlas = TextureAtlas.from_images(images)
+        return self.texture_atlas
+
+    def get_compressed_textures(self):
+
+        # the atlas with its blocks, encoded once per cached scene
+        atlas = self.get_packed_textures()
+        if atlas.blocks is None:
+            start = datetime.datetime.now()
+            atlas.compress()
+            print("Textures compressed in {:.2f} s".format(
+                (datetime.datetime.now() - start).total_seconds()))
+            if self.scene_cache:
+                self.scene_cache.save_blocks(atlas.blocks)
+        return atlas
+
+    def load_from_mesh(self, filename, use_cache=True):
+
+        cache = SceneCache(filename) if use_cache else None
+        cached = cache.load() if cache else None
+        self.scene_cache = cache
+        if cached:
+            triangles, materials, self.textures, self.texture_atlas = cached
+            self.add_mesh(
+                    triangles, [Material(**args) for args in materials])
+            print("Triangles:", len(triangles))
+            print("Scene loaded from", cache.path)
+            return
 
         textures = {None: (-1, 0, 0)}
         texture_num = 0
@@ -117,6 +203,8 @@ class Scene(object):
 
         scene = pywavefront.Wavefront(filename, collect_faces=True,
                                       create_materials=True)
+        materials = []
+        triangles = []
         for name, material in scene.materials.items():
             diff_texture = load_texture(material.texture)
             ambi_texture = load_texture(material.texture_ambient)
@@ -152,13 +240,24 @@ class Scene(object):
                     texture_specular_color=spec_texture,
                     texture_bump=bump_texture)
 
-            for triangle in self.triangle_gen(
-                    material.vertices,
-                    material.vertex_format,
-                    mat, diff_texture[1], diff_texture[2]):
-                self.add_object(triangle)
-                num_triangles += 1
+            triangles.append(Triangle.pack_vertices(
+                    material.vertices, material.vertex_format,
+                    len(materials)))
+            num_triangles += len(triangles[-1])
+            materials.append(mat)
+            # pywavefront's float list is the largest thing left around
+            material.vertices = []
 
+        triangles = np.concatenate(
+                triangles or [np.zeros(0, dtype=Triangle.triangle_struct)])
         self.textures = textures
+        self.texture_atlas = None
+        if cache:
+            directory = os.path.dirname(filename)
+            files = [os.path.join(directory, name) for name in scene.mtllibs]
+            cache.save(triangles, materials, textures,
+                       self.get_packed_textures(), files + [
+                           path for path in textures if path])
+        self.add_mesh(triangles, materials)
         print("Triangles:", num_triangles)
         print("Scene loaded!")
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from src.cache import get_cache_dir
+from src.texture_atlas import TextureAtlas
+
+
+class SceneCache(object):
+
+    # bump when the layout of the cached buffers changes
+    version = 4
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.path = get_cache_dir("scenes", self.get_key(filename))
+
+    @classmethod
+    def get_key(cls, filename):
+
+        # contents and mtime of the OBJ, the files it pulls in are
+        # checked against the mtimes stored with the entry
+        digest = hashlib.sha1("{} {}".format(
+            cls.version, os.path.getmtime(filename)).encode())
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(2**20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get_file(self, name):
+        return os.path.join(self.path, name)
+
+    @staticmethod
+    def load_array(filename):
+
+        # numpy can't map an empty file
+        array = np.load(filename, mmap_mode="r")
+        return array if len(array) else np.load(filename)
+
+    def load(self):
+
+        # (triangles, material args, textures, texture atlas) or None
+        if not os.path.exists(self.get_file("scene.json")):
+            return None
+        with open(self.get_file("scene.json")) as f:
+            meta = json.load(f)
+        for path, mtime in meta["files"]:
+            if not os.path.exists(path) or os.path.getmtime(path) != mtime:
+                return None
+
+        textures = {None: (-1, 0, 0)}
+        for path, index, width, height in meta["textures"]:
+            textures[path] = (index, width, height)
+        atlas = None
+        if meta["atlas"]:
+            blocks = None
+            # only there once the textures were used compressed
+            if os.path.exists(self.get_file("texture_blocks.npy")):
+                blocks = self.load_array(self.get_file("texture_blocks.npy"))
+            atlas = TextureAtlas(
+                self.load_array(self.get_file("textures.npy")),
+                np.load(self.get_file("texture_records.npy")), blocks)
+        return (self.load_array(self.get_file("triangles.npy")),
+                meta["materials"], textures, atlas)
+
+    def save(self, triangles, materials, textures, atlas, files):
+
+        np.save(self.get_file("triangles.npy"), triangles)
+        if atlas is not None:
+            np.save(self.get_file("textures.npy"), atlas.image)
+            np.save(self.get_file("texture_records.npy"), atlas.records)
+        if atlas is not None and atlas.blocks is not None:
+            self.save_blocks(atlas.blocks)
+        elif os.path.exists(self.get_file("texture_blocks.npy")):
+            os.remove(self.get_file("texture_blocks.npy"))
+
+        files = [path for path in files if os.path.exists(path)]
+        meta = {
+            "files": [[path, os.path.getmtime(path)] for path in files],
+            "materials": [material.get_args() for material in materials],
+            "textures": [[path] + list(value)
+                         for path, value in textures.items() if path],
+            "atlas": atlas is not None}
+        # written last, an entry without it is ignored
+        with open(self.get_file("scene.json"), "w") as f:
+            json.dump(meta, f)
+
+    def save_blocks(self, blocks):
+        np.save(self.get_file("texture_blocks.npy"), blocks)
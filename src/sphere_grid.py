@@ -0,0 +1,118 @@
+import numpy as np
+import pyopencl as cl
+import pyopencl.cltypes  # noqa: F401
+
+
+class SphereGrid(object):
+
+    # resolution.w is the index of the extra cell used outside the grid,
+    # it holds the spheres without a radius, which are also in every cell
+    grid_struct = np.dtype(
+        [("bounds_min", cl.cltypes.float3),
+         ("inv_cell_size", cl.cltypes.float3),
+         ("resolution", cl.cltypes.int4)])
+
+    def __init__(self, centers, radii, per_cell=1, max_resolution=128):
+        self.centers = np.asarray(centers, dtype=np.float32).reshape(-1, 3)
+        self.radii = np.asarray(radii, dtype=np.float32).reshape(-1)
+        self.per_cell = per_cell
+        self.max_resolution = max_resolution
+        self.grid = np.zeros(1, dtype=self.grid_struct)
+        self.cells = None
+        self.indices = None
+        self.build()
+
+    @classmethod
+    def from_spheres(cls, spheres, **kwargs):
+
+        return cls([sphere.center for sphere in spheres],
+                   [sphere.radius for sphere in spheres], **kwargs)
+
+    @property
+    def max_count(self):
+        return int(self.cells[:, 1].max())
+
+    def get_resolution(self, extent, n_spheres):
+
+        # roughly cubic cells, a few spheres in each
+        n_cells = max(n_spheres / self.per_cell, 1)
+        cell_size = (np.prod(extent) / n_cells) ** (1 / 3)
+        resolution = np.ceil(extent / cell_size).astype(np.int32)
+        return np.clip(resolution, 1, self.max_resolution)
+
+    def get_overlaps(self, centers, radii, bounds_min, cell_size,
+                     resolution):
+
+        # (sphere, cell) pairs for every cell of a sphere's bounding box
+        # that the sphere touches, all spheres at once
+        inv_cell_size = 1 / cell_size
+        first = np.clip(
+            ((centers - radii[:, np.newaxis] - bounds_min) * inv_cell_size)
+            .astype(np.int32), 0, resolution - 1)
+        last = np.clip(
+            ((centers + radii[:, np.newaxis] - bounds_min) * inv_cell_size)
+            .astype(np.int32), 0, resolution - 1)
+        span = last - first + 1
+        counts = span.prod(axis=1)
+
+        sphere = np.repeat(np.arange(len(centers)), counts)
+        offset = np.arange(len(sphere)) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        span = span[sphere]
+        cell = first[sphere] + np.stack(
+            [offset % span[:, 0],
+             offset // span[:, 0] % span[:, 1],
+             offset // (span[:, 0] * span[:, 1])], axis=1)
+
+        box_min = bounds_min + cell * cell_size
+        closest = np.clip(centers[sphere], box_min, box_min + cell_size)
+        inside = (((closest - centers[sphere]) ** 2).sum(1) <=
+                  radii[sphere] ** 2)
+        return sphere[inside], cell[inside]
+
+    def build(self):
+
+        bounded = np.flatnonzero(self.radii > 0)
+        unbounded = np.flatnonzero(self.radii <= 0)
+        resolution = np.zeros(3, dtype=np.int32)
+        bounds_min = np.zeros(3, dtype=np.float32)
+        inv_cell_size = np.zeros(3, dtype=np.float32)
+        cell_ids = [np.zeros(0, dtype=np.int64)]
+        sphere_ids = [np.zeros(0, dtype=np.int64)]
+
+        if len(bounded):
+            centers = self.centers[bounded]
+            radii = self.radii[bounded]
+            bounds_min = (centers - radii[:, np.newaxis]).min(axis=0)
+            extent = (centers + radii[:, np.newaxis]).max(axis=0) - bounds_min
+            resolution = self.get_resolution(extent, len(bounded))
+            inv_cell_size = resolution / extent
+
+            sphere, cell = self.get_overlaps(
+                centers, radii, bounds_min, extent / resolution, resolution)
+            cell_ids.append(
+                (cell[:, 2] * resolution[1] + cell[:, 1]) *
+                resolution[0] + cell[:, 0])
+            sphere_ids.append(bounded[sphere])
+
+        n_cells = int(np.prod(resolution)) if len(bounded) else 0
+        for sphere in unbounded:
+            cell_ids.append(np.arange(n_cells + 1))
+            sphere_ids.append(np.full(n_cells + 1, sphere))
+
+        cell_ids = np.concatenate(cell_ids)
+        sphere_ids = np.concatenate(sphere_ids)
+        # spheres keep their scene order inside a cell
+        order = np.lexsort((sphere_ids, cell_ids))
+        counts = np.bincount(cell_ids, minlength=n_cells + 1)
+        self.cells = np.stack(
+            [np.cumsum(counts) - counts, counts], axis=1).astype(np.int32)
+        self.indices = sphere_ids[order].astype(np.int32)
+
+        for field, value in [("bounds_min", bounds_min),
+                             ("inv_cell_size", inv_cell_size)]:
+            for axis, name in enumerate("xyz"):
+                self.grid[field][name] = value[axis]
+        for axis, name in enumerate("xyzw"):
+            self.grid["resolution"][name] = (
+                list(resolution) + [n_cells])[axis]
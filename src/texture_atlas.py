@@ -0,0 +1,116 @@
+import numpy as np
+import pyopencl as cl
+import pyopencl.cltypes  # noqa: F401
+
+from src.texture_compression import BLOCK, encode_bc1
+
+
+class TextureAtlas(object):
+
+    # where a texture sits in the atlas, in pixels, uv * scale + offset.
+    # Textures come first, in texture index order, with the number of
+    # their mip levels and the record of level 1; the records of smaller
+    # levels follow it and have no levels of their own.
+    record_struct = np.dtype(
+        [("offset", cl.cltypes.float2),
+         ("scale", cl.cltypes.float2),
+         ("levels", np.int32),
+         ("mips", np.int32)])
+
+    def __init__(self, image, records, blocks=None):
+        # (height, width, 4) uint8 and the records
+        self.image = image
+        self.records = records
+        # the image block compressed, see compress()
+        self.blocks = blocks
+
+    @staticmethod
+    def get_mip_chain(image):
+
+        # 2x2 box filter down to a single pixel, odd sizes wrap around
+        # like the texture does when sampled
+        levels = [image]
+        level = image.astype(np.float32)
+        while max(level.shape[:2]) > 1:
+            height, width, channels = level.shape
+            level = np.pad(
+                level, ((0, height % 2), (0, width % 2), (0, 0)), "wrap")
+            level = level.reshape(
+                (height + 1) // 2, 2, (width + 1) // 2, 2, channels).mean(
+                    axis=(1, 3))
+            levels.append(np.round(level).astype(np.uint8))
+        return levels
+
+    @classmethod
+    def from_images(cls, images, border=1, max_width=16384, mipmaps=True,
+                    block=BLOCK):
+
+        chains = [
+            cls.get_mip_chain(image) if mipmaps else [image]
+            for image in images]
+        # level 0 of every texture first, then the smaller levels
+        images = [chain[0] for chain in chains]
+        mips = []
+        for chain in chains:
+            mips.append(len(images))
+            images.extend(chain[1:])
+
+        # shelf packing, tallest first; each texture is surrounded by
+        # border pixels of itself, wrapped, so linear filtering at its
+        # edges repeats it like a separate image would. The wrapping goes
+        # on to whole compression blocks, so that no block mixes textures
+        sizes = [image.shape[1::-1] for image in images]
+        images = [
+            np.pad(image, ((border, border + -(h + 2 * border) % block),
+                           (border, border + -(w + 2 * border) % block),
+                           (0, 4 - image.shape[2])), "wrap")
+            for image, (w, h) in zip(images, sizes)]
+        area = sum(image.shape[0] * image.shape[1] for image in images)
+        width = min(max(max(image.shape[1] for image in images),
+                        -(-int(np.ceil(np.sqrt(area))) // block) * block),
+                    max_width)
+
+        order = sorted(range(len(images)), key=lambda i: -images[i].shape[0])
+        positions = [None] * len(images)
+        x = y = shelf = 0
+        for i in order:
+            height, w = images[i].shape[:2]
+            if x + w > width:
+                x, y, shelf = 0, y + shelf, 0
+            positions[i] = (x, y)
+            x += w
+            shelf = max(shelf, height)
+
+        atlas = np.zeros((y + shelf, width, 4), dtype=np.uint8)
+        records = np.zeros(len(images), dtype=cls.record_struct)
+        for i, (image, (x, y)) in enumerate(zip(images, positions)):
+            height, w = image.shape[:2]
+            atlas[y:y + height, x:x + w] = image
+            for field, value in [
+                    ("offset", (x + border, y + border)),
+                    ("scale", sizes[i])]:
+                records[field]["x"][i], records[field]["y"][i] = value
+        for i, chain in enumerate(chains):
+            records["levels"][i] = len(chain)
+            records["mips"][i] = mips[i]
+
+        return cls(atlas, records)
+
+    def compress(self):
+        self.blocks = encode_bc1(self.image)
+        return self.blocks
+
+    @property
+    def size(self):
+        return self.image.nbytes
+
+    @property
+    def compressed_size(self):
+        return self.blocks.nbytes
+
+    @property
+    def array_size(self):
+        # what the same textures take padded to the largest one each,
+        # without mip levels
+        scale = self.records["scale"][self.records["levels"] > 0]
+        return int(len(scale) * scale["x"].max() * scale["y"].max() * 4)
@@ -0,0 +1,141 @@
+import numpy as np
+
+
+# BC1 without alpha: every 4x4 block is two RGB565 colors and a 2 bit index
+# per pixel choosing one of them or a third or two thirds of the way between,
+# 8 bytes instead of the 64 of RGBA8
+BLOCK = 4
+SCALE = np.array([31, 63, 31], dtype=np.float32)
+WEIGHTS = np.array([0, 1, 1 / 3, 2 / 3], dtype=np.float32)
+
+
+def get_blocks(image):
+
+    # (blocks, 16, 3) float32, sizes not divisible by 4 repeat the edge
+    height, width = image.shape[:2]
+    pixels = np.pad(
+        image[..., :3], ((0, -height % BLOCK), (0, -width % BLOCK), (0, 0)),
+        "edge")
+    rows, columns = pixels.shape[0] // BLOCK, pixels.shape[1] // BLOCK
+    return pixels.reshape(rows, BLOCK, columns, BLOCK, 3).transpose(
+        0, 2, 1, 3, 4).reshape(-1, BLOCK * BLOCK, 3).astype(np.float32)
+
+
+def unpack_colors(colors):
+
+    # RGB565 to 0..1 floats, the same as the kernel does
+    channels = np.stack(
+        [(colors >> 11) & 31, (colors >> 5) & 63, colors & 31], axis=-1)
+    return channels.astype(np.float32) / SCALE
+
+
+def quantize(colors):
+
+    colors = np.round(np.clip(colors, 0, 255) * SCALE / 255).astype(np.uint32)
+    return colors[:, 0] << 11 | colors[:, 1] << 5 | colors[:, 2]
+
+
+def get_indices(pixels, first, second):
+
+    # the nearest of the four colors of every block, (blocks, 16)
+    a, b = unpack_colors(first) * 255, unpack_colors(second) * 255
+    palette = a[:, np.newaxis] + (b - a)[:, np.newaxis] * \
+        WEIGHTS[np.newaxis, :, np.newaxis]
+    distance = ((pixels[:, :, np.newaxis] - palette[:, np.newaxis]) ** 2).sum(
+        axis=-1)
+    indices = distance.argmin(axis=-1)
+    error = np.take_along_axis(distance, indices[..., np.newaxis], -1).sum(
+        axis=(1, 2))
+    return indices, error
+
+
+def get_endpoints(pixels, indices):
+
+    # least squares colors for the chosen indices, not valid where every
+    # pixel got the same weight
+    weights = WEIGHTS[indices]
+    a, b = 1 - weights, weights
+    aa, ab, bb = (a * a).sum(1), (a * b).sum(1), (b * b).sum(1)
+    ap = np.einsum("ni,nij->nj", a, pixels)
+    bp = np.einsum("ni,nij->nj", b, pixels)
+    det = (aa * bb - ab * ab)[:, np.newaxis]
+    valid = np.abs(det[:, 0]) > 1e-6
+    det[~valid] = 1
+    return (bb[:, None] * ap - ab[:, None] * bp) / det, \
+        (aa[:, None] * bp - ab[:, None] * ap) / det, valid
+
+
+def order(first, second):
+
+    # the first color is the larger one, otherwise decoders expect the
+    # three color mode with transparent black
+    return np.maximum(first, second), np.minimum(first, second)
+
+
+def encode_blocks(pixels, iterations=4, refinements=1):
+
+    # endpoints on the principal axis of each block's colors
+    mean = pixels.mean(axis=1, keepdims=True)
+    centered = pixels - mean
+    covariance = np.einsum("nij,nik->njk", centered, centered)
+    axis = pixels.max(axis=1) - pixels.min(axis=1)
+    for _ in range(iterations):
+        axis = np.einsum("njk,nk->nj", covariance, axis)
+        length = np.linalg.norm(axis, axis=1, keepdims=True)
+        axis = np.divide(axis, length, out=np.zeros_like(axis),
+                         where=length > 0)
+    projection = np.einsum("nij,nj->ni", centered, axis)
+    first, second = order(
+        quantize(mean[:, 0] + axis * projection.max(axis=1, keepdims=True)),
+        quantize(mean[:, 0] + axis * projection.min(axis=1, keepdims=True)))
+    indices, error = get_indices(pixels, first, second)
+
+    # refit the colors to the pixels that chose them, kept where better
+    for _ in range(refinements):
+        a, b, valid = get_endpoints(pixels, indices)
+        refined = order(quantize(a), quantize(b))
+        refined_indices, refined_error = get_indices(pixels, *refined)
+        better = valid & (refined_error < error)
+        first = np.where(better, refined[0], first)
+        second = np.where(better, refined[1], second)
+        indices = np.where(better[:, np.newaxis], refined_indices, indices)
+        error = np.where(better, refined_error, error)
+
+    shifts = np.arange(BLOCK * BLOCK, dtype=np.uint32) * 2
+    indices = np.bitwise_or.reduce(
+        indices.astype(np.uint32) << shifts, axis=1)
+    return np.stack([first | second << 16, indices], axis=1)
+
+
+def encode_bc1(image, chunk=2**16):
+
+    # (height, width, channels) uint8 to (blocks, 2) uint32 in row major
+    # block order, alpha is dropped
+    pixels = get_blocks(image)
+    return np.concatenate(
+        [encode_blocks(pixels[i:i + chunk])
+         for i in range(0, len(pixels), chunk)] or
+        [np.zeros((0, 2), dtype=np.uint32)])
+
+
+def decode_bc1(blocks, width, height):
+
+    # back to (height, width, 3) uint8
+    colors = blocks[:, 0]
+    a, b = unpack_colors(colors & 0xffff), unpack_colors(colors >> 16)
+    shifts = np.arange(BLOCK * BLOCK, dtype=np.uint32) * 2
+    indices = (blocks[:, 1, np.newaxis] >> shifts) & 3
+    weights = WEIGHTS[indices][..., np.newaxis]
+    pixels = a[:, np.newaxis] + (b - a)[:, np.newaxis] * weights
+
+    rows, columns = -(-height // BLOCK), -(-width // BLOCK)
+    image = pixels.reshape(rows, columns, BLOCK, BLOCK, 3).transpose(
+        0, 2, 1, 3, 4).reshape(rows * BLOCK, columns * BLOCK, 3)
+    return np.round(image[:height, :width] * 255).astype(np.uint8)
+
+
+def get_psnr(image, reference):
+
+    error = np.mean((image.astype(np.float64) -
+                     reference.astype(np.float64)) ** 2)
+    return np.inf if error == 0 else 10 * np.log10(255 ** 2 / error)
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from src.material import Material
+from src.objects.camera import Camera
+from src.objects.light import Light
+from src.objects.sphere import Sphere
+from src.objects.triangle import Triangle
+from src.scene import Scene
+
+
+# binary fractions survive float32 exactly, also after 1 - v
+def get_values(random, *shape):
+    return random.randint(-64, 64, shape) / 8
+
+
+def get_scene(objects):
+
+    scene = Scene(None, None)
+    for obj in objects:
+        scene.add_object(obj)
+    return scene
+
+
+def get_materials(random):
+    return [Material(*get_values(random, 3, 3).tolist()) for _ in range(3)]
+
+
+def get_triangles(random, textured):
+
+    materials = get_materials(random)
+    triangles = []
+    for i in range(20):
+        texture_coord = None
+        if textured:
+            texture_coord = list(get_values(random, 3, 2))
+        triangles.append(Triangle(
+            materials[i % len(materials)], list(get_values(random, 3, 3)),
+            list(get_values(random, 3, 3)), texture_coord))
+    return triangles
+
+
+def assert_packed_like_objects(scene, obj_type):
+
+    packed = scene.get_packed(obj_type)
+    objects = np.array(scene.get_objects(obj_type))
+    assert packed.dtype == objects.dtype
+    assert packed.tobytes() == objects.tobytes()
+
+
+def test_cameras():
+
+    random = np.random.RandomState(0)
+    scene = get_scene([
+        Camera(320, 240, get_values(random, 3), [0, -1, -1], z_far=50),
+        Camera(100, 300, get_values(random, 3), [1, 0, 0])])
+    assert_packed_like_objects(scene, "Camera")
+
+
+def test_lights():
+
+    random = np.random.RandomState(1)
+    scene = get_scene([
+        Light(*get_values(random, 4, 3).tolist(), radius=radius)
+        for radius in [0, 2.5, 10]])
+    assert_packed_like_objects(scene, "Light")
+
+
+def test_spheres():
+
+    random = np.random.RandomState(2)
+    materials = get_materials(random)
+    scene = get_scene([
+        Sphere(materials[i % len(materials)], get_values(random, 3).tolist(),
+               i / 4 + 0.5)
+        for i in range(20)])
+    assert_packed_like_objects(scene, "Sphere")
+
+
+@pytest.mark.parametrize("textured", [False, True])
+def test_triangles(textured):
+
+    random = np.random.RandomState(3)
+    scene = get_scene(get_triangles(random, textured))
+    assert_packed_like_objects(scene, "Triangle")
+
+
+@pytest.mark.parametrize("vertex_format", ["T2F_N3F_V3F", "N3F_V3F"])
+def test_pack_vertices(vertex_format):
+
+    random = np.random.RandomState(4)
+    material = Material()
+    faces = get_values(random, 10, 3, 8)
+    if vertex_format == "N3F_V3F":
+        faces = faces[..., 2:]
+    packed = Triangle.pack_vertices(faces, vertex_format, 0)
+
+    # the same faces as objects, pywavefront data has v flipped
+    objects = []
+    for face in faces:
+        texture_coord = None
+        if vertex_format == "T2F_N3F_V3F":
+            texture_coord = [[u, 1 - v] for u, v in face[:, :2]]
+        objects.append(Triangle(
+            material, list(face[:, -3:]), list(face[:, -6:-3]), texture_coord))
+    scene = get_scene(objects)
+
+    assert packed.tobytes() == np.array(
+        scene.get_objects("Triangle")).tobytes()
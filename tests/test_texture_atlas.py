@@ -0,0 +1,48 @@
+import numpy as np
+
+from src.texture_atlas import TextureAtlas
+from src.texture_compression import BLOCK, decode_bc1
+
+
+def get_atlas():
+
+    random = np.random.RandomState(0)
+    images = [
+        np.tile(np.uint8([255, 0, 0]), (32, 32, 1)),
+        np.tile(np.uint8([0, 255, 255]), (17, 9, 1)),
+        random.randint(0, 256, (33, 50, 3)).astype(np.uint8)]
+    atlas = TextureAtlas.from_images(images)
+    atlas.compress()
+    return atlas
+
+
+def get_area(record):
+
+    x, y = int(record["offset"]["x"]), int(record["offset"]["y"])
+    w, h = int(record["scale"]["x"]), int(record["scale"]["y"])
+    return np.s_[y:y + h, x:x + w]
+
+
+def test_entries_on_whole_blocks():
+
+    atlas = get_atlas()
+    height, width, _ = atlas.image.shape
+    assert height % BLOCK == 0 and width % BLOCK == 0
+    # the border of one texel comes first
+    assert np.all((atlas.records["offset"]["x"] - 1) % BLOCK == 0)
+    assert np.all((atlas.records["offset"]["y"] - 1) % BLOCK == 0)
+
+
+def test_solid_textures_lossless():
+
+    # every level of a solid texture, also mip levels smaller than a block
+    atlas = get_atlas()
+    height, width, _ = atlas.image.shape
+    decoded = decode_bc1(atlas.blocks, width, height)
+    for i in [0, 1]:
+        record = atlas.records[i]
+        levels = [record] + list(atlas.records[
+            record["mips"]:record["mips"] + record["levels"] - 1])
+        for level in levels:
+            area = get_area(level)
+            assert np.array_equal(decoded[area], atlas.image[area][..., :3])